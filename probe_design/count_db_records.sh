@@ -1,2 +1,7 @@
 WORKDIR=${1:-results}
+ALLDB=${WORKDIR}/all_bins_targeted_probe_cluster.db
+if [ -f "${ALLDB}" ]; then
+  echo "__${ALLDB}__"; litecli $ALLDB -te "select s.bin_id, s.recs as probes_seq_info, coalesce(f.recs, 0) as probes_filtered, coalesce(f.musicc, 0) as filtered_musicc from (select bin_id, count(*) as recs from probes_seq_info group by bin_id) s left join (select bin_id, count(*) as recs, sum(is_musicc) as musicc from probes_filtered group by bin_id) f using (bin_id);"
+  exit
+fi
 for DB in ${WORKDIR}/*.db; do echo "__${DB}__"; litecli $DB -te "select (select count(*) from probes_seq_info) as probes_seq_info, (select count(*) from probes_filtered) as probes_filtered, (select count(*) from probes_filtered where is_musicc=1) as filtered_musicc;"; done
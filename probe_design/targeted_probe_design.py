@@ -11,6 +11,11 @@ import os
 import re
 import shutil
 import random
+import importlib.util
+import itertools
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from functools import partial
 
 # Config options:
 import tomlkit
@@ -18,23 +23,35 @@ import tomlkit
 # pipeline-app modules
 from tprobe import (
     log,
+    log_channel_group,
     config,
     CONFIG, DB_CFG,
     read_config_file,
     SqliteIO as Sdb,
     AbsPath as APath,
+    PipelineManifest,
+    AnnotationClassifier,
+    ProbeIndex,
 )
+from tprobe.tiling import tile_probes
+from tprobe.kmer import KmerIndex, KMER_FIELDS, kmer_match_probes
+from tprobe.probeindex import write_unique_queries, fan_out_blasts
 from tprobe.utils import (
     run_cmd,
+    iter_cmd_lines,
     read_fasta,
-    pct_gc,
-    replace_spaces,
+    pct_gc_batch,
     sed_inplace,
+    transform_fasta,
     concatenate_files,
+    cat_files,
     tidy_up_files,
     gzip_compress,
-    write_out_csv,
+    iter_write_csv,
+    iter_write_arrow,
     write_out_file,
+    reservoir_sample,
+    spool_rows,
 )
 
 try:
@@ -117,36 +134,90 @@ def check_options():
     except Exception as e:
         raise e
 
+    # Output format checks:
+    try:
+        log.info('Checking blast matches output formats.')
+        hits_formats = CONFIG.get('blastn').get('hits_formats', ['csv'])
+        unknown = [ fmt for fmt in hits_formats if fmt not in ('csv', 'parquet', 'arrow') ]
+        assert not unknown, f'Unknown [blastn] hits_formats: {unknown}'
+        if set(hits_formats) & {'parquet', 'arrow'}:
+            assert importlib.util.find_spec('pyarrow'), \
+                'Module "pyarrow" is required for [blastn] hits_formats parquet or arrow!'
+
+        engine = CONFIG.get('blastn').get('engine', 'blastn')
+        assert engine in ('blastn', 'kmer'), f'Unknown [blastn] engine: "{engine}"'
+        if engine == 'kmer':
+            log.info('Checking k-mer engine options.')
+            assert importlib.util.find_spec('numpy'), \
+                'Module "numpy" is required for [blastn] engine kmer!'
+            assert float(CONFIG.get('filters').get('pct_identity')) == 100, \
+                '[blastn] engine kmer finds only exact matches: [filters] pct_identity must be 100!'
+            unknown = [ f for f in CONFIG.get('blastn').get('fields') if f not in KMER_FIELDS ]
+            assert not unknown, f'[blastn] fields not given by engine kmer: {unknown}'
+    except AssertionError as e:
+        log.error(e)
+        sys.exit(1)
+
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Prep BlastDB for Prokka Annotations ~~~~~
-def get_metagenome_cluster_prokka(prokka_dir=None, dest_dir=None, suffix='ffn'):
-    """copy all cluster 'ffn' files from remote directory.
-    Then prepend file name on froent of header lines,
-    and replace all spaces in lines with underscores '_'
+def copy_prokka_ffn(ffn, dest_dir=None, dest_fh=None):
+    """copy cluster 'ffn' file into dest_dir, in a single pass prepending file
+    name on front of header lines, and replacing all spaces with underscores '_'.
+    Return the copied file; or if 'dest_fh' (open binary file), write it
+    there instead, as it is read, and return None.
+    """
+    log.info(f'Copying {ffn.name}, prepending "{ffn.stem}" into sequence headers')
+    if dest_fh is not None:
+        transform_fasta(ffn, dest_fh, header_prefix=f'{ffn.stem}_', space_repl='_')
+        return None
+    dst_fn = dest_dir / ffn.name
+    with open(dst_fn, 'wb') as dst_fh:
+        transform_fasta(ffn, dst_fh, header_prefix=f'{ffn.stem}_', space_repl='_')
+    return dst_fn
+
+
+def get_metagenome_cluster_prokka(prokka_dir=None, dest_dir=None, suffix='ffn',
+                                  concat_file=None, threads=None):
+    """copy all cluster 'ffn' files from remote directory (see 'copy_prokka_ffn'),
+    on a pool of 'threads' each copying one file at a time.
+    If 'concat_file', stream them all straight into it instead, one after
+    another in name order, skipping the per-file copies ('threads' unused).
+    Return list of copied files (empty if 'concat_file').
     Note: *_dir args should be 'APath' instances
     """
     #TODO: ensure all files named after their cluster (w/o _,-..?) !!
     srce_dir = prokka_dir or APath(CONFIG.get('paths').get('prokka_dir'))
     dest_dir = dest_dir or APath(CONFIG.get('paths').get('working_dir'))
-    log.info('Copying and processing Prokka ffn files '
-             'from {srce_dir} into {dest_dir}')
-    dest_files = []
-    assert next(srce_dir.glob('*'+suffix)), f'No matching files in the dir "{srce_dir.abspath}"'
-    for ffn in srce_dir.glob('*'+suffix):
-        log.info(f'Copying {ffn.name}')
-        try:
-            dst_fn = dest_dir / ffn.name
-            dest_files.append(shutil.copyfile(ffn, dst_fn))
-            log.info(f'Prepending "{ffn.stem}" into sequence headers')
-            sed_inplace(dst_fn, r'^>', f'>{ffn.stem}_')
-            replace_spaces(dst_fn, '_')
-        except IOError as e:
-            log.error(f'IOError, copying "{e.filename}" to "{e.filename2}": {e}')
-            raise e
-        except Exception as e:
-            log.error(f'Error: {e}')
-            raise e
-    return dest_files
+    threads = max(int(threads or CONFIG.get('general').get('prokka_ingest_threads', 1)), 1)
+    ffns = sorted(srce_dir.glob('*'+suffix))
+    assert ffns, f'No matching files in the dir "{srce_dir.abspath}"'
+    try:
+        if concat_file:
+            log.info(f'Processing Prokka ffn files from {srce_dir} into {concat_file}')
+            with open(concat_file, 'wb') as concat_fh:
+                for ffn in ffns:
+                    copy_prokka_ffn(ffn, dest_fh=concat_fh)
+            return []
+
+        with ThreadPool(threads) as pool:
+            log.info(f'Copying and processing Prokka ffn files from {srce_dir} into {dest_dir}')
+            return pool.map(partial(copy_prokka_ffn, dest_dir=dest_dir), ffns)
+    except IOError as e:
+        log.error(f'IOError, copying "{e.filename}": {e}')
+        raise e
+    except Exception as e:
+        log.error(f'Error: {e}')
+        raise e
+
+
+def blastdb_files(fastaname):
+    """Return list of the files of blast db made from fasta file: its alias
+    file, if made in several volumes, else its header, index and seq files
+    """
+    alias_file = f'{fastaname}.nal'
+    if os.path.exists(alias_file):
+        return [alias_file]
+    return [ f'{fastaname}.{ext}' for ext in ('nhr', 'nin', 'nsq') ]
 
 
 def makeblastdb(fastaname, blast_db=None):
@@ -183,39 +254,25 @@ def make_blacklist(fasta_path, gbin_name, suffix='fasta'):
         blacks = [f for f in fpath.glob('*'+suffix)
                   if gbin_name not in f.name]
         blacklist = 'blacklist.' + gbin_name
-        try:
-            os.remove(blacklist)
-        except FileNotFoundError:
-            pass
-        with open(blacklist, mode='a') as blck:
-            for b in blacks:
-                with open(b) as bff:
-                    blck.write(bff.read())
+        cat_files(blacks, blacklist)
         return blacklist
     except Exception as e:
         log.error(f'Error: {e}')
         raise e
 
 
-def make_blacklists(filepath, suffix='fasta'):
-    """make blacklist fasta files for each file in path"""
-    log.info('in function make_blacklists')
-    try:
-        blacklists = []
-        fpath = APath(filepath)
-        for fa in fpath.glob('*'+suffix):
-            blacklists.append( make_blacklist(fpath, fa.name) )
-        return blacklists
-    except Exception as e:
-        log.error(f'Error: {e}')
-        raise e
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Exec 'CATCH' Probe design ~~~~~
+def genome_bin_probes_file(gbin, dest_dir=None):
+    """Return path of the probes file designed for genome bin in dest_dir"""
+    dest_dir = dest_dir or APath(CONFIG.get('paths').get('working_dir'))
+    return dest_dir / '.'.join([gbin.stem, 'probes', gbin.suffix[1:]])
 
 
-#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Exec 'CATCH' Probe design ~~~~~
 def catch_design_probes(gbin, dest_dir=None, reuse_existing=False):
     """Design cluster probes using catch app.
     Prepend cluster gbin name into header in resulting sequence files.
     Requires: [catch]
+    ...unless config'd [catch] engine = 'native': tile probes in-process instead.
     Note: file, dir args should be 'APath' instances
     """
     log.info(f'Designing probes for {gbin.name}')
@@ -226,7 +283,7 @@ def catch_design_probes(gbin, dest_dir=None, reuse_existing=False):
         catch_app = CONFIG.get('APPS').get('catch')
 
         # insert '.probes' into outfile and log names
-        probe_out = dest_dir / '.'.join([gbin.stem, 'probes', gbin.suffix[1:]])
+        probe_out = genome_bin_probes_file(gbin, dest_dir)
         catch_tsv = dest_dir / f'{gbin.stem}.probe_coverage_analysis.tsv'
 
         if reuse_existing and probe_out.exists():
@@ -235,6 +292,12 @@ def catch_design_probes(gbin, dest_dir=None, reuse_existing=False):
 
         opt_probe_length = str(CONFIG.get('catch').get('probe_length'))
         opt_probe_stride = str(CONFIG.get('catch').get('probe_stride'))
+        if CONFIG.get('catch').get('engine', 'catch') == 'native':
+            tile_probes(gbin.abspath, probe_out.abspath, catch_tsv.abspath,
+                        opt_probe_length, opt_probe_stride,
+                        header_prefix=f'{gbin.stem}_')
+            return probe_out
+
         cmd = [catch_app,
                '--write-analysis-to-tsv', catch_tsv.abspath,
                '--probe-length', opt_probe_length,
@@ -255,8 +318,24 @@ def catch_design_probes(gbin, dest_dir=None, reuse_existing=False):
 
 #~~~~~~~~~~~~~ exec 'blastn' each cluster's probes on all (concat) genomes ~~~~~
 ##  Requires: `blastn`
-def blast_clust_probes_on_genome(probe_file, blastdb):
+def blast_fields():
+    """Return list of blastn output fields: the default ones, plus the extra
+    non-default ones config'd.
+    """
+    fields = DB_CFG.get('blastn').get('fields').copy()
+    extras = CONFIG.get('blastn').get('fields')
+    fields += [f for f in extras if f not in fields]
+    return fields
+
+
+def blast_clust_probes_on_genome(probe_file, blastdb, stream=False):
     """Run 'blastn' of cluster's probe fasta on genome blastdb.
+    If 'stream', return a generator of the match rows, read from blastn's
+    output as they arrive, rather than a list of all of them.
+    If probe_file is not a file, return an error message, or if 'stream'
+    raise FileNotFoundError (the rows of which would be its characters).
+    If [blastn] engine = 'kmer', find the exact matches in-process instead,
+    blastdb being the fasta file (see 'kmer_match_probes').
     Note: probe_file be 'APath' instance, blastdb param is string of filename or filepath.
     """
     log.info(f'Blasting cluster\'s probes ({probe_file}) on genome db {blastdb}')
@@ -268,16 +347,20 @@ def blast_clust_probes_on_genome(probe_file, blastdb):
         numcpu = CONFIG.get('blastn').get('num_threads', '1')
         outfmt = CONFIG.get('blastn').get('outfmt', '10')
 
-        fields = DB_CFG.get('blastn').get('fields').copy()
-        extras = CONFIG.get('blastn').get('fields')
-        fields += [f for f in extras if f not in fields]
+        fields = blast_fields()
         field_fmt = ' '.join(fields)
 
         if not probe_file.is_file():
             err_msg = f'Path: "{probe_file.abspath}" is not a file?!'
             log.warning(err_msg)
+            if stream:
+                raise FileNotFoundError(err_msg)
             return err_msg
 
+        if CONFIG.get('blastn').get('engine', 'blastn') == 'kmer':
+            kmer_rows = kmer_match_probes(probe_file.abspath, blastdb, fields, max_subjects=numaln)
+            return kmer_rows if stream else list(kmer_rows)
+
         cmd = [blastn,
                '-task', 'blastn',
                '-query', probe_file.abspath,
@@ -288,6 +371,10 @@ def blast_clust_probes_on_genome(probe_file, blastdb):
                '-num_threads', numcpu,
                '-outfmt', f'{outfmt} {field_fmt}',
                ]
+        if stream:
+            log.info('Streaming blast matches')
+            return ( row.split(',') for row in iter_cmd_lines(cmd) )
+
         output = run_cmd(cmd, only_stdout=True)
         log.notice('blast output: '+output[0:100])
 
@@ -305,30 +392,82 @@ def blast_clust_probes_on_genome(probe_file, blastdb):
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Insert blast results into DB table ~~~~~
 ##  Blast Result: probe, gene_annot, identity, length, other-stats...
-def import_blasts_to_db(blast_hit_list, db_name=None, table_name=None):
-    """Import blast results to database."""
-
-    """check args or use config options"""
-    db = db_name or DB_CFG.get('clusterdb').get('name')
-    table_name = table_name or DB_CFG.get('probes_table').get('name')
-    table_cols = DB_CFG.get('probes_table').get('cols')
-    index_cols = ', '.join(table_cols.keys()) # index only the default columns
+def probes_table_ddl(table_name, bin_col=None):
+    """Return DDL to create probes table: default columns, plus the extra
+    non-default blastn fields (without datatype), plus 'bin_col' if passed.
+    """
+    table_cols = dict(DB_CFG.get('probes_table').get('cols'))
 
     """add in extra non-default blastn fields to the column list without datatype"""
     blastn_fields = CONFIG.get('blastn').get('fields').copy()
     for fld in blastn_fields:
         if fld not in table_cols:
             table_cols[fld] = '' # empty datatypes
+    if bin_col:
+        table_cols[bin_col] = 'TEXT'
 
     col_defs = ', '.join([' '.join(t) for t in table_cols.items()])
-    ddl_table = f'CREATE TABLE IF NOT EXISTS {table_name} ({col_defs});'
+    return f'CREATE TABLE IF NOT EXISTS {table_name} ({col_defs});'
+
+
+def probes_index_ddls(table_name, bin_col=None):
+    """Return list of DDL to create the probes table's indexes (per DB_CFG),
+    each led by 'bin_col' if passed.
+    """
+    index_ddls = []
+    for index_name, index_cols in DB_CFG.get('probes_table').get('indexes').items():
+        cols = ([bin_col] if bin_col else []) + list(index_cols)
+        index_ddls.append(f'CREATE INDEX IF NOT EXISTS "{index_name}"'
+                          f' ON {table_name} ({", ".join(cols)});')
+    return index_ddls
+
+
+def import_blasts_to_db(blast_hit_list, db_name=None, table_name=None, fields=None,
+                        bin_id=None):
+    """Import blast results to database.
+    If list of 'fields' is passed, 'blast_hit_list' can be any iterable of rows
+    (value lists in 'fields' order), streamed into the table in batches.
+    If 'bin_id' is passed, the db is the consolidated results db of all bins:
+    rows are tagged with bin_id, replacing any prior rows of that bin.
+    Otherwise it is the bin's own db: they replace all prior rows.
+    """
+
+    """check args or use config options"""
+    db = db_name or DB_CFG.get('clusterdb').get('name')
+    table_name = table_name or DB_CFG.get('probes_table').get('name')
+    bin_col = DB_CFG.get('resultsdb').get('bin_col') if bin_id else None
+
+    ddl_table = probes_table_ddl(table_name, bin_col=bin_col)
     create_table = Sdb.exec_ddl(db, ddl_table)
 
-    ddl_index = f'CREATE INDEX IF NOT EXISTS "probes_idx" ON {table_name} ({index_cols});'
-    create_index = Sdb.exec_ddl(db, ddl_index)
+    """indexes are created after the bulk import, rather than updated per row;
+    then table statistics are gathered for the query planner (of the results
+    db, once all bins are imported: see 'summarize_results_db')"""
+    index_ddls = probes_index_ddls(table_name, bin_col=bin_col)
+    if not bin_id:
+        index_ddls.append(f'ANALYZE {table_name};')
+
+    sqlite_opts = CONFIG.get('sqlite')
+    bulk_opts = dict(chunk_size=sqlite_opts.get('import_chunk_rows', 10000),
+                     pragmas=dict(sqlite_opts.get('pragmas', Sdb.BULK_PRAGMAS)),
+                     index_ddls=index_ddls)
+    if bin_id:
+        bulk_opts['delete_where'] = (f'{bin_col}=?', (bin_id,))
+        if fields:
+            fields = fields + [bin_col]
+            blast_hit_list = ( row + [bin_id] for row in blast_hit_list )
+        else:
+            for hit in blast_hit_list:
+                hit[bin_col] = bin_id
+    else:
+        bulk_opts['delete_where'] = ('1', ()) # e.g. of a run that died part way
 
-    import_success = Sdb.import_data(blast_hit_list, db, table=table_name)
-    return create_table and create_index and import_success
+    if fields:
+        import_success = Sdb.import_rows(blast_hit_list, db, table_name, fields, **bulk_opts)
+    else:
+        import_success = Sdb.import_data(blast_hit_list, db, table=table_name,
+                                         bulk=True, **bulk_opts)
+    return create_table and import_success
 
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Filter DB table probe headers ~~~~~
@@ -338,14 +477,20 @@ def import_blasts_to_db(blast_hit_list, db_name=None, table_name=None):
 ##    remove all hits not on this specific cluster (using field holding cluster ID)
 ##    remove based on tRNA regex (from config to sep db table)
 ##    filter resulting headers by GC% (Step 11)
-def filter_probe_seqs(dbname, cluster_id, table_name=None):
+def filter_probe_seqs(dbname, cluster_id, table_name=None, by_bin=False, materialize=None):
     """Create db view onto blast results table, limiting on (below default values):
         - dupes
         - pct_identity
         - within GC min>max
         - =40bp length
-        - hit on this clust
-        - not match tRNA names
+        - probe of this clust (id prefixed '<cluster_id>_')
+        - not excluded, i.e. match tRNA names (tagged on import)
+    If 'by_bin', the view is onto the consolidated results db of all bins:
+    each hit is limited to its own row's bin (cluster_id unused).
+    If 'materialize' (default from CONFIG [sqlite]), it's a table of the
+    filtered rows instead, indexed on is_musicc, so filtering is done once.
+    If also 'by_bin', the table is created empty (cluster_id None), then
+    the rows of bin cluster_id are (re)placed in it.
     """
     try:
         log.info(f'Filtering headers in db view for {dbname}')
@@ -355,6 +500,17 @@ def filter_probe_seqs(dbname, cluster_id, table_name=None):
         filter_view = DB_CFG.get('probes_view').get('name')
 
         field_list = DB_CFG.get('probes_view').get('cols').copy()
+        """probe ids are prefixed '<cluster_id>_': a range, searchable by index
+        (unlike LIKE, whose '_' is a wildcard)"""
+        if by_bin:
+            bin_col = DB_CFG.get('resultsdb').get('bin_col')
+            field_list.append(bin_col)
+            clust_where = f"qseqid >= {bin_col} || '_' AND qseqid < {bin_col} || '`'"
+            group_cols = f'{bin_col}, qseqid' # lets a bin's rows be searched by index
+        else:
+            clust_val = cluster_id.replace("'", "''")
+            clust_where = f"qseqid >= '{clust_val}_' AND qseqid < '{clust_val}`'"
+            group_cols = 'qseqid'
         field_sql = ', '.join(field_list)
 
         gc_min = CONFIG.get('gc_percent').get('min_percent')
@@ -362,25 +518,51 @@ def filter_probe_seqs(dbname, cluster_id, table_name=None):
         probe_length = CONFIG.get('catch').get('probe_length')
         pct_identity = CONFIG.get('filters').get('pct_identity')
 
-        trna_list = CONFIG.get('filters').get('trna_list')
-        trna_wheres = [ f'sseqid NOT LIKE "%{t}%"' for t in trna_list ]
-        trna_where_def = ' AND ('+ ' AND '.join(trna_wheres) +')'
-
         wheres = [f'gc_pct between "{gc_min}" and "{gc_max}"',
                   f'pident={pct_identity}',
                   f'length={probe_length}',
-                  f'qseqid like "{cluster_id}%"',
-                  ] + trna_wheres
-        where_def = ' AND '.join(wheres) + trna_where_def
-        group_def = 'qseqid HAVING count(qseqid)=1'
-
-        ddl_view = f'DROP VIEW IF EXISTS {filter_view};'
-        ddl_view = (f'CREATE VIEW {filter_view} AS'
-                    f' SELECT {field_sql} FROM {table_name}'
-                    f' WHERE {where_def} GROUP BY {group_def};')
-        # log.debug(f'filtering view query: "{ddl_view}"')
-        create_success = Sdb.exec_ddl(db, ddl_view)
-        return create_success
+                  clust_where,
+                  'is_excluded=0',
+                  ]
+        where_def = ' AND '.join(wheres)
+        group_def = f'{group_cols} HAVING count(qseqid)=1'
+
+        select_sql = (f'SELECT {field_sql} FROM {table_name}'
+                      f' WHERE {where_def} GROUP BY {group_def}')
+        if materialize is None:
+            materialize = CONFIG.get('sqlite').get('materialize_filter', False)
+        if not materialize:
+            Sdb.log_query_plan(db, select_sql)
+            Sdb.drop_object(db, filter_view)
+            ddl_view = f'CREATE VIEW {filter_view} AS {select_sql};'
+            # log.debug(f'filtering view query: "{ddl_view}"')
+            create_success = Sdb.exec_ddl(db, ddl_view)
+            return create_success
+
+        if not by_bin:
+            Sdb.log_query_plan(db, select_sql)
+            Sdb.drop_object(db, filter_view)
+            Sdb.exec_ddl(db, f'CREATE TABLE {filter_view} AS {select_sql};')
+            return Sdb.exec_ddl(db, f'CREATE INDEX "{filter_view}_musicc_idx"'
+                                    f' ON {filter_view} (is_musicc);')
+
+        if cluster_id is None:
+            log.info(f'Creating filtered probes table in {db}')
+            Sdb.drop_object(db, filter_view, types=('view',)) # keep rows of table
+            Sdb.exec_ddl(db, f'CREATE TABLE IF NOT EXISTS {filter_view} AS'
+                             f' {select_sql.replace(" WHERE ", " WHERE 0 AND ", 1)};')
+            return Sdb.exec_ddl(db, f'CREATE INDEX IF NOT EXISTS "{filter_view}_bin_idx"'
+                                    f' ON {filter_view} ({bin_col}, is_musicc);')
+
+        log.info(f'Filtering probes of {cluster_id} into table {filter_view}')
+        bin_select = select_sql.replace(' WHERE ', f' WHERE {bin_col}=? AND ', 1)
+        Sdb.log_query_plan(db, bin_select, (cluster_id,))
+        """write lock taken at the start, so concurrent bins' writers wait in turn"""
+        with Sdb.connection(db, row_dict=False) as db_con, db_con:
+            db_con.execute('BEGIN IMMEDIATE;')
+            db_con.execute(f'DELETE FROM {filter_view} WHERE {bin_col}=?;', (cluster_id,))
+            db_con.execute(f'INSERT INTO {filter_view} {bin_select};', (cluster_id,))
+        return True
     except Exception as e:
         log.error(f'Writing to db "{db}": {e}')
         raise e
@@ -405,136 +587,610 @@ def generate_musicc_regex(musiccs=None, begin_regex=None):
         raise e
 
 
+#~~~~~~~~~~~~~~~~~~~ Annotate Blast Matches with GC%, MUSiCC, Exclusion ~~~~~
+def annotation_classifier():
+    """Return AnnotationClassifier of MUSiCC and excluded (trna_list) hits, per CONFIG"""
+    trna_list = CONFIG.get('filters').get('trna_list')
+    return AnnotationClassifier(generate_musicc_regex(), [ str(t) for t in trna_list ])
+
+
+def annotate_probe_blasts(probe_blasts, probes_file, probe_ids=None):
+    """Yield each blast match record (list) with GC% of its probe seq (qseqid),
+    and MUSiCC match and exclusion (trna_list) of its hit (sseqid) appended,
+    in a single pass of matches.
+    GC% is calculated once per probe, all in one batch; calculated only for
+    'probe_ids' if passed.
+    Hits are classified once per distinct sseqid (see AnnotationClassifier).
+    Records whose qseqid is not in the probes_file are yielded unchanged.
+    """
+    log.info('Processing blast match sequences for GC%, and the seq hits for MUSiCC')
+    probe_seqs = {}
+    for header, seq in read_fasta(probes_file):
+        qid = header.replace('>','')
+        if (probe_ids is None or qid in probe_ids) and qid not in probe_seqs:
+            probe_seqs[qid] = seq
+    probes_gc = dict(zip(probe_seqs.keys(), pct_gc_batch(list(probe_seqs.values()))))
+    log.debug(f' ... Calculated GC% of {len(probes_gc)} probe seqs')
+
+    classifier = annotation_classifier()
+    for pb in probe_blasts:
+        gc = probes_gc.get(pb[0])
+        if gc is not None:
+            is_musicc, is_excluded = classifier.classify(pb[1])
+            pb.append( gc )
+            pb.append( is_musicc )
+            pb.append( is_excluded )
+        yield pb
+
+
 #~~~~~~~~~~~~~~~~~~~~~~~~ Select Random Probe Seqs from Final Filtered Set ~~~~~
-def export_final_sets(dbname, cluster_id, final_probe_amount=1, randomly=True):
+def final_set_files(cluster_id):
+    """Return list of the final probe set files of cluster: 'normal', 'musicc'"""
+    working_dir = APath(CONFIG.get('paths').get('working_dir'))
+    return [ working_dir / '.'.join([cluster_id, 'probes', 'final', which, 'fasta'])
+             for which in ('normal', 'musicc') ]
+
+
+def export_final_sets(dbname, cluster_id, final_probe_amount=None, randomly=None,
+                      by_bin=False, seed=None):
     """Export final sets of (possibly random) probe sequences into fasta format;
     one file for 'musicc', one for non.
+    Random picks are made in the db query ('ORDER BY random()'), or if 'seed'
+    is set, by reservoir sampling in a single pass for reproducible sets.
+    If 'by_bin', export from the consolidated results db of all bins.
     """
     log.info(f'Exporting probes for {cluster_id}')
 
-    working_dir = APath(CONFIG.get('paths').get('working_dir'))
-    final_amount = int(final_probe_amount) or int(CONFIG.get('general').get('final_probe_amount'))
-    random_picks = randomly or CONFIG.get('general').get('final_probe_random')
+    general = CONFIG.get('general')
+    final_amount = int(final_probe_amount or general.get('final_probe_amount'))
+    random_picks = randomly if randomly is not None else general.get('final_probe_random')
+    seed = seed if seed is not None else general.get('final_probe_seed', '')
+    rng = random.Random(f'{seed}:{cluster_id}') if str(seed) else None
     filter_view = DB_CFG.get('probes_view').get('name')
 
     """final_fields taken from config/database/probes_view_cols last words (post-space)"""
     final_fields = [col.split(' ')[-1] for col in DB_CFG.get('probes_view').get('cols').copy()]
 
-    for which, where in (('normal','0'), ('musicc','1')):
-        export_bits = '.'.join([cluster_id, 'probes', 'final', which, 'fasta'])
-        export_file = working_dir / export_bits
+    for (which, where), export_file in zip((('normal','0'), ('musicc','1')),
+                                           final_set_files(cluster_id)):
         whim = 'is_musicc='+where
+        if by_bin:
+            bin_col = DB_CFG.get('resultsdb').get('bin_col')
+            bin_val = cluster_id.replace("'", "''")
+            whim += f" AND {bin_col}='{bin_val}'"
+
+        if random_picks and rng:
+            log.debug(f' ... reservoir sampling {final_amount} rows, seed "{seed}"')
+            probes_selector = Sdb.iter_select(dbname, filter_view, where=whim, fields=final_fields,
+                                              row_mode='tuple', explain=True)
+            final_rows = reservoir_sample(probes_selector, final_amount, rng=rng)
+        else:
+            order_by = 'random()' if random_picks else None
+            probes_selector = Sdb.iter_select(dbname, filter_view, where=whim, fields=final_fields,
+                                              order_by=order_by, limit=final_amount,
+                                              row_mode='tuple', explain=True)
+            final_rows = list(probes_selector)
+        log.debug(f' ... selected rows: {len(final_rows)}')
+
+        if not final_rows:
+            log.notice(f'No filtered "{which}" probes for cluster "{cluster_id}".')
+            write_out_file('', export_file) # write empty file
+            continue
 
-        record_count = Sdb.iter_select(dbname, filter_view, where=whim, fields='count(*) as recs')
-        record_count = next(record_count).pop('recs')
-        log.debug(f' ... record_count: {record_count}')
+        log.info(f'Exporting to file {export_file}')
+        seq_idx = final_fields.index('probe_seq') # NB: presumption of column name 'probe_seq' in filter view!!
+        with open(export_file, 'w') as export_fh:
+            for row in final_rows:
+                seq = row[seq_idx]
+                head = '>' + '|'.join([str(v) for i, v in enumerate(row) if i != seq_idx])
+                probe_fasta = os.linesep.join([head, seq, '']) # final '' elem appends EOL
+                log.debug(f' ... writing to file {export_file}: "{probe_fasta}"')
+                export_fh.write(probe_fasta)
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~ Filter and Export Final Probes of Cluster DB ~~~~~
+def filter_export_probes(clust_db, cluster_id, by_bin=False, manifest=None,
+                         upstream=None, redo=True):
+    """Filter the imported blast matches and export final probe sets.
+    If 'by_bin', clust_db is the consolidated results db of all bins, whose
+    filter view is already created by 'init_results_db' (or if materialized,
+    the table which this bin's filtered rows are put into).
+    Each step is skipped if already done per the 'manifest', unless 'redo'
+    (i.e. the blast matches were just imported); 'upstream' is the blast step key.
+    Note: clust_db should be 'APath' instance
+    """
+    """Filter resulting table to limits in CONFIG"""
+    filter_key, filter_done = step_checkpoint(manifest, cluster_id, 'filter', upstream=upstream,
+                                              outputs=[clust_db], redo=redo)
+    materialize = CONFIG.get('sqlite').get('materialize_filter', False)
+    if not (filter_done or (by_bin and not materialize)):
+        log.name = 'Probe:FilterView'
+        filter_probe_seqs(clust_db.abspath, cluster_id, by_bin=by_bin)
+    if manifest:
+        manifest.mark(cluster_id, 'filter', filter_key)
+
+    """Create two views, one for SC, one inverse for MC"""
+    export_key, export_done = step_checkpoint(manifest, cluster_id, 'export', upstream=filter_key,
+                                              outputs=final_set_files(cluster_id),
+                                              redo=redo or not filter_done)
+    if not export_done:
+        log.name = 'Probe:ExportFinals'
+        final_probe_amount = CONFIG.get('general').get('final_probe_amount')
+        log.debug(f' ... final_probe_amount {final_probe_amount}')
+        export_final_sets(clust_db.abspath, cluster_id, final_probe_amount=final_probe_amount,
+                          by_bin=by_bin)
+    if manifest:
+        manifest.mark(cluster_id, 'export', export_key)
 
-        if record_count == 0:
-            log.notice(f'No filtered "{which}" probes for cluster "{cluster_id}".')
-            write_out_file('', export_file, mode='a') # write empty file
-            next
 
-        if random_picks:
-            final_amount = final_amount if record_count >= final_amount else record_count
-            row_nums = random.sample(range(record_count), k=final_amount)
-        else:
-            row_nums = [r for r in range(final_amount)]
-        log.debug(f' ... row_nums: {row_nums}')
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Consolidated Results DB for All Bins ~~~~~
+def init_results_db(dbname):
+    """Create consolidated results db for all genome bins: the probes table
+    (with bin_col), its indexes and filter view, in WAL journal mode so
+    parallel workers can read while another writes.
+    """
+    log.info(f'Initializing consolidated results db "{dbname}"')
+    table_name = DB_CFG.get('probes_table').get('name')
+    bin_col = DB_CFG.get('resultsdb').get('bin_col')
+
+    Sdb.exec_ddl(dbname, 'PRAGMA journal_mode=WAL;')
+    Sdb.exec_ddl(dbname, probes_table_ddl(table_name, bin_col=bin_col))
+    """indexed up front, as bins' rows are deleted and imported concurrently"""
+    for ddl_index in probes_index_ddls(table_name, bin_col=bin_col):
+        Sdb.exec_ddl(dbname, ddl_index)
+    filter_probe_seqs(dbname, None, table_name=table_name, by_bin=True)
+
+
+def summarize_results_db(dbname):
+    """Log counts of probes, filtered and filtered MUSiCC probes per genome bin
+    in the consolidated results db, using a single query. Return list of dicts.
+    Call once all bins are done: the table statistics are gathered for the
+    query planner, once; the db is reverted from WAL journal_mode.
+    """
+    log.info(f'Summarizing consolidated results db "{dbname}"')
+    table_name = DB_CFG.get('probes_table').get('name')
+    filter_view = DB_CFG.get('probes_view').get('name')
+    bin_col = DB_CFG.get('resultsdb').get('bin_col')
+    Sdb.exec_ddl(dbname, f'ANALYZE {table_name};')
+
+    summary_from = (f'(SELECT {bin_col}, count(*) AS recs FROM {table_name}'
+                    f' GROUP BY {bin_col}) s LEFT JOIN'
+                    f' (SELECT {bin_col}, count(*) AS recs, sum(is_musicc) AS musicc'
+                    f' FROM {filter_view} GROUP BY {bin_col}) f USING ({bin_col})')
+    summary_fields = [f's.{bin_col} AS {bin_col}',
+                      f's.recs AS {table_name}',
+                      f'coalesce(f.recs, 0) AS {filter_view}',
+                      'coalesce(f.musicc, 0) AS filtered_musicc']
+    summary = list(Sdb.iter_select(dbname, summary_from, fields=summary_fields))
+    for row in summary:
+        log.notice(' '.join(f'{k}={v}' for k, v in row.items()))
+
+    """all writers are done: checkpoint WAL back into the db file"""
+    Sdb.exec_ddl(dbname, 'PRAGMA journal_mode=DELETE;')
+    return summary
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Checkpoints of Steps per Genome Bin ~~~~~
+"""CONFIG options (section, option) on which the results of each step depend"""
+STEP_CONFIG = dict(
+    prokka = [ ('general', 'prokka_prediction_suffix') ],
+    blastdb = [],
+    design = [ ('catch', 'probe_length'), ('catch', 'probe_stride'), ('catch', 'engine') ],
+    blast = [ ('blastn', 'evalue'), ('blastn', 'dust'), ('blastn', 'num_alignments'),
+              ('blastn', 'fields'), ('filters', 'begin_regex'), ('filters', 'musicc_list'),
+              ('filters', 'trna_list'), ('sqlite', 'consolidate_bins'),
+              ('blastn', 'drop_shared_probes'), ('blastn', 'engine'),
+              ('blastn', 'hits_formats') ],
+    filter = [ ('gc_percent', 'min_percent'), ('gc_percent', 'max_percent'),
+               ('catch', 'probe_length'), ('filters', 'pct_identity'),
+               ('sqlite', 'materialize_filter') ],
+    export = [ ('general', 'final_probe_amount'), ('general', 'final_probe_random'),
+               ('general', 'final_probe_seed') ],
+)
 
-        probes_selector = Sdb.iter_select(dbname, filter_view, where=whim, fields=final_fields)
 
-        log.info(f'Exporting to file {export_file}')
-        for row in [row for num, row in enumerate(probes_selector) if num in row_nums]:
-            seq = row.pop('probe_seq') # NB: presumption of column name 'probe_seq' in filter view!!
-            head = '>' + '|'.join([str(v) for v in row.values()])
-            probe_fasta = os.linesep.join([head, seq, '']) # final '' elem appends EOL
-            log.debug(f' ... writing to file {export_file}: "{probe_fasta}"')
-            write_out_file(probe_fasta, export_file, mode='a')
+"""manifest 'bin name' of the steps done once per run, for all genome bins"""
+RUN_STEPS_ID = 'all_bins'
 
 
-#~~~ Generate/Process/Filter/Export Probe Sequences for Cluster Genome Bin ~~~~~
-def targeted_genome_bin_probes(genome_bin, blastdb=None):
-    """Generate, process, filter and export probes for a cluster genome bin"""
-    log.notice(f'Generating targeted probes for genome bin: {genome_bin.name}')
-    working_dir = APath(CONFIG.get('paths').get('working_dir'))
-    blast_header = DB_CFG.get('blastn').get('fields').copy()
-    blast_extras = CONFIG.get('blastn').get('fields').copy()
+def step_checkpoint(manifest, cluster_id, step, inputs=(), upstream=None, outputs=(), redo=False):
+    """Return tuple of (key, done?) for step of cluster in the checkpoint manifest.
+    Never done if 'redo' (e.g. a step before it just ran), nor without a manifest.
+    """
+    if manifest is None:
+        return None, False
+    step_cfg = { f'{sect}.{opt}': CONFIG.get(sect).get(opt) for sect, opt in STEP_CONFIG[step] }
+    key = manifest.step_key(inputs, step_cfg, upstream)
+    return key, not redo and manifest.is_done(cluster_id, step, key, outputs)
 
-    """add in extra non-default blastn fields to the header"""
-    for fld in blast_extras:
-        if fld not in blast_header:
-            blast_header.append(fld)
-    blast_header.extend([ 'gc_pct', 'is_musicc' ])
 
-    blastdb = blastdb or makeblastdb(genome_bin)
-    cluster_id = genome_bin.stem
+def cluster_results_db(cluster_id):
+    """Return tuple of (db, by_bin): the cluster's own db, or the consolidated
+    results db of all bins if so configured.
+    """
+    working_dir = APath(CONFIG.get('paths').get('working_dir'))
+    if CONFIG.get('sqlite').get('consolidate_bins', False):
+        return working_dir / DB_CFG.get('resultsdb').get('name'), True
+    db_name = DB_CFG.get('clusterdb').get('name')
+    return working_dir / '_'.join([cluster_id, db_name]), False
+
 
+def design_genome_bin_probes(genome_bin, manifest=None, probe_index=None):
+    """Design probes for genome bin, reusing its probes file if that step is
+    done per manifest, or if already designed for the 'probe_index'.
+    Return tuple of (probes_file, design step key).
+    """
     log.name = 'Probe:CatchDesign'
-    reuse_existing_probes = CONFIG.get('catch').get('reuse_existing_probe_files')
+    cluster_id = genome_bin.stem
+    design_key, design_done = step_checkpoint(manifest, cluster_id, 'design', inputs=[genome_bin],
+                                              outputs=[genome_bin_probes_file(genome_bin)])
+    indexed = probe_index is not None and probe_index.probes_file(cluster_id) is not None
+    reuse_existing_probes = (CONFIG.get('catch').get('reuse_existing_probe_files')
+                             or design_done or indexed)
     probes_file = catch_design_probes(genome_bin, reuse_existing=reuse_existing_probes)
+    if manifest:
+        manifest.mark(cluster_id, 'design', design_key)
+    return probes_file, design_key
+
+
+def resume_genome_bin_blasts(genome_bin, probes_file, blastdb, design_key, manifest=None):
+    """If blast matches of genome bin are already imported per manifest,
+    only filter and export its probes (each if not done either).
+    Return tuple of (blast step key, done?)
+    """
+    log.name = 'Probes:Blast'
+    cluster_id = genome_bin.stem
+    clust_db, by_bin = cluster_results_db(cluster_id)
+    blast_key, blast_done = step_checkpoint(manifest, cluster_id, 'blast',
+                                            inputs=[probes_file, blastdb],
+                                            upstream=design_key,
+                                            outputs=[clust_db, *blast_hits_files(probes_file)])
+    if blast_done:
+        with Sdb.session(clust_db.abspath):
+            filter_export_probes(clust_db, cluster_id, by_bin=by_bin, manifest=manifest,
+                                 upstream=blast_key, redo=False)
+    return blast_key, blast_done
+
+
+def blast_hits_files(probes_file):
+    """Return list of the files of blast matches of probes_file, one for each
+    of [blastn] hits_formats (csv, parquet, arrow), in that order.
+    """
+    hits_formats = CONFIG.get('blastn').get('hits_formats', ['csv'])
+    return [ probes_file.with_suffix(f'.blasts.{fmt}')
+             for fmt in ('csv', 'parquet', 'arrow') if fmt in hits_formats ]
+
+
+def blast_query_file(genome_bins, probes_files, query_file, probe_index=None):
+    """Return tuple of (blast query file of the probes of genome bins, i.e.
+    of their probes_files in order; function to fan out the blast matches of
+    its queries to all the probes, or None).
+    If [blastn] drop_shared_probes, probes whose seq is shared (either strand,
+    in any bin, per 'probe_index') are left out; if [blastn] dedup_queries,
+    each distinct seq (either strand) is blasted once (see 'write_unique_queries').
+    Otherwise a single probes file is used as is; several are concatenated
+    into query_file.
+    """
+    blastn_opts = CONFIG.get('blastn')
+    dedup = blastn_opts.get('dedup_queries', False)
+    exclude = set()
+    if probe_index is not None and blastn_opts.get('drop_shared_probes', False):
+        for gbin in genome_bins:
+            exclude |= probe_index.shared_ids(gbin.stem)
+    if dedup or exclude:
+        query_ids, reps, flipped = write_unique_queries(probes_files, query_file, exclude, dedup)
+        fan_out = None
+        if reps:
+            fan_out = partial(fan_out_blasts, query_ids=query_ids, reps=reps,
+                              flipped=flipped, fields=blast_fields())
+        return query_file, fan_out
+
+    if len(probes_files) == 1:
+        return probes_files[0], None
+    log.info(f'Concatenating probes of {len(genome_bins)} bins into {query_file}')
+    with open(query_file, 'w') as query_fh:
+        for probes_file in probes_files:
+            with open(probes_file) as probes_fh:
+                shutil.copyfileobj(probes_fh, query_fh)
+    return query_file, None
+
+
+#~~~ Generate/Process/Filter/Export Probe Sequences for Cluster Genome Bin ~~~~~
+def targeted_genome_bin_probes(genome_bin, blastdb=None, manifest=None, probe_index=None):
+    """Generate, process, filter and export probes for a cluster genome bin,
+    skipping steps already done per the checkpoint 'manifest' (if any).
+    """
+    log.notice(f'Generating targeted probes for genome bin: {genome_bin.name}')
+    blastdb = blastdb or makeblastdb(genome_bin)
 
-    """probe_blasts is list of all blast matched records (as lists)"""
+    probes_file, design_key = design_genome_bin_probes(genome_bin, manifest, probe_index)
+    blast_key, blast_done = resume_genome_bin_blasts(genome_bin, probes_file, blastdb,
+                                                     design_key, manifest)
+    if blast_done:
+        return probes_file
+
+    """probe_blasts is list of all blast matched records (as lists), or generator of them"""
     log.name = 'Probes:Blast'
-    probe_blasts = blast_clust_probes_on_genome(probes_file, blastdb)
+    query_file, fan_out = blast_query_file([genome_bin], [probes_file],
+                                           probes_file.with_suffix('.uniq.fasta'), probe_index)
+    stream_blasts = CONFIG.get('blastn').get('stream_results', False)
+    probe_blasts = blast_clust_probes_on_genome(query_file, blastdb, stream=stream_blasts)
+    if fan_out:
+        probe_blasts = fan_out(probe_blasts)
+
+    process_genome_bin_blasts(genome_bin, probes_file, probe_blasts,
+                              manifest=manifest, blast_key=blast_key)
+    if query_file != probes_file:
+        os.remove(query_file)
+    return probes_file
 
-    """Calculate GC% for each seq in probes. Append that and seq onto probe_blasts"""
-    probe_ids = set( [pb[0] for pb in probe_blasts] )
-    probes_gc = {}
 
+def process_genome_bin_blasts(genome_bin, probes_file, probe_blasts, manifest=None,
+                              blast_key=None):
+    """Annotate the blast matches of a genome bin's probes with GC% and MUSiCC,
+    write them to csv, import to the cluster db, then filter and export probes.
+    'probe_blasts' is list of all blast matched records (as lists), or any
+    iterable of them (e.g. streamed from blastn), passed through each step.
+    Into the consolidated results db (shared by parallel workers), streamed
+    matches are spooled (and written to csv, etc) first, so the db's write
+    lock is held only for the import, not for the whole blastn run.
+    Once imported, the blast step is recorded in 'manifest' with 'blast_key'.
+    """
+    blast_header = blast_fields()
+    blast_header.extend([ 'gc_pct', 'is_musicc', 'is_excluded' ])
+
+    cluster_id = genome_bin.stem
+    clust_db, by_bin = cluster_results_db(cluster_id)
+    bin_id = cluster_id if by_bin else None
+
+    """Calculate GC% for each seq in probes. Append that and MUSiCC onto probe_blasts"""
     log.name = ('Probe:GC,MUSiCC')
-    log.info('Processing blast match sequences for GC%, and the seq hits for MUSiCC')
-    musicc_re = generate_musicc_regex()
-    for header, seq in read_fasta(probes_file):
-        qid = header.replace('>','')
-        if qid in probe_ids:
-            log.info(f'Processing probe seq id: "{qid}"')
-            for pb in probe_blasts:
-                if pb[0] == qid:
-                    if pb[0] not in probes_gc:
-                        log.debug(f' ... Calc GC% on "{qid}"')
-                        probes_gc[pb[0]] = pct_gc(seq)
-                    pb.append( probes_gc[pb[0]] )
-                    # log.debug(f' ... Check MUSiCC on "{pb[1]}"')
-                    is_musicc = 1 if musicc_re.search(pb[1]) else 0
-                    pb.append( is_musicc )
-
-    """Get list of fields; write to csv file as header"""
-    probe_blasts.insert(0, blast_header)
-    blast_probe_file = probes_file.with_suffix('.blasts.csv')
-    write_out_csv(blast_probe_file.abspath, probe_blasts, append=False)
-
-    """Convert Blast list into field:val dict for db import"""
-    log.name = ('Probe:BlastListtPrepImport')
-    log.info('Converting list of blast hits to dict for import to db')
-    probe_fields = probe_blasts.pop(0) # pop off blast_header record with new columns
-    pseqs = []
-    if len(probe_fields) == len(probe_blasts[0]):
-        for vals in probe_blasts:
-            vals_dict = {f:v for (f,v) in zip(probe_fields, vals)}
-            pseqs.append(vals_dict)
-        log.debug(f'len pseqs: {len(pseqs)}')
-
-        """import blast file to cluster database"""
+    probe_ids = set( pb[0] for pb in probe_blasts ) if isinstance(probe_blasts, list) else None
+    probe_rows = annotate_probe_blasts(probe_blasts, probes_file, probe_ids)
+
+    """Write to csv and/or columnar files (with header of fields), passing rows on to db import"""
+    col_types = dict(DB_CFG.get('probes_table').get('cols'))
+    for hits_file in blast_hits_files(probes_file):
+        fmt = hits_file.suffix[1:]
+        if fmt == 'csv':
+            probe_rows = iter_write_csv(hits_file.abspath, probe_rows, header=blast_header)
+        else:
+            probe_rows = iter_write_arrow(hits_file.abspath, probe_rows, header=blast_header,
+                                          col_types=col_types, fmt=fmt)
+    if by_bin and not isinstance(probe_blasts, list):
+        log.info(f'Spooling blast matches of {cluster_id} before import')
+        probe_rows = spool_rows(probe_rows,
+                                chunk_rows=CONFIG.get('sqlite').get('import_chunk_rows', 10000),
+                                spool_dir=clust_db.parent.abspath)
+
+    """import blast rows to cluster database, then filter and export, on one connection"""
+    with Sdb.session(clust_db.abspath):
         log.name = 'Probe:ImportBlast'
-        db_name = DB_CFG.get('clusterdb').get('name')
-        clust_db = working_dir / '_'.join([cluster_id, db_name])
         log.info(f'Importing blast matches to db "{clust_db}"')
-        import_blasts_to_db(pseqs, db_name=clust_db.abspath)
+        import_blasts_to_db(probe_rows, db_name=clust_db.abspath, fields=blast_header,
+                            bin_id=bin_id)
+        if manifest:
+            manifest.mark(cluster_id, 'blast', blast_key)
+        filter_export_probes(clust_db, cluster_id, by_bin=by_bin, manifest=manifest,
+                             upstream=blast_key)
+    return probes_file
 
-        """Filter resulting table to limits in CONFIG"""
-        log.name = 'Probe:FilterView'
-        filter_probe_seqs(clust_db.abspath, cluster_id)
 
-        """Create two views, one for SC, one inverse for MC"""
-        log.name = 'Probe:ExportFinals'
-        final_probe_amount = CONFIG.get('general').get('final_probe_amount')
-        log.debug(f' ... final_probe_amount {final_probe_amount}')
-        export_final_sets(clust_db.abspath, cluster_id, final_probe_amount=final_probe_amount)
+#~~~~~~~~~~~~~~~~~~~~~~ Batch of Genome Bins: blastn their probes at once ~~~~~
+def genome_bin_of_probe(genome_bins):
+    """Return function mapping a probe's qseqid to its genome bin,
+    by the cluster (bin stem) prefix inserted by 'catch_design_probes'.
+    Longest bin stem wins, in case one stem prefixes another.
+    """
+    by_stem = sorted(genome_bins, key=lambda g: len(g.stem), reverse=True)
+    bin_of = {}
+    def probe_bin(qseqid):
+        try:
+            return bin_of[qseqid]
+        except KeyError:
+            for gbin in by_stem:
+                if qseqid.startswith(gbin.stem + '_'):
+                    bin_of[qseqid] = gbin
+                    return gbin
+            raise ValueError(f'No genome bin for blast query "{qseqid}"!')
+    return probe_bin
+
+
+def targeted_genome_bin_batch(genome_bins, blastdb, manifest=None, probe_index=None):
+    """Generate, process, filter and export probes for a batch of genome bins,
+    running a single blastn of all their probes (concatenated) on the blastdb,
+    so it is loaded once per batch. Each bin's blast matches are demultiplexed
+    by their qseqid cluster prefix, then processed as for a single bin.
+    Bins whose blast matches are already imported per the checkpoint
+    'manifest' are left out of the batch blastn.
+    Failures are isolated per bin: a bin failing its design or processing is
+    logged and left out, the others finish; only a failed blastn fails all
+    bins of the batch yet to be processed.
+    Return list of tuples (genome_bin, probes_file or None, error message or
+    None), in order of genome_bins.
+    """
+    working_dir = APath(CONFIG.get('paths').get('working_dir'))
+    bin_names = ', '.join(g.name for g in genome_bins)
+    log.notice(f'Generating targeted probes for batch of genome bins: {bin_names}')
+
+    all_probes_files, blast_keys, errors = {}, {}, {}
+    def failed(gbin, e):
+        log.error(f'Failed processing genome bin "{gbin.name}": {e}')
+        errors[gbin] = f'{type(e).__name__}: {e}'
 
+    for gbin in genome_bins:
+        try:
+            probes_file, design_key = design_genome_bin_probes(gbin, manifest, probe_index)
+            blast_key, blast_done = resume_genome_bin_blasts(gbin, probes_file, blastdb,
+                                                             design_key, manifest)
+        except Exception as e:
+            failed(gbin, e)
+            continue
+        all_probes_files[gbin] = probes_file
+        if not blast_done:
+            blast_keys[gbin] = blast_key
+
+    results = lambda: [ (gbin, all_probes_files.get(gbin) if gbin not in errors else None,
+                         errors.get(gbin)) for gbin in genome_bins ]
+    batch_bins = [ gbin for gbin in genome_bins if gbin in blast_keys ]
+    probes_files = { gbin: all_probes_files[gbin] for gbin in batch_bins }
+    if not batch_bins:
+        return results()
+
+    def process_bin(gbin, bin_blasts):
+        try:
+            process_genome_bin_blasts(gbin, probes_files[gbin], bin_blasts,
+                                      manifest=manifest, blast_key=blast_keys[gbin])
+        except Exception as e:
+            failed(gbin, e)
+        done.append(gbin)
+
+    log.name = 'Probes:BatchBlast'
+    batch_query = working_dir / '.'.join([batch_bins[0].stem, 'batch',
+                                          str(len(batch_bins)), 'probes.fasta'])
+    done = []
+    query_file = None
+    try:
+        query_file, fan_out = blast_query_file(batch_bins, list(probes_files.values()),
+                                               batch_query, probe_index)
+
+        stream_blasts = CONFIG.get('blastn').get('stream_results', False)
+        probe_blasts = blast_clust_probes_on_genome(query_file, blastdb, stream=stream_blasts)
+        if fan_out:
+            probe_blasts = fan_out(probe_blasts)
+        probe_bin = genome_bin_of_probe(batch_bins)
+
+        if stream_blasts:
+            """blastn output is in query order, i.e. each bin's matches are contiguous"""
+            for gbin, bin_blasts in itertools.groupby(probe_blasts,
+                                                      key=lambda pb: probe_bin(pb[0])):
+                if gbin in done:
+                    raise ValueError(f'Blast matches of "{gbin.name}" not contiguous!')
+                process_bin(gbin, bin_blasts)
+        else:
+            demuxed = { gbin: [] for gbin in batch_bins }
+            for pb in probe_blasts:
+                demuxed[probe_bin(pb[0])].append(pb)
+            del probe_blasts
+            for gbin, bin_blasts in demuxed.items():
+                log.info(f'Number of blast matches for {gbin.name}: {len(bin_blasts)}')
+                process_bin(gbin, bin_blasts)
+    except Exception as e:
+        """the batch blastn (or its demultiplexing) failed: so have its bins yet to be done"""
+        for gbin in batch_bins:
+            if gbin not in done:
+                failed(gbin, e)
+                done.append(gbin)
+
+    """bins without any matches still get their (empty) db and files"""
+    for gbin in batch_bins:
+        if gbin not in done:
+            log.name = 'Probes:BatchBlast'
+            log.notice(f'No blast matches for genome bin: {gbin.name}')
+            process_bin(gbin, [])
+
+    if query_file is not None and query_file not in probes_files.values():
+        os.remove(query_file) # a batch of one bin is blasted from its own probes file
+    return results()
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~ Parallel workers: one genome bin per process ~~~~~
+"""workers are forked, whatever the platform's default start method: they
+inherit the log setup and the cached k-mer index (see 'KmerIndex.cached')"""
+MP_CONTEXT = multiprocessing.get_context('fork')
+
+
+def init_bin_worker(config_toml, debug=False):
+    """Initialize a pool worker process with the CONFIG options of this run."""
+    CONFIG.update(tomlkit.parse(config_toml))
+    if debug:
+        log.level_name = 'DEBUG'
+        for lh in log.handlers:
+            lh.level_name = 'DEBUG'
+
+
+def genome_bin_worker(genome_bins, blastdb=None, manifest=None, probe_index=None):
+    """Run targeted_genome_bin_probes on a single genome bin, or
+    targeted_genome_bin_batch on a list of several, isolating failures
+    (per bin, within a batch).
+    Log records are tagged with the bin name(s) so the log.name switching in
+    concurrent workers remains distinguishable in the shared logfile.
+    Return list of tuples (genome_bin, probes_file or None, error message or None)
+    """
+    group = '+'.join(g.stem for g in genome_bins)
+    with log_channel_group(group).applicationbound():
+        if len(genome_bins) > 1:
+            return targeted_genome_bin_batch(genome_bins, blastdb, manifest=manifest,
+                                             probe_index=probe_index)
+        try:
+            probe_file = targeted_genome_bin_probes(genome_bins[0], blastdb=blastdb,
+                                                    manifest=manifest, probe_index=probe_index)
+        except Exception as e:
+            log.error(f'Failed processing genome bin "{group}": {e}')
+            return [ (genome_bins[0], None, f'{type(e).__name__}: {e}') ]
+        else:
+            return [ (genome_bins[0], probe_file, None) ]
+
+
+def batch_genome_bins(genome_bins, batch_size=1):
+    """Split list of genome bins into list of batches of 'batch_size' bins"""
+    batch_size = max(int(batch_size), 1)
+    return [ genome_bins[i:i+batch_size] for i in range(0, len(genome_bins), batch_size) ]
+
+
+def parallel_genome_bin_probes(genome_bins, blastdb, workers=2, batch_size=1, debug=False,
+                               manifest=None, probe_index=None):
+    """Process genome bins in a pool of 'workers' processes, in batches of
+    'batch_size' bins per blastn run, with checkpoints in 'manifest', and
+    shared probes per 'probe_index' (if any).
+    Results are collected in the order of 'genome_bins'; failed bins are logged
+    and left out of the returned list of probe files.
+    """
+    log.info(f'Processing {len(genome_bins)} genome bins using {workers} workers')
+    probe_fastas, failures = [], []
+    worker = partial(genome_bin_worker, blastdb=blastdb, manifest=manifest,
+                     probe_index=probe_index)
+    initargs = (tomlkit.dumps(CONFIG), debug)
+    batches = batch_genome_bins(genome_bins, batch_size)
+    with MP_CONTEXT.Pool(workers, initializer=init_bin_worker, initargs=initargs) as pool:
+        for results in pool.imap(worker, batches, chunksize=1):
+            for gbin, probe_file, error in results:
+                if error:
+                    failures.append((gbin, error))
+                else:
+                    log.info(f'Completed genome bin: {gbin.name}')
+                    probe_fastas.append(probe_file)
+
+    for gbin, error in failures:
+        log.error(f'Genome bin "{gbin.name}" failed: {error}')
+    if failures:
+        log.warning(f'{len(failures)} of {len(genome_bins)} genome bins failed!')
+    return probe_fastas
+
+
+def index_genome_bin_probes(genome_bins, index_db, workers=1, debug=False, manifest=None):
+    """Design the probes of all genome bins (in a pool of 'workers' processes),
+    then index their seqs across all bins, before any are blasted.
+    Return the ProbeIndex.
+    """
+    log.info(f'Designing probes of {len(genome_bins)} genome bins, to index them')
+    designer = partial(design_genome_bin_probes, manifest=manifest)
+    if workers > 1:
+        initargs = (tomlkit.dumps(CONFIG), debug)
+        with MP_CONTEXT.Pool(workers, initializer=init_bin_worker, initargs=initargs) as pool:
+            designed = pool.map(designer, genome_bins, chunksize=1)
     else:
-        log.notice(f'Number of fieldnames({len(probe_fields)}) not equal to'
-                   f'number of values({len(probe_blasts[0])})!')
-    return probes_file
+        designed = [ designer(gbin) for gbin in genome_bins ]
+
+    log.name = 'Targeted:ProbeIndex'
+    probe_index = ProbeIndex(index_db, clear=True)
+    for gbin, (probes_file, _) in zip(genome_bins, designed):
+        probe_index.add_bin(gbin.stem, probes_file)
+    probe_index.index_shared()
+    num_probes, num_seqs, num_shared = probe_index.summary()
+    log.notice(f'Indexed {num_probes} probes: {num_seqs} distinct seqs (either strand);'
+               f' {num_shared} probes of seqs shared within or across bins')
+    return probe_index
 
 
 def finalize_outfiles(working_dir='', blastdb=None, annots=[], probes=[]):
@@ -551,6 +1207,11 @@ def finalize_outfiles(working_dir='', blastdb=None, annots=[], probes=[]):
 
     keepers = CONFIG.get('general').get('keep_files').copy()
     compress = CONFIG.get('general').get('compress_files')
+    tidy_opts = dict(
+        workers = CONFIG.get('general').get('tidy_workers', 1),
+        codec = CONFIG.get('general').get('compress_codec', 'gzip'),
+        level = CONFIG.get('general').get('compress_level', None),
+    )
     file_globs = config.TMP_FILE_GLOBS.copy()
 
     # special cases of files tracked without 
@@ -574,7 +1235,7 @@ def finalize_outfiles(working_dir='', blastdb=None, annots=[], probes=[]):
             if ftype in keepers:
                 log.info(f'Tidying up {ftype}')
                 file_globs.pop(ftype)
-                tidy_up_files(flist, working_dir, True, compress)
+                tidy_up_files(flist, working_dir, True, compress, **tidy_opts)
         except Exception:
             pass
 
@@ -593,7 +1254,7 @@ def finalize_outfiles(working_dir='', blastdb=None, annots=[], probes=[]):
         log.info(f'Tidying up {k}')
         glob = ''.join(['*', glb]) if glb else argfiles[k]
         if k in keepers:
-            tidy_up_files(glob, working_dir, True, compress)
+            tidy_up_files(glob, working_dir, True, compress, **tidy_opts)
         else:
             tidy_up_files(glob, working_dir, keep=False)
 
@@ -602,10 +1263,12 @@ def finalize_outfiles(working_dir='', blastdb=None, annots=[], probes=[]):
 
 
 #~~~~~~~~~ Main Hub: Copy/Modify bin/prokka files, makeblastdb; loop gbins ~~~~~
-def main_pipe(*, config_file:'c'=None, debug=False):
+def main_pipe(*, config_file:'c'=None, workers:'w'=0, resume=False, debug=False):
     """Execute the steps of the targeted probe design pipeline
 
     :param config_file: non-default TOML configuration file to set modified options.
+    :param workers: number of genome bins processed in parallel (overrides config).
+    :param resume: skip steps already done in a previous run (overrides config).
     :param debug: show internal debugging messages and configuration.
     """
     try:
@@ -634,6 +1297,17 @@ def main_pipe(*, config_file:'c'=None, debug=False):
         gbin_dir = APath(CONFIG.get('paths').get('genome_bins'))
         gbin_suff = CONFIG.get('general').get('genome_bins_suffix')
 
+        """Completed steps are always recorded, so any run can be resumed;
+        'resume' only skips those already done. A run without it redoes all
+        steps, so the records of previous runs are cleared first."""
+        log.name = 'Targeted:Manifest'
+        resume = resume or CONFIG.get('general').get('resume', False)
+        manifest_db = working_dir / DB_CFG.get('manifestdb').get('name')
+        manifest = PipelineManifest(manifest_db.abspath, resume=resume)
+        if not resume:
+            log.info(f'Not resuming: clearing checkpoints of previous runs, {manifest_db}')
+            manifest.clear()
+
         """Make blast dbs for all ffn, if no preexisting designated use_blastdb"""
         log.name = 'Targeted:blastdb'
         use_blastdb = CONFIG.get('paths').get('use_blastdb', None)
@@ -657,28 +1331,104 @@ def main_pipe(*, config_file:'c'=None, debug=False):
                 # log.name = 'Targeted:GetMwgsProkka'
                 prokka_dir = APath(CONFIG.get('paths').get('prokka_dir'))
                 prokka_suff = CONFIG.get('general').get('prokka_prediction_suffix')
-                prokka_files = get_metagenome_cluster_prokka(prokka_dir, working_dir, suffix=prokka_suff)
-
+                prokka_key, prokka_done = step_checkpoint(
+                    manifest, RUN_STEPS_ID, 'prokka', inputs=sorted(prokka_dir.glob('*'+prokka_suff)),
+                    outputs=[blastdb_path])
                 log.info(f'Creating blastdb: {blastdb_path.abspath}')
-                """concat all clusters' prokka_files into one for blasting"""
-                blast_all_clusters = concatenate_files(
-                    working_dir.abspath,
-                    blastdb_path.abspath,
-                    suffix=prokka_suff,
-                    clobber=True
-                )
-                makeblastdb(blast_all_clusters)
+                if prokka_done:
+                    prokka_files = [ working_dir / ffn.name
+                                     for ffn in sorted(prokka_dir.glob('*'+prokka_suff))
+                                     if (working_dir / ffn.name).exists() ]
+                    blast_all_clusters = blastdb_path.abspath
+                elif CONFIG.get('general').get('prokka_direct_concat', False):
+                    """write all clusters' prokka files straight into one for blasting"""
+                    prokka_files = get_metagenome_cluster_prokka(
+                        prokka_dir, working_dir, suffix=prokka_suff,
+                        concat_file=blastdb_path.abspath)
+                    blast_all_clusters = blastdb_path.abspath
+                else:
+                    prokka_files = get_metagenome_cluster_prokka(prokka_dir, working_dir,
+                                                                 suffix=prokka_suff)
+                    """concat all clusters' prokka_files into one for blasting"""
+                    blast_all_clusters = concatenate_files(
+                        working_dir.abspath,
+                        blastdb_path.abspath,
+                        suffix=prokka_suff,
+                        clobber=True
+                    )
+                manifest.mark(RUN_STEPS_ID, 'prokka', prokka_key)
+
+                if CONFIG.get('blastn').get('engine', 'blastn') != 'kmer':
+                    blastdb_key, blastdb_done = step_checkpoint(
+                        manifest, RUN_STEPS_ID, 'blastdb', inputs=[blast_all_clusters],
+                        upstream=prokka_key, outputs=blastdb_files(blast_all_clusters),
+                        redo=not prokka_done)
+                    if not blastdb_done:
+                        makeblastdb(blast_all_clusters)
+                    manifest.mark(RUN_STEPS_ID, 'blastdb', blastdb_key)
             except Exception as e:
                 log.error(f'Unable to create blastdb: {blastdb_name}')
                 raise e
 
+        log.name = 'Targeted:Manifest'
+        manifest.file_hash(blast_all_clusters) # hashed once here; workers get the cache
+
+        """Create the single results db for all bins, if so configured"""
+        results_db = None
+        if CONFIG.get('sqlite').get('consolidate_bins', False):
+            log.name = 'Targeted:ResultsDB'
+            results_db = working_dir / DB_CFG.get('resultsdb').get('name')
+            if not results_db.exists():
+                """a new results db holds no matches of a previous run"""
+                manifest.clear(step='blast')
+            init_results_db(results_db.abspath)
+
         """Design probes for genome bin fastas"""
-        #TODO: run in parallel, use multiprocessing.Pool ??
+        workers = int(workers or CONFIG.get('general').get('workers', 1))
+        genome_bins = sorted(gbin_dir.glob('*'+gbin_suff))
         probe_fastas = []
-        for gbin in gbin_dir.glob('*'+gbin_suff):
-            log.name = 'Targeted Pipeline'
-            probe_file = targeted_genome_bin_probes(gbin, blastdb=blast_all_clusters)
-            probe_fastas.append(probe_file)
+        batch_size = int(CONFIG.get('blastn').get('batch_bins', 1))
+
+        """Index probe seqs of all bins first, to drop shared ones before blasting"""
+        probe_index = None
+        if CONFIG.get('blastn').get('drop_shared_probes', False):
+            log.name = 'Targeted:ProbeIndex'
+            probe_index_db = working_dir / DB_CFG.get('probeindexdb').get('name')
+            probe_index = index_genome_bin_probes(genome_bins, probe_index_db.abspath,
+                                                  workers=workers, debug=debug,
+                                                  manifest=manifest)
+
+        if CONFIG.get('blastn').get('engine', 'blastn') == 'kmer':
+            """index built once here; forked workers share it"""
+            log.name = 'Targeted:KmerIndex'
+            KmerIndex.cached(blast_all_clusters, CONFIG.get('catch').get('probe_length'))
+
+        if workers > 1:
+            log.name = 'Targeted:Parallel'
+            probe_fastas = parallel_genome_bin_probes(
+                genome_bins, blast_all_clusters, workers=workers,
+                batch_size=batch_size, debug=debug, manifest=manifest,
+                probe_index=probe_index)
+        else:
+            """one process: the manifest db (if any) is kept open for the whole run"""
+            with Sdb.session(manifest.dbname):
+                if batch_size > 1:
+                    for gbins in batch_genome_bins(genome_bins, batch_size):
+                        log.name = 'Targeted Pipeline'
+                        results = targeted_genome_bin_batch(gbins, blast_all_clusters,
+                                                            manifest=manifest,
+                                                            probe_index=probe_index)
+                        probe_fastas += [ pfile for _, pfile, error in results if not error ]
+                        failed = [ gbin.name for gbin, _, error in results if error ]
+                        if failed:
+                            log.warning(f'Genome bins failed: {", ".join(failed)}')
+                else:
+                    for gbin in genome_bins:
+                        log.name = 'Targeted Pipeline'
+                        probe_file = targeted_genome_bin_probes(gbin, blastdb=blast_all_clusters,
+                                                                manifest=manifest,
+                                                                probe_index=probe_index)
+                        probe_fastas.append(probe_file)
     except Exception as e:
         log.error(f'Error. {e.args}')
         raise e
@@ -690,6 +1440,10 @@ def main_pipe(*, config_file:'c'=None, debug=False):
         if debug:
             log.notice(f'''\nDatabase Config options used: {tomlkit.dumps(DB_CFG)}''')
 
+        if results_db:
+            log.name = 'Targeted:ResultsDB'
+            summarize_results_db(results_db.abspath)
+
         log.info('Finalize by tidying up intermediate files.')
         finalize_outfiles(working_dir,
                           blastdb=blastdb_name,
@@ -0,0 +1,77 @@
+import os
+import random
+import sys
+import tempfile
+
+import pytest
+import tomlkit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+"""the log file is opened in the cwd on import: keep it out of the tree"""
+_cwd = os.getcwd()
+os.chdir(tempfile.mkdtemp(prefix='tprobe-tests-'))
+from tprobe import CONFIG, SqliteIO, log
+log.filename = os.path.abspath(log.filename)
+os.chdir(_cwd)
+from tprobe.abspath import AbsPath as APath
+
+
+def random_seq(rng, length):
+    return ''.join(rng.choice('ACGT') for _ in range(length))
+
+
+def filtered_probes(working_dir, bin_name):
+    """sorted ids of the filtered probes in a bin's db"""
+    db = working_dir / f'{bin_name}_targeted_probe_cluster.db'
+    return sorted(SqliteIO.iter_select(str(db), 'probes_filtered', fields='probe_id',
+                                       row_mode='tuple'))
+
+
+@pytest.fixture
+def config():
+    """CONFIG, restored to its options before the test"""
+    saved = tomlkit.dumps(CONFIG)
+    yield CONFIG
+    CONFIG.clear()
+    CONFIG.update(tomlkit.parse(saved))
+    SqliteIO.close_session(force=True)
+
+
+@pytest.fixture
+def pipeline_dirs(tmp_path, config):
+    """Working dir, genome bins and concatenated prokka fasta of 5 small
+    random bins (and their prokka ffn files, for main_pipe), CONFIG'd for the
+    native tiler and k-mer engine (no apps). Each bin has two genes; the
+    first of bin0 is also in bin1 (shared probes).
+    Return tuple of (working_dir, list of genome bins, prokka fasta path).
+    """
+    rng = random.Random(1)
+    working_dir = tmp_path / 'pipeline_results'
+    gbin_dir = tmp_path / 'cluster_genome_bins'
+    working_dir.mkdir()
+    gbin_dir.mkdir()
+    prokka_dir = tmp_path / 'cluster_prokka_annotations'
+    prokka_dir.mkdir()
+    prokka_fasta = working_dir / 'all_clusters_prokka.fasta'
+
+    shared_gene = random_seq(rng, 200)
+    with open(prokka_fasta, 'w') as prokka_fh:
+        for idx in range(5):
+            genes = [ shared_gene if idx in (0, 1) else random_seq(rng, 200),
+                      random_seq(rng, 200) ]
+            with open(gbin_dir / f'bin{idx}.fasta', 'w') as gbin_fh:
+                gbin_fh.write(f'>contig{idx}\n{"".join(genes)}\n')
+            ffn = f'>GENE_{idx}_0 metK ribosomal\n{genes[0]}\n>GENE_{idx}_1 foo bar\n{genes[1]}\n'
+            (prokka_dir / f'bin{idx}.ffn').write_text(ffn)
+            prokka_fh.write(f'>bin{idx}_GENE_{idx}_0_metK_ribosomal\n{genes[0]}\n')
+            prokka_fh.write(f'>bin{idx}_GENE_{idx}_1_foo_bar\n{genes[1]}\n')
+
+    config['paths']['working_dir'] = str(working_dir)
+    config['paths']['genome_bins'] = str(gbin_dir)
+    config['paths']['prokka_dir'] = str(prokka_dir)
+    config['catch']['engine'] = 'native'
+    config['blastn']['engine'] = 'kmer'
+    config['general']['final_probe_amount'] = '5'
+    genome_bins = sorted(APath(gbin_dir).glob('*.fasta'))
+    return APath(working_dir), genome_bins, str(prokka_fasta)
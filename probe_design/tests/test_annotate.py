@@ -0,0 +1,37 @@
+import re
+import sqlite3
+
+import pytest
+
+from tprobe import annotate
+from tprobe.annotate import AnnotationClassifier
+
+EXCLUDE = [ 'tRNA', 'ribosomal_RNA', '16S%rRNA', 'Mn+2' ]
+SSEQIDS = [ 'bin0_GENE_1_tRNA-Leu', 'bin0_GENE_2_TRNA_x', 'bin0_GENE_3_ribosomal_RNA',
+            'bin0_GENE_4_ribosomalXRNA', 'bin0_GENE_5_16S_ribosomal_rRNA',
+            'bin0_GENE_6_16S', 'bin0_GENE_7_Mn+2_transporter', 'bin0_GENE_8_Mnn2',
+            'bin0_GENE_9_metK', 'bin0_GENE_10_rpsB' ]
+
+
+def sql_like_excluded(sseqids, exclude_list):
+    """is_excluded of each sseqid, as the SQL 'LIKE "%pattern%"' filter has it"""
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE hits (sseqid TEXT)')
+    conn.executemany('INSERT INTO hits VALUES (?)', [ (s,) for s in sseqids ])
+    where = ' OR '.join('sseqid LIKE ?' for _ in exclude_list)
+    params = [ f'%{p}%' for p in exclude_list ]
+    return [ row[0] for row in conn.execute(f'SELECT ({where}) FROM hits ORDER BY rowid',
+                                            params) ]
+
+
+@pytest.mark.parametrize('use_automaton', [True, False])
+def test_classify_equals_sql_like(monkeypatch, use_automaton):
+    if use_automaton:
+        pytest.importorskip('ahocorasick')
+    else:
+        monkeypatch.setattr(annotate, 'ahocorasick', None)
+    classifier = AnnotationClassifier(re.compile('metK|rpsB'), EXCLUDE)
+    classes = [ classifier.classify(s) for s in SSEQIDS ]
+    assert [ c[1] for c in classes ] == sql_like_excluded(SSEQIDS, EXCLUDE)
+    assert [ c[0] for c in classes ] == [0] * 8 + [1, 1]
+    assert classifier.classify(SSEQIDS[0]) is classes[0] # memoized
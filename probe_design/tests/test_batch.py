@@ -0,0 +1,94 @@
+import pytest
+
+import targeted_probe_design as tpd
+
+from conftest import filtered_probes
+
+
+def test_batch_of_one_bin_keeps_probes_file(pipeline_dirs):
+    working_dir, genome_bins, blastdb = pipeline_dirs
+    results = tpd.targeted_genome_bin_batch(genome_bins[:1], blastdb)
+    assert len(results) == 1
+    gbin, probes_file, error = results[0]
+    assert gbin == genome_bins[0] and error is None
+    assert probes_file.is_file()
+    assert (working_dir / 'bin0_targeted_probe_cluster.db').is_file()
+
+
+def test_odd_bin_count_batches(pipeline_dirs):
+    working_dir, genome_bins, blastdb = pipeline_dirs
+    batches = tpd.batch_genome_bins(genome_bins, 2)
+    assert [ len(b) for b in batches ] == [2, 2, 1]
+
+    probes_files = []
+    for gbins in batches:
+        probes_files += [ pfile for _, pfile, _ in tpd.targeted_genome_bin_batch(gbins, blastdb) ]
+    assert [ p.name for p in probes_files ] == [ f'bin{i}.probes.fasta' for i in range(5) ]
+    assert all(p.is_file() for p in probes_files)
+    assert not list(working_dir.glob('*.batch.*'))
+    for idx in range(5):
+        for which in ('musicc', 'normal'):
+            assert (working_dir / f'bin{idx}.probes.final.{which}.fasta').is_file()
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_deduped_batch_matches_single_bins(pipeline_dirs, config, tmp_path, stream):
+    working_dir, genome_bins, blastdb = pipeline_dirs
+    config['blastn']['dedup_queries'] = True
+    config['blastn']['stream_results'] = stream
+    tpd.targeted_genome_bin_batch(genome_bins[:3], blastdb)
+    batched = { g.stem: filtered_probes(working_dir, g.stem) for g in genome_bins[:3] }
+    assert batched['bin2'] # a bin of unique genes keeps probes
+
+    tpd.targeted_genome_bin_batch(genome_bins[:3], blastdb) # rerun replaces, not appends
+    assert filtered_probes(working_dir, 'bin2') == batched['bin2']
+
+    single_dir = tmp_path / 'single_results'
+    single_dir.mkdir()
+    config['paths']['working_dir'] = str(single_dir)
+    config['blastn']['dedup_queries'] = False
+    for gbin in genome_bins[:3]:
+        tpd.targeted_genome_bin_probes(gbin, blastdb)
+        assert filtered_probes(single_dir, gbin.stem) == batched[gbin.stem]
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_batch_isolates_failed_bins(pipeline_dirs, config, monkeypatch, stream):
+    working_dir, genome_bins, blastdb = pipeline_dirs
+    config['blastn']['stream_results'] = stream
+    missing = tpd.APath(genome_bins[0].parent / 'bin9.fasta')
+    process = tpd.process_genome_bin_blasts
+    def process_failing(gbin, *args, **kwargs):
+        if gbin.stem == 'bin1':
+            raise RuntimeError('bin1 failed')
+        return process(gbin, *args, **kwargs)
+    monkeypatch.setattr(tpd, 'process_genome_bin_blasts', process_failing)
+
+    results = tpd.targeted_genome_bin_batch([genome_bins[0], missing, genome_bins[1],
+                                             genome_bins[2]], blastdb)
+    errors = { gbin.stem: error for gbin, _, error in results }
+    assert errors['bin0'] is None and errors['bin2'] is None
+    assert 'bin1 failed' in errors['bin1'] and errors['bin9']
+    for gbin, probes_file, error in results:
+        assert (probes_file is None) == (error is not None)
+    for idx in (0, 2):
+        assert (working_dir / f'bin{idx}.probes.final.normal.fasta').is_file()
+
+
+def test_streamed_blasts_equal_buffered(pipeline_dirs, config, tmp_path):
+    working_dir, genome_bins, blastdb = pipeline_dirs
+    tpd.targeted_genome_bin_probes(genome_bins[2], blastdb)
+    buffered = filtered_probes(working_dir, 'bin2')
+    assert buffered
+
+    config['blastn']['stream_results'] = True
+    tpd.targeted_genome_bin_probes(genome_bins[2], blastdb)
+    assert filtered_probes(working_dir, 'bin2') == buffered
+
+
+def test_streamed_blast_of_missing_probes_file(pipeline_dirs, tmp_path):
+    _, _, blastdb = pipeline_dirs
+    missing = tpd.APath(tmp_path / 'missing.probes.fasta')
+    assert 'is not a file' in tpd.blast_clust_probes_on_genome(missing, blastdb)
+    with pytest.raises(FileNotFoundError):
+        tpd.blast_clust_probes_on_genome(missing, blastdb, stream=True)
@@ -0,0 +1,35 @@
+from tprobe import VirtualBlacklist
+from tprobe.utils import read_fasta
+
+
+BINS = { 'bin0': '>c0 x\nACGT\nAC\n>c1\nGG\n', 'bin1': '>c2\nTTTT', # no final newline
+         'bin2': '>c3 y z\nCCA\n' }
+
+
+def make_blacklists(tmp_path):
+    for bin_name, fasta in BINS.items():
+        (tmp_path / f'{bin_name}.fasta').write_text(fasta)
+    shared = tmp_path / 'blacklist.all_bins.fasta'
+    VirtualBlacklist.build_shared_fasta(sorted(tmp_path.glob('bin*.fasta')), shared)
+    return VirtualBlacklist.for_all_bins(shared)
+
+
+def test_blacklists_equal_other_bins(tmp_path):
+    blacklists = make_blacklists(tmp_path)
+    assert [ bl.bin_name for bl in blacklists ] == ['bin0', 'bin1', 'bin2']
+
+    records = { name: list(read_fasta(str(tmp_path / f'{name}.fasta'))) for name in BINS }
+    for blacklist in blacklists:
+        others = [ rec for name in BINS if name != blacklist.bin_name
+                   for rec in records[name] ]
+        assert list(blacklist.iter_records()) == others
+        written = blacklist.write_fasta(str(tmp_path / f'blacklist.{blacklist.bin_name}'))
+        assert list(read_fasta(written)) == others
+
+
+def test_blacklist_seqidlists(tmp_path):
+    excluded = { 'bin0': ['c0', 'c1'], 'bin1': ['c2'], 'bin2': ['c3'] }
+    for blacklist in make_blacklists(tmp_path):
+        assert blacklist.excluded_seqids() == excluded[blacklist.bin_name]
+        seqidlist = blacklist.write_seqidlist(str(tmp_path / f'{blacklist.bin_name}.seqidlist'))
+        assert open(seqidlist).read().split() == excluded[blacklist.bin_name]
@@ -0,0 +1,112 @@
+import gzip
+import sqlite3
+
+import pytest
+
+from tprobe import SqliteIO as Sdb
+
+
+@pytest.fixture
+def probes_db(tmp_path):
+    """db of a 'probes' table of 25 rows"""
+    db = str(tmp_path / 'probes.db')
+    Sdb.exec_ddl(db, 'CREATE TABLE probes (probe_id TEXT, gc_pct REAL, probe_seq TEXT);')
+    Sdb.import_rows(([ f'p{i}', i * 1.5, 'ACGT' * (i % 3 + 1) ] for i in range(25)),
+                    db, 'probes', ['probe_id', 'gc_pct', 'probe_seq'], chunk_size=7)
+    yield db
+    Sdb.close_session(force=True)
+
+
+def test_session_reuses_connection(probes_db):
+    with Sdb.connection(probes_db) as con:
+        pass
+    with pytest.raises(sqlite3.ProgrammingError): # closed on exit, not in a session
+        con.execute('SELECT 1;')
+
+    with Sdb.session(probes_db):
+        with Sdb.connection(probes_db) as con:
+            pass
+        with Sdb.session(probes_db): # re-entered: same connection
+            with Sdb.connection(probes_db) as nested:
+                assert nested is con
+        assert len(list(Sdb.iter_select(probes_db, 'probes'))) == 25
+        con.execute('SELECT 1;') # still open
+    with pytest.raises(sqlite3.ProgrammingError):
+        con.execute('SELECT 1;')
+    assert not Sdb._sessions
+
+
+def test_iter_select_row_modes(probes_db):
+    select = lambda **kws: list(Sdb.iter_select(probes_db, 'probes', fields=['probe_id', 'gc_pct'],
+                                                where='gc_pct < 6', **kws))
+    expected = [ ('p0', 0.0), ('p1', 1.5), ('p2', 3.0), ('p3', 4.5) ]
+    assert select(row_mode='tuple') == expected
+    assert select(row_mode='tuple', header=True) == [('probe_id', 'gc_pct')] + expected
+    assert select() == [ dict(probe_id=p, gc_pct=g) for p, g in expected ]
+    assert [ tuple(r) for r in select(row_dict=False) ] == expected
+    records = select(row_mode='record')
+    assert [ (r.probe_id, r.gc_pct) for r in records ] == expected
+    assert select(row_mode='tuple', chunk_rows=3) == [ expected[:3], expected[3:] ]
+    assert select(row_mode='tuple', header=True, chunk_rows=3) == \
+        [ [('probe_id', 'gc_pct')], expected[:3], expected[3:] ]
+    assert [ len(c) for c in select(row_mode='record', chunk_rows=3) ] == [3, 1]
+    with pytest.raises(ValueError):
+        select(row_mode='nope')
+
+
+def test_export_csv_formats(probes_db, tmp_path):
+    rows = list(Sdb.iter_select(probes_db, 'probes', row_mode='tuple'))
+    csv_file = tmp_path / 'probes.csv'
+    assert Sdb.export_csv(probes_db, 'probes', csv_file, chunk_rows=4) == 25
+    lines = csv_file.read_text().splitlines()
+    assert lines[0] == 'probe_id,gc_pct,probe_seq'
+    assert lines[1:] == [ ','.join(str(v) for v in row) for row in rows ]
+    """appending to a non-empty file: no second header"""
+    Sdb.export_csv(probes_db, 'probes', csv_file, where='gc_pct > 30', append=True)
+    assert csv_file.read_text().splitlines() == lines + lines[-4:]
+
+    tsv_gz = tmp_path / 'probes.tsv.gz'
+    Sdb.export_csv(probes_db, 'probes', tsv_gz, fields='probe_id, probe_seq', limit=2)
+    with gzip.open(tsv_gz, 'rt') as fh:
+        assert fh.read() == 'probe_id\tprobe_seq\np0\tACGT\np1\tACGTACGT\n'
+
+    fasta = tmp_path / 'probes.fasta'
+    Sdb.export_csv(probes_db, 'probes', fasta, where="probe_id IN ('p2', 'p3')")
+    assert fasta.read_text() == '>p2|3.0\nACGTACGTACGT\n>p3|4.5\nACGT\n'
+    with pytest.raises(ValueError):
+        Sdb.export_csv(probes_db, 'probes', fasta, fmt='xml')
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_import_csv_round_trip(probes_db, tmp_path, workers):
+    csv_gz = tmp_path / 'probes.csv.gz'
+    Sdb.export_csv(probes_db, 'probes', csv_gz)
+    db = str(tmp_path / 'imported.db')
+    assert Sdb.import_csv(str(csv_gz), db, chunk_rows=4, workers=workers, sample_rows=3) == 25
+    """table named for the file; types from the sample"""
+    cols = [ (c['name'], c['type']) for c in Sdb.iter_select(db, 'pragma_table_info("probes")') ]
+    assert cols == [ ('probe_id', 'TEXT'), ('gc_pct', 'REAL'), ('probe_seq', 'TEXT') ]
+    select = lambda dbname: list(Sdb.iter_select(dbname, 'probes', row_mode='tuple'))
+    assert select(db) == select(probes_db)
+
+
+def test_import_csv_typing(tmp_path):
+    csv_file = tmp_path / 'values.csv'
+    csv_file.write_text('a,b,c,d\n1,2,x,\n2,2.5,3,\n3,4,5,\n\nx,5,6,\n')
+    db = str(tmp_path / 'values.db')
+    Sdb.import_csv(str(csv_file), db, table='vals', fields=['w', 'x', 'y', 'z'], sample_rows=2)
+    """'x' is past the sample: kept as text in the INTEGER column"""
+    assert list(Sdb.iter_select(db, 'vals', row_mode='tuple')) == \
+        [ (1, 2.0, 'x', None), (2, 2.5, '3', None), (3, 4.0, '5', None), ('x', 5.0, '6', None) ]
+    with pytest.raises(ValueError):
+        Sdb.import_csv(str(csv_file), db, fields=['w'])
+
+
+def test_import_csv_quoted_newlines(tmp_path):
+    """serial import: records spanning chunks of lines are parsed whole"""
+    csv_file = tmp_path / 'notes.csv'
+    csv_file.write_text('id,note\n1,"a\nb"\n2,"c\n\nd,e"\n3,f\n')
+    db = str(tmp_path / 'notes.db')
+    assert Sdb.import_csv(str(csv_file), db, chunk_rows=1, sample_rows=1) == 3
+    assert list(Sdb.iter_select(db, 'notes', row_mode='tuple')) == \
+        [ (1, 'a\nb'), (2, 'c\n\nd,e'), (3, 'f') ]
@@ -0,0 +1,25 @@
+import targeted_probe_design as tpd
+
+FIELDS = [ 'qseqid', 'sseqid', 'pident', 'length', 'qseq', 'gc_pct', 'is_musicc',
+           'is_excluded' ]
+SEQ = 'ACGT' * 10
+
+
+def blast_row(qseqid, sseqid='gene_0', pident='100.000', gc_pct=50.0, is_excluded=0):
+    return [ qseqid, sseqid, pident, '40', SEQ, gc_pct, 0, is_excluded ]
+
+
+def test_filter_probe_seqs(tmp_path, config):
+    db = str(tmp_path / 'bin_1_targeted_probe_cluster.db')
+    rows = [ blast_row('bin_1_probe_0'),
+             blast_row('bin_1_probe_1'), blast_row('bin_1_probe_1', 'gene_1'), # not unique
+             blast_row('bin_1_probe_2', pident='95.000'),
+             blast_row('bin_1_probe_3', gc_pct=30.0),
+             blast_row('bin_1_probe_4', is_excluded=1),
+             blast_row('binX1_probe_0'), # 'bin_1%' would match it
+             blast_row('bin_10_probe_0') ]
+    tpd.import_blasts_to_db(rows, db_name=db, fields=FIELDS)
+    tpd.filter_probe_seqs(db, 'bin_1')
+    filtered = list(tpd.Sdb.iter_select(db, 'probes_filtered', fields='probe_id',
+                                        row_mode='tuple'))
+    assert filtered == [('bin_1_probe_0',)]
@@ -0,0 +1,20 @@
+import pytest
+
+import targeted_probe_design as tpd
+
+
+@pytest.mark.parametrize('keep', [True, False])
+def test_finalize_blast_hits_files(tmp_path, config, monkeypatch, keep):
+    monkeypatch.setattr(tpd, 'gzip_compress', lambda *args: None) # the session's log file
+    config['general']['compress_files'] = True
+    if not keep:
+        config['general']['keep_files'] = [ k for k in config['general']['keep_files']
+                                            if not k.startswith('blast_') ]
+    hits_files = [ tmp_path / f'bin0.probes.blasts.{fmt}' for fmt in ('csv', 'parquet', 'arrow') ]
+    for hits_file in hits_files:
+        hits_file.write_text('qseqid\n')
+
+    tpd.finalize_outfiles(str(tmp_path))
+    for hits_file in hits_files:
+        assert not hits_file.exists()
+        assert (tmp_path / f'{hits_file.name}.gz').exists() == keep
@@ -0,0 +1,76 @@
+import random
+
+import pytest
+
+from tprobe.kmer import KmerIndex, kmer_match_probes
+from tprobe.probeindex import reverse_complement
+
+from conftest import random_seq
+
+
+def naive_matches(seqs, probe):
+    """(seq index, 0-based start, strand) of every exact match, by scanning;
+    none for probes with other bases than ACGT (as windows of them are not indexed)"""
+    found = []
+    if set(probe.upper()) - set('ACGT'):
+        return found
+    for seq_idx, seq in enumerate(seqs):
+        for strand, query in (('+', probe), ('-', reverse_complement(probe))):
+            start = seq.find(query)
+            while start != -1:
+                found.append((seq_idx, start, strand))
+                start = seq.find(query, start + 1)
+    return sorted(found)
+
+
+@pytest.fixture
+def db_fasta(tmp_path):
+    """Seqs with repeats (either strand), Ns and lowercase; and probes of them"""
+    rng = random.Random(3)
+    repeat = random_seq(rng, 12)
+    seqs = []
+    for idx in range(20):
+        parts = [ random_seq(rng, rng.randint(5, 60)) for _ in range(3) ]
+        seqs.append(repeat.join(parts) if idx % 3 else reverse_complement(repeat).join(parts))
+    seqs[4] = seqs[4][:20] + 'NN' + seqs[4][22:]
+    seqs[5] = seqs[5].lower()
+    fasta = tmp_path / 'db.fasta'
+    with open(fasta, 'w') as fh:
+        for idx, seq in enumerate(seqs):
+            fh.write(f'>gene{idx} some annotation\n{seq}\n')
+    probes = [ repeat, seqs[4][15:27], 'ACGTNACGTACG' ] + \
+             [ rng.choice(seqs)[:12] for _ in range(20) ] + \
+             [ random_seq(rng, 12) for _ in range(20) ]
+    return str(fasta), [ s.upper() for s in seqs ], probes
+
+
+@pytest.mark.parametrize('chunk_bases', [7, 1 << 20])
+def test_kmer_index_equals_naive_scan(db_fasta, monkeypatch, chunk_bases):
+    fasta, seqs, probes = db_fasta
+    monkeypatch.setattr(KmerIndex, 'CHUNK_BASES', chunk_bases)
+    index = KmerIndex(fasta, 12)
+    assert len(index.keys) == sum(len(s) - 11 for s in seqs) - 13 # windows with Ns
+    assert index.find_all(probes) == [ naive_matches(seqs, p) for p in probes ]
+    assert index.find_all([ p.lower() for p in probes[:3] ]) == index.find_all(probes[:3])
+
+
+def test_kmer_match_probes_rows(db_fasta, tmp_path):
+    fasta, seqs, probes = db_fasta
+    probe_file = tmp_path / 'probes.fasta'
+    with open(probe_file, 'w') as fh:
+        fh.write(f'>p0\n{probes[0]}\n>p1\n{probes[3]}\n')
+    fields = [ 'qseqid', 'sseqid', 'pident', 'length', 'sstart', 'send', 'sstrand' ]
+    rows = list(kmer_match_probes(str(probe_file), fasta, fields, max_subjects=5))
+    repeats = naive_matches(seqs, probes[0])
+    subjects = sorted(set(m[0] for m in repeats))[:5]
+    assert [ r[0] for r in rows ].count('p0') == sum(1 for m in repeats if m[0] in subjects)
+    for row in rows:
+        assert row[2:4] == ['100.000', '12']
+        sstart, send = int(row[4]), int(row[5])
+        assert (sstart < send) == (row[6] == 'plus')
+        seq = seqs[int(row[1][4:])][min(sstart, send) - 1:max(sstart, send)]
+        query = probes[0] if row[0] == 'p0' else probes[3]
+        assert seq == (query if row[6] == 'plus' else reverse_complement(query))
+
+    with pytest.raises(ValueError):
+        next(kmer_match_probes(str(probe_file), fasta, ['qseqid', 'evalue']))
@@ -0,0 +1,106 @@
+import random
+
+import pytest
+
+from tprobe.kmer import kmer_match_probes
+from tprobe.probeindex import (ProbeIndex, canonical_hash, fan_out_blasts,
+                               reverse_complement, write_unique_queries)
+
+from conftest import random_seq
+
+FIELDS = [ 'qseqid', 'sseqid', 'pident', 'length', 'qseq', 'sseq',
+           'qstart', 'qend', 'sstart', 'send', 'sstrand' ]
+
+
+@pytest.fixture
+def probes_and_db(tmp_path):
+    """Probes of two bins, with repeats on either strand, and a db fasta
+    holding their seqs (some twice)."""
+    rng = random.Random(2)
+    seqs = [ random_seq(rng, 20) for _ in range(6) ]
+    bins = {
+        'binA': [ seqs[0], seqs[1], seqs[0], reverse_complement(seqs[2]), seqs[3] ],
+        'binB': [ seqs[2], reverse_complement(seqs[0]), seqs[4], seqs[1].lower() ],
+    }
+    probes_files = []
+    for bin_name, bin_seqs in bins.items():
+        probes_file = tmp_path / f'{bin_name}.probes.fasta'
+        with open(probes_file, 'w') as fh:
+            for idx, seq in enumerate(bin_seqs):
+                fh.write(f'>{bin_name}_probe_{idx}\n{seq}\n')
+        probes_files.append(str(probes_file))
+    db_fasta = tmp_path / 'db.fasta'
+    with open(db_fasta, 'w') as fh:
+        for idx, seq in enumerate(seqs[:5] + [seqs[1]]):
+            fh.write(f'>gene{idx}\n{random_seq(rng, 30)}{seq}{random_seq(rng, 30)}\n')
+    return probes_files, str(db_fasta), tmp_path
+
+
+def test_write_unique_queries_either_strand(probes_and_db):
+    probes_files, _, tmp_path = probes_and_db
+    query_ids, reps, flipped = write_unique_queries(probes_files, tmp_path / 'q.fasta')
+    assert len(query_ids) == 9
+    assert reps == { 'binA_probe_2': 'binA_probe_0', 'binB_probe_0': 'binA_probe_3',
+                     'binB_probe_1': 'binA_probe_0', 'binB_probe_3': 'binA_probe_1' }
+    assert flipped == { 'binB_probe_0': 20, 'binB_probe_1': 20 }
+
+    query_ids, reps, flipped = write_unique_queries(probes_files, tmp_path / 'q.fasta',
+                                                    exclude={'binA_probe_0'}, dedup=False)
+    assert len(query_ids) == 8 and not reps and not flipped
+
+
+def test_fan_out_equals_all_probes_matched(probes_and_db):
+    probes_files, db_fasta, tmp_path = probes_and_db
+    all_file = tmp_path / 'all.fasta'
+    write_unique_queries(probes_files, all_file, dedup=False)
+    all_blasts = list(kmer_match_probes(str(all_file), db_fasta, FIELDS))
+
+    query_file = tmp_path / 'q.fasta'
+    query_ids, reps, flipped = write_unique_queries(probes_files, query_file)
+    uniq_blasts = list(kmer_match_probes(str(query_file), db_fasta, FIELDS))
+    assert len(uniq_blasts) < len(all_blasts)
+    fanned = list(fan_out_blasts(uniq_blasts, query_ids, reps, flipped, FIELDS))
+
+    """same matches, in query order; a lowercase copy keeps its rep's qseq case"""
+    by_probe = lambda blasts: { (pb[0], pb[1], pb[8], pb[10]) for pb in blasts }
+    assert by_probe(fanned) == by_probe(all_blasts)
+    assert [ pb[0] for pb in fanned ] == [ pb[0] for pb in all_blasts ]
+    upper = lambda blasts: sorted([ v.upper() for v in pb ] for pb in blasts)
+    assert upper(fanned) == upper(all_blasts)
+
+
+def test_fan_out_streams(probes_and_db):
+    probes_files, db_fasta, tmp_path = probes_and_db
+    query_file = tmp_path / 'q.fasta'
+    query_ids, reps, flipped = write_unique_queries(probes_files, query_file)
+    consumed = []
+
+    def matches():
+        for pb in kmer_match_probes(str(query_file), db_fasta, FIELDS):
+            consumed.append(pb[0])
+            yield pb
+
+    fanned = fan_out_blasts(matches(), query_ids, reps, flipped, FIELDS)
+    first = next(fanned)
+    assert first[0] == 'binA_probe_0'
+    assert len(set(consumed)) < len(query_ids) - len(reps)
+
+
+def test_fan_out_rejects_out_of_order():
+    blasts = [ ['p1', 's', '100'], ['p0', 's', '100'] ]
+    with pytest.raises(ValueError):
+        list(fan_out_blasts(blasts, ['p0', 'p1'], {}))
+
+
+def test_probe_index_shared_ids(probes_and_db, tmp_path):
+    probes_files, _, _ = probes_and_db
+    probe_index = ProbeIndex(str(tmp_path / 'index.db'), clear=True)
+    for bin_name, probes_file in zip(('binA', 'binB'), probes_files):
+        probe_index.add_bin(bin_name, probes_file)
+    assert probe_index.index_shared() == 3
+    assert probe_index.shared_ids('binA') == { 'binA_probe_0', 'binA_probe_1',
+                                               'binA_probe_2', 'binA_probe_3' }
+    assert probe_index.shared_ids('binB') == { 'binB_probe_0', 'binB_probe_1',
+                                               'binB_probe_3' }
+    assert probe_index.summary() == (9, 5, 7)
+    assert canonical_hash('ACGTTG') == canonical_hash('caacgt')
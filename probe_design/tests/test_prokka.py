@@ -0,0 +1,39 @@
+import gzip
+
+import targeted_probe_design as tpd
+from tprobe.abspath import AbsPath as APath
+from tprobe.utils import transform_fasta
+
+
+def write_ffns(prokka_dir):
+    prokka_dir.mkdir()
+    with open(prokka_dir / 'bin0.ffn', 'w') as fh:
+        fh.write('>GENE_0 tRNA-Leu thing\nACGT\nTTGA\n>GENE_1 foo bar\nGGCC\n')
+    with gzip.open(prokka_dir / 'bin1.ffn', 'wt') as fh:
+        fh.write('>GENE_0 metK ribosomal\nAAAA\n')
+
+
+def test_direct_concat_equals_copies(tmp_path, config):
+    prokka_dir = tmp_path / 'prokka'
+    write_ffns(prokka_dir)
+    copy_dir = tmp_path / 'copies'
+    copy_dir.mkdir()
+    copies = tpd.get_metagenome_cluster_prokka(APath(prokka_dir), APath(copy_dir), suffix='ffn',
+                                               threads=2)
+    concat_file = tmp_path / 'all.fasta'
+    assert tpd.get_metagenome_cluster_prokka(APath(prokka_dir), APath(copy_dir), suffix='ffn',
+                                             concat_file=str(concat_file)) == []
+    concat = concat_file.read_bytes()
+    assert concat == b''.join(open(c, 'rb').read() for c in copies)
+    assert concat == (b'>bin0_GENE_0_tRNA-Leu_thing\nACGT\nTTGA\n>bin0_GENE_1_foo_bar\nGGCC\n'
+                      b'>bin1_GENE_0_metK_ribosomal\nAAAA\n')
+
+
+def test_transform_fasta_small_chunks(tmp_path):
+    src = tmp_path / 'a.ffn'
+    src.write_bytes(b'>g 1\nAC GT\n>h\nTT\n')
+    for chunk_size in (1, 2, 3, 5, 64):
+        dest = tmp_path / 'b.fasta'
+        with open(dest, 'wb') as fh:
+            transform_fasta(str(src), fh, header_prefix='x y_', chunk_size=chunk_size)
+        assert dest.read_bytes() == b'>x_y_g_1\nAC_GT\n>x_y_h\nTT\n'
@@ -0,0 +1,77 @@
+import importlib.util
+import os
+
+import targeted_probe_design as tpd
+from tprobe import PipelineManifest
+
+
+def test_resume_checkpoints(pipeline_dirs, config, monkeypatch):
+    working_dir, genome_bins, _ = pipeline_dirs
+    monkeypatch.setattr(tpd, 'gzip_compress', lambda *args: None) # the session's log file
+    config['general']['compress_files'] = False
+    manifest_db = working_dir / 'pipeline_manifest.db'
+    probes_file = working_dir / 'bin0.probes.fasta'
+
+    prokka_fasta = working_dir / 'all_clusters_prokka.fasta'
+
+    tpd.main_pipe()
+    assert probes_file.is_file()
+    """recorded without resume too, e.g. to resume a run that died"""
+    steps = list(tpd.Sdb.iter_select(str(manifest_db), PipelineManifest.TABLE,
+                                     fields='bin_name, step', where="status='done'",
+                                     row_mode='tuple'))
+    assert len(steps) == len(genome_bins) * 4 + 1
+    assert (tpd.RUN_STEPS_ID, 'prokka') in steps
+    designed = probes_file.stat().st_mtime_ns
+    ingested = prokka_fasta.stat().st_mtime_ns
+
+    tpd.main_pipe(resume=True)
+    assert probes_file.stat().st_mtime_ns == designed # skipped
+    assert prokka_fasta.stat().st_mtime_ns == ingested
+
+    hits_file = working_dir / 'bin0.probes.blasts.csv'
+    hits_file.unlink()
+    tpd.main_pipe(resume=True)
+    assert probes_file.stat().st_mtime_ns == designed
+    assert hits_file.is_file() # blast output gone: redone
+
+    if importlib.util.find_spec('pyarrow'):
+        config['blastn']['hits_formats'] = ['csv', 'parquet']
+        tpd.main_pipe(resume=True)
+        assert (working_dir / 'bin0.probes.blasts.parquet').is_file() # formats changed: redone
+
+    probes_file.unlink()
+    tpd.main_pipe(resume=True)
+    assert probes_file.is_file() # design output gone: redone
+    designed = probes_file.stat().st_mtime_ns
+
+    config['catch']['probe_stride'] = '10'
+    tpd.main_pipe(resume=True)
+    assert probes_file.stat().st_mtime_ns != designed # config changed: redone
+
+    designed = probes_file.stat().st_mtime_ns
+    tpd.main_pipe()
+    assert probes_file.stat().st_mtime_ns != designed # not resuming: all redone
+    assert prokka_fasta.stat().st_mtime_ns != ingested
+
+
+def test_resume_blastdb(pipeline_dirs, config, monkeypatch):
+    working_dir, _, _ = pipeline_dirs
+    monkeypatch.setattr(tpd, 'gzip_compress', lambda *args: None) # the session's log file
+    config['general']['compress_files'] = False
+    config['blastn']['engine'] = 'blastn'
+    made = []
+    def makeblastdb(fastaname):
+        made.append(fastaname)
+        for db_file in tpd.blastdb_files(fastaname):
+            open(db_file, 'w').close()
+    monkeypatch.setattr(tpd, 'makeblastdb', makeblastdb)
+    monkeypatch.setattr(tpd, 'blast_clust_probes_on_genome', lambda *args, **kwargs: [])
+
+    tpd.main_pipe()
+    tpd.main_pipe(resume=True)
+    assert len(made) == 1 # skipped
+
+    os.remove(tpd.blastdb_files(made[0])[0])
+    tpd.main_pipe(resume=True)
+    assert len(made) == 2 # blastdb gone: redone
@@ -0,0 +1,37 @@
+import pytest
+
+from tprobe import tiling
+from tprobe.tiling import coverage_stats, tile_probes, tile_sequence, tile_starts
+
+
+def test_tile_starts():
+    assert tile_starts(10, 4, 3) == [0, 3, 6]
+    assert tile_starts(11, 4, 3) == [0, 3, 6, 7] # last one flush with the end
+    assert tile_starts(4, 4, 3) == [0]
+    assert tile_starts(3, 4, 3) == []
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_tile_sequence(monkeypatch, use_numpy):
+    if not use_numpy:
+        monkeypatch.setattr(tiling, 'np', None)
+    seq = 'ACGTACGGTTCA'
+    assert tile_sequence(seq, 5, 3) == [ seq[s:s+5] for s in (0, 3, 6, 7) ]
+    assert tile_sequence('ACG', 5, 3) == []
+
+
+def test_coverage_stats():
+    assert coverage_stats(11, [0, 3, 6, 7], 4) == (11, 16)
+    assert coverage_stats(20, [0, 10], 4) == (8, 8)
+
+
+def test_tile_probes(tmp_path):
+    fasta = tmp_path / 'bin.fasta'
+    fasta.write_text('>c0\nAAAACCCCAAAA\n>c1\nAAAACC\n>c2\nAC\n')
+    probe_out, coverage_tsv = tmp_path / 'probes.fasta', tmp_path / 'coverage.tsv'
+    num = tile_probes(str(fasta), str(probe_out), str(coverage_tsv), 4, 4, header_prefix='b_')
+    """c0's last 'AAAA' and c1's first are duplicates"""
+    assert num == 3
+    assert probe_out.read_text() == '>b_probe_0\nAAAA\n>b_probe_1\nCCCC\n>b_probe_2\nAACC\n'
+    header, row = coverage_tsv.read_text().splitlines()
+    assert row.split('\t') == ['bin.fasta', '18', '0.9000', '1.0000']
@@ -0,0 +1,121 @@
+import gzip
+import random
+import sys
+from subprocess import CalledProcessError
+
+import pytest
+
+from tprobe import utils
+from tprobe.utils import cat_files, pct_gc, pct_gc_batch, read_fasta, reservoir_sample
+
+
+def test_read_fasta_gzip(tmp_path):
+    fasta = '>s0 desc\nACGT\nAC\n>s1\n\nGG\n'
+    plain = tmp_path / 'a.fasta'
+    plain.write_text(fasta)
+    packed = tmp_path / 'a.fasta.gz' # named either way, by its magic bytes
+    with gzip.open(packed, 'wt') as fh:
+        fh.write(fasta)
+    expected = [ ('>s0 desc', 'ACGTAC'), ('>s1', 'GG') ]
+    assert list(read_fasta(str(plain))) == expected
+    assert list(read_fasta(str(packed))) == expected
+    (tmp_path / 'b.fasta').write_bytes(packed.read_bytes())
+    assert list(read_fasta(str(tmp_path / 'b.fasta'))) == expected
+
+
+def test_pct_gc_batch_equals_pct_gc():
+    rng = random.Random(4)
+    seqs = [ ''.join(rng.choice('ACGTacgtN') for _ in range(rng.randint(1, 50)))
+             for _ in range(200) ]
+    assert pct_gc_batch(seqs) == [ pct_gc(s) for s in seqs ]
+    assert pct_gc_batch(seqs, points=4) == [ pct_gc(s, 4) for s in seqs ]
+    assert pct_gc_batch([]) == []
+    with pytest.raises(ZeroDivisionError):
+        pct_gc_batch(['ACG', ''])
+
+    np = pytest.importorskip('numpy')
+    fixed = [ s[:20] for s in seqs if len(s) >= 20 ]
+    as_bytes = np.array([ s.encode() for s in fixed ], dtype='S20')
+    assert pct_gc_batch(as_bytes) == [ pct_gc(s) for s in fixed ]
+    assert pct_gc_batch(as_bytes.view(np.uint8).reshape(len(fixed), 20)) == \
+        [ pct_gc(s) for s in fixed ]
+
+
+def test_reservoir_sample():
+    items = list(range(100))
+    assert reservoir_sample(iter(items[:3]), 5) == items[:3]
+    sample = reservoir_sample(iter(items), 10, rng=random.Random(5))
+    assert len(set(sample)) == 10 and sample == sorted(sample)
+    assert reservoir_sample(iter(items), 10, rng=random.Random(5)) == sample
+
+    """each item about equally likely: k/n of the picks"""
+    rng = random.Random(6)
+    counts = [0] * 20
+    for _ in range(4000):
+        for item in reservoir_sample(range(20), 5, rng=rng):
+            counts[item] += 1
+    assert all(800 < c < 1200 for c in counts)
+
+
+@pytest.mark.parametrize('kernel_copy', [True, False])
+def test_cat_files(tmp_path, monkeypatch, kernel_copy):
+    if not kernel_copy:
+        monkeypatch.setattr(utils, '_copy_fd_kernel', lambda in_fd, out_fd, size: 0)
+    contents = [ b'>a\nACGT\n', b'', bytes(range(256)) * 5000, b'>b\nGG' ]
+    src_files = []
+    for idx, content in enumerate(contents):
+        src = tmp_path / f'src{idx}'
+        src.write_bytes(content)
+        src_files.append(str(src))
+    packed = tmp_path / 'src.gz'
+    with gzip.open(packed, 'wb') as fh:
+        fh.write(b'>z\nTT\n')
+    src_files.append(str(packed))
+
+    dest = tmp_path / 'dest'
+    assert cat_files(src_files, str(dest)) == sum(map(len, contents)) + 6
+    assert dest.read_bytes() == b''.join(contents) + b'>z\nTT\n'
+    cat_files(src_files[:1], str(dest), append=True)
+    assert dest.read_bytes() == b''.join(contents) + b'>z\nTT\n' + contents[0]
+    cat_files(src_files[:1], str(dest))
+    assert dest.read_bytes() == contents[0]
+
+
+@pytest.mark.parametrize('fmt', ['parquet', 'arrow'])
+def test_iter_write_arrow(tmp_path, fmt):
+    pa = pytest.importorskip('pyarrow')
+    header = [ 'qseqid', 'sseqid', 'pident', 'length' ]
+    rows = [ [f'p{i}', f'gene{i % 3}', 100.0 - i, 20] for i in range(10) ] + [ ['p10', 'gene1'] ]
+    out_file = str(tmp_path / f'hits.{fmt}')
+    passed = list(utils.iter_write_arrow(out_file, iter(rows), header, fmt=fmt, batch_rows=4,
+                                         col_types=dict(pident='REAL', length='INTEGER')))
+    assert passed == rows
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        table = pq.read_table(out_file)
+    else:
+        with pa.memory_map(out_file) as fh:
+            table = pa.ipc.open_file(fh).read_all()
+    assert table.column_names == header
+    assert pa.types.is_dictionary(table.schema.field('sseqid').type)
+    assert table.schema.field('length').type == pa.int64()
+    assert [ list(r.values()) for r in table.to_pylist() ] == \
+        [ r + [None] * (4 - len(r)) for r in rows ]
+    with pytest.raises(ValueError):
+        next(utils.iter_write_arrow(out_file, iter(rows), header, fmt='csv'))
+
+
+def test_iter_cmd_lines_streams(tmp_path):
+    marker = tmp_path / 'done'
+    script = ('import sys, time\nprint("a", flush=True)\ntime.sleep(0.5)\n'
+              f'print("b")\nopen({str(marker)!r}, "w").close()\n')
+    lines = utils.iter_cmd_lines([sys.executable, '-c', script])
+    assert next(lines) == 'a'
+    assert not marker.exists() # read as it arrives, not when the cmd is done
+    assert list(lines) == ['b']
+    assert marker.exists()
+
+    with pytest.raises(CalledProcessError) as err:
+        list(utils.iter_cmd_lines([sys.executable, '-c',
+                                   'import sys; print("x"); sys.exit("failed!")']))
+    assert 'failed!' in err.value.output
@@ -0,0 +1,87 @@
+import time
+
+import targeted_probe_design as tpd
+from tprobe.abspath import AbsPath as APath
+
+from conftest import filtered_probes
+
+
+def test_parallel_bins_equal_serial(pipeline_dirs, config, tmp_path):
+    working_dir, genome_bins, blastdb = pipeline_dirs
+    missing = APath(tmp_path / 'cluster_genome_bins' / 'bin9.fasta')
+    gbins = genome_bins[:2] + [missing] + genome_bins[2:]
+    probes_files = tpd.parallel_genome_bin_probes(gbins, blastdb, workers=2, batch_size=2)
+    """the missing bin fails, and is left out; the other bins, of its batch too, run"""
+    assert [ p.name for p in probes_files ] == [ f'bin{i}.probes.fasta' for i in range(5) ]
+    assert (working_dir / 'bin2.probes.final.normal.fasta').is_file()
+    parallel = { g.stem: filtered_probes(working_dir, g.stem) for g in genome_bins[:2] }
+    assert parallel['bin0'] or parallel['bin1']
+
+    single_dir = tmp_path / 'single_results'
+    single_dir.mkdir()
+    config['paths']['working_dir'] = str(single_dir)
+    for gbin in genome_bins[:2]:
+        tpd.targeted_genome_bin_probes(gbin, blastdb)
+        assert filtered_probes(single_dir, gbin.stem) == parallel[gbin.stem]
+
+
+def test_parallel_bins_consolidated_materialized(pipeline_dirs, config, monkeypatch, tmp_path):
+    working_dir, genome_bins, _ = pipeline_dirs
+    monkeypatch.setattr(tpd, 'gzip_compress', lambda *args: None) # the session's log file
+    config['general']['compress_files'] = False
+    config['sqlite']['consolidate_bins'] = True
+    config['sqlite']['materialize_filter'] = True
+    tpd.main_pipe(workers=3)
+
+    results_db = str(working_dir / tpd.DB_CFG.get('resultsdb').get('name'))
+    bin_col = tpd.DB_CFG.get('resultsdb').get('bin_col')
+    table_name = tpd.DB_CFG.get('probes_table').get('name')
+    filter_view = tpd.DB_CFG.get('probes_view').get('name')
+    """all bins imported, by concurrent writers, and filtered into the table"""
+    imported = tpd.Sdb.iter_select(results_db, table_name, fields=f'DISTINCT {bin_col}',
+                                   row_mode='tuple')
+    assert sorted(b for b, in imported) == [ g.stem for g in genome_bins ]
+    filter_type = tpd.Sdb.iter_select(results_db, 'sqlite_master', fields='type',
+                                      where=f"name='{filter_view}'", row_mode='tuple')
+    assert list(filter_type) == [('table',)]
+    consolidated = {}
+    for probe_id, bin_name in tpd.Sdb.iter_select(results_db, filter_view,
+                                                  fields=f'probe_id, {bin_col}',
+                                                  row_mode='tuple'):
+        consolidated.setdefault(bin_name, []).append((probe_id,))
+    assert consolidated
+
+    single_dir = tmp_path / 'single_results'
+    single_dir.mkdir()
+    config['paths']['working_dir'] = str(single_dir)
+    config['sqlite']['consolidate_bins'] = False
+    config['sqlite']['materialize_filter'] = False
+    blastdb = str(working_dir / 'all_clusters_prokka.fasta')
+    for gbin in genome_bins:
+        tpd.targeted_genome_bin_probes(gbin, blastdb)
+        assert filtered_probes(single_dir, gbin.stem) == sorted(consolidated.get(gbin.stem, []))
+
+
+def test_parallel_streams_into_consolidated_db(pipeline_dirs, config, monkeypatch):
+    """a worker's streamed blast matches are spooled before its import: the
+    write lock isn't held while another worker's (slow) stream is read"""
+    working_dir, genome_bins, _ = pipeline_dirs
+    monkeypatch.setattr(tpd, 'gzip_compress', lambda *args: None) # the session's log file
+    config['general']['compress_files'] = False
+    config['sqlite']['consolidate_bins'] = True
+    config['blastn']['stream_results'] = True
+    monkeypatch.setattr(tpd.Sdb, 'BUSY_TIMEOUT', 0.2)
+    blast = tpd.blast_clust_probes_on_genome
+    def slow_blast(*args, **kwargs):
+        for row in blast(*args, **kwargs):
+            time.sleep(0.05)
+            yield row
+    monkeypatch.setattr(tpd, 'blast_clust_probes_on_genome', slow_blast)
+    tpd.main_pipe(workers=2)
+
+    results_db = str(working_dir / tpd.DB_CFG.get('resultsdb').get('name'))
+    bin_col = tpd.DB_CFG.get('resultsdb').get('bin_col')
+    table_name = tpd.DB_CFG.get('probes_table').get('name')
+    imported = tpd.Sdb.iter_select(results_db, table_name, fields=f'DISTINCT {bin_col}',
+                                   row_mode='tuple')
+    assert sorted(b for b, in imported) == [ g.stem for g in genome_bins ]
@@ -1,4 +1,8 @@
 from .db import SqliteIO
 from .abspath import AbsPath
 from .config import CONFIG, DB_CFG, read_config_file, write_config_file
-from .log import log, log_init
+from .log import log, log_init, log_channel_group
+from .manifest import PipelineManifest
+from .blacklist import VirtualBlacklist
+from .annotate import AnnotationClassifier
+from .probeindex import ProbeIndex
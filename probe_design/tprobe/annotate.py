@@ -0,0 +1,68 @@
+import re
+
+from .log import log
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+
+def like_regex(pattern):
+    """Return regex (str) matching as SQL 'LIKE "%pattern%"' does,
+    i.e. 'pattern' anywhere, with wildcards '%' (any chars) and '_' (one char).
+    """
+    return ''.join('.*' if c == '%' else '.' if c == '_' else re.escape(c)
+                   for c in pattern)
+
+
+class AnnotationClassifier():
+    """Classify the annotation (sseqid) of blast hits, once per distinct one:
+        - is_musicc: matches 'musicc_re' (see generate_musicc_regex)
+        - is_excluded: contains any of 'exclude_list' (e.g. tRNA, rRNA names),
+          as SQL 'LIKE "%pattern%"': case-insensitive, '_' and '%' wildcards.
+    Exclusions without wildcards are matched together by one Aho-Corasick
+    automaton if module 'pyahocorasick' is available; others (or all, if not)
+    by one compiled regex alternation.
+    """
+
+    def __init__(self, musicc_re, exclude_list=()):
+        self.musicc_re = re.compile(musicc_re) if isinstance(musicc_re, str) else musicc_re
+        self._classes = {} # {sseqid: (is_musicc, is_excluded)}
+
+        wild_patts = [ p for p in exclude_list if '%' in p or '_' in p ]
+        literal_patts = [ p for p in exclude_list if p not in wild_patts ]
+        self.exclude_automaton = None
+        if ahocorasick is not None and literal_patts:
+            self.exclude_automaton = ahocorasick.Automaton()
+            for patt in literal_patts:
+                self.exclude_automaton.add_word(patt.lower(), patt)
+            self.exclude_automaton.make_automaton()
+        else:
+            wild_patts = list(exclude_list)
+
+        self.exclude_re = None
+        if wild_patts:
+            self.exclude_re = re.compile('|'.join(like_regex(p) for p in wild_patts),
+                                         re.IGNORECASE | re.DOTALL)
+        log.debug(f'Annotation exclusions: {len(literal_patts)} literal,'
+                  f' {len(wild_patts)} by regex; automaton: {bool(self.exclude_automaton)}')
+
+
+    def is_excluded(self, sseqid):
+        """Does sseqid contain any of the exclusion patterns?"""
+        if self.exclude_automaton is not None:
+            for _ in self.exclude_automaton.iter(sseqid.lower()):
+                return True
+        return bool(self.exclude_re and self.exclude_re.search(sseqid))
+
+
+    def classify(self, sseqid):
+        """Return tuple of (is_musicc, is_excluded) as 1 or 0, memoized per sseqid"""
+        try:
+            return self._classes[sseqid]
+        except KeyError:
+            classes = (1 if self.musicc_re.search(sseqid) else 0,
+                       1 if self.is_excluded(sseqid) else 0)
+            self._classes[sseqid] = classes
+            return classes
@@ -0,0 +1,139 @@
+import os
+import csv
+
+from .log import log
+from .utils import copy_file_into
+
+
+class VirtualBlacklist():
+    """Blacklist of the seqs of all genome bins but one, without writing it:
+    a view onto one shared fasta of all the bins (see 'build_shared_fasta'),
+    excluding the byte range [start, end) of the one bin's seqs.
+    Iterate its lines or records, write the excluded seq ids for blastn's
+    '-negative_seqidlist', or materialize it with 'write_fasta' if need be.
+    """
+
+    INDEX_SUFFIX = '.bins.tsv'
+
+    def __init__(self, shared_fasta, bin_name, start, end):
+        self.shared_fasta = str(shared_fasta)
+        self.bin_name = bin_name
+        self.start = int(start)
+        self.end = int(end)
+
+
+    def __repr__(self):
+        return (f'{type(self).__name__}({self.shared_fasta!r}, {self.bin_name!r},'
+                f' {self.start}, {self.end})')
+
+
+    @staticmethod
+    def build_shared_fasta(fasta_files, shared_fasta):
+        """cat all fasta_files into shared_fasta (each ending in a newline), and
+        write the index of each bin's byte range in it alongside ('.bins.tsv').
+        Bins are named by their file's stem. Return dict {bin_name: (start, end)}
+        """
+        try:
+            log.info(f'Building shared blacklist fasta {shared_fasta}')
+            ranges = {}
+            with open(shared_fasta, 'w+b') as shared_fh:
+                for fasta in fasta_files:
+                    start = shared_fh.tell()
+                    copy_file_into(fasta, shared_fh)
+                    end = shared_fh.tell()
+                    shared_fh.flush()
+                    if end > start and os.pread(shared_fh.fileno(), 1, end - 1) != b'\n':
+                        shared_fh.write(b'\n') # next bin's header on its own line
+                        end += 1
+                    ranges[os.path.splitext(os.path.basename(fasta))[0]] = (start, end)
+
+            with open(str(shared_fasta) + VirtualBlacklist.INDEX_SUFFIX, 'w') as index_fh:
+                writer = csv.writer(index_fh, delimiter='\t', dialect='unix',
+                                    quoting=csv.QUOTE_NONE)
+                for bin_name, (start, end) in ranges.items():
+                    writer.writerow([bin_name, start, end])
+        except Exception as e:
+            log.error(f'Building shared blacklist fasta "{shared_fasta}": {e}')
+            raise e
+        else:
+            return ranges
+
+
+    @staticmethod
+    def read_index(shared_fasta):
+        """Return dict {bin_name: (start, end)} from index of shared_fasta"""
+        with open(str(shared_fasta) + VirtualBlacklist.INDEX_SUFFIX) as index_fh:
+            return { bin_name: (int(start), int(end))
+                     for bin_name, start, end in csv.reader(index_fh, delimiter='\t') }
+
+
+    @classmethod
+    def for_all_bins(cls, shared_fasta):
+        """Return list of blacklists for each bin in index of shared_fasta"""
+        return [ cls(shared_fasta, bin_name, start, end)
+                 for bin_name, (start, end) in cls.read_index(shared_fasta).items() ]
+
+
+    def ranges(self):
+        """Return list of byte ranges (start, end) of shared fasta in blacklist"""
+        size = os.path.getsize(self.shared_fasta)
+        return [ (s, e) for s, e in ((0, self.start), (self.end, size)) if e > s ]
+
+
+    def _iter_range_lines(self, ranges):
+        """Yield lines (bytes) of shared fasta in byte ranges"""
+        with open(self.shared_fasta, 'rb') as fh:
+            for start, end in ranges:
+                fh.seek(start)
+                pos = start
+                while pos < end:
+                    line = fh.readline()
+                    if not line:
+                        break
+                    pos += len(line)
+                    yield line
+
+
+    def iter_lines(self):
+        """Yield lines (bytes) of the blacklist, i.e. all bins but this one"""
+        yield from self._iter_range_lines(self.ranges())
+
+
+    def iter_records(self):
+        """Yield header, seq of each record in the blacklist (as 'read_fasta')"""
+        name, seq = None, []
+        for line in self.iter_lines():
+            line = line.decode().rstrip()
+            if line.startswith('>'):
+                if name: yield (name, ''.join(seq))
+                name, seq = line, []
+            else:
+                seq.append(line)
+        if name: yield (name, ''.join(seq))
+
+
+    def excluded_seqids(self):
+        """Return list of seq ids (first word of header) of the excluded bin"""
+        return [ line[1:].split()[0].decode()
+                 for line in self._iter_range_lines([(self.start, self.end)])
+                 if line.startswith(b'>') and line[1:].strip() ]
+
+
+    def write_seqidlist(self, seqidlist_file):
+        """Write excluded seq ids, one per line, e.g. for blastn
+        '-negative_seqidlist' on a blastdb of the shared fasta (made with
+        '-parse_seqids'). Return seqidlist_file.
+        """
+        with open(seqidlist_file, 'w') as ids_fh:
+            for seqid in self.excluded_seqids():
+                ids_fh.write(seqid + '\n')
+        return seqidlist_file
+
+
+    def write_fasta(self, fasta_file):
+        """Materialize the blacklist as a fasta file. Return fasta_file."""
+        log.info(f'Writing blacklist of {self.bin_name} to {fasta_file}')
+        with open(fasta_file, 'wb') as fasta_fh:
+            for line in self.iter_lines():
+                fasta_fh.write(line)
+        return fasta_file
@@ -20,9 +20,19 @@ _DEFAULT_CONFIG_TOML = """
 [general]
     final_probe_amount = '20'
     final_probe_random = true
+    final_probe_seed = '' # set to any value for reproducible random picks
 
     prokka_prediction_suffix = '.ffn'
     genome_bins_suffix = '.fasta'
+    prokka_ingest_threads = '4' # prokka files copied/processed at a time
+    prokka_direct_concat = false # write prokka files straight into the blastdb fasta; no copies
+
+    workers = '1' # number of genome bins processed in parallel (processes)
+    resume = false # skip steps of each bin already done (per manifest) in a previous run
+
+    tidy_workers = '4' # intermediate files compressed at a time when tidying up
+    compress_codec = 'gzip' # or 'zstd' (needs module 'zstandard')
+    compress_level = '6' # gzip 1-9, zstd 1-22; lower is faster
 
 [gc_percent]
     min_percent = '45'
@@ -32,6 +42,7 @@ _DEFAULT_CONFIG_TOML = """
     probe_length = '40'
     probe_stride = '20'
     reuse_existing_probe_files = false
+    engine = 'catch' # or 'native': tile probes in-process (length/stride only), no catch needed
 
 [paths]
     # Where are your source data files? Where do you want the resulting files located?
@@ -46,6 +57,13 @@ _DEFAULT_CONFIG_TOML = """
     num_alignments = '250' # Integer >1. (blastn default: 250)
     num_threads    = '2'   # how many cpus?
 
+    stream_results    = false   # stream blastn output into the db as it arrives; memory stays flat
+    batch_bins        = '1'     # blast probes of this many bins together, loading the db once
+    hits_formats      = ['csv'] # blast matches files: any of 'csv', 'parquet', 'arrow' (need pyarrow)
+    dedup_queries     = false   # blast each distinct probe seq (either strand) once per blastn run, copying its matches
+    drop_shared_probes = false  # drop probes whose seq (either strand) is in any bin more than once, before blasting
+    engine            = 'blastn' # or 'kmer': exact full-length matches in-process (needs numpy), no blastdb
+
     outfmt         = '10'  # 10 = csv w/o header lines. This format is used by the pipeline.  'nuf said.
     fields = []
 
@@ -54,6 +72,16 @@ _DEFAULT_CONFIG_TOML = """
     # Here you can a list of others to add, e.g.:
     # fields = ['mismatch', 'gapopen', 'qstart', 'qend', 'sstart', 'send', 'evalue', 'bitscore']
 
+[sqlite]
+    import_chunk_rows = '10000' # rows per executemany batch when importing blast matches
+    consolidate_bins  = false   # write all bins into one results db, rows keyed by 'bin_id'
+    materialize_filter = false  # filter probes once into an indexed table, not a view
+    [sqlite.pragmas] # set on the db connection while importing, trading durability for speed
+        journal_mode = 'WAL'
+        synchronous  = 'OFF'
+        cache_size   = '-200000' # negative = KiB, i.e. ~200MB
+        temp_store   = 'MEMORY'
+
 [filters]
     pct_identity = '100'
     # musicc_list contains expressions to match the annotation's sequence id's. Use any python.re regex characters or sets.
@@ -75,7 +103,11 @@ _DATABASE_CONFIG_TOML = """
 #=======================================#
 
 clusterdb.name = 'targeted_probe_cluster.db'
+resultsdb.name = 'all_bins_targeted_probe_cluster.db' # consolidated; also matches clusterdb glob
+resultsdb.bin_col = 'bin_id'
 blastdb.name   = 'all_clusters_prokka.fasta'
+manifestdb.name = 'pipeline_manifest.db' # checkpoints of steps done per bin
+probeindexdb.name = 'probe_index.db' # probe seqs of all bins, for drop_shared_probes
 
 blastn.fields = [ 'qseqid', 'sseqid', 'pident', 'length', 'qseq' ]
 
@@ -89,7 +121,14 @@ blastn.fields = [ 'qseqid', 'sseqid', 'pident', 'length', 'qseq' ]
     qseq   = 'TEXT'
     gc_pct = 'REAL'
     is_musicc = 'BOOLEAN'
+    is_excluded = 'BOOLEAN'
     # + plus "extra" config'd blast fields when db table created
+[probes_table.indexes]
+    # created after the bulk import, then ANALYZE'd; in the consolidated
+    # results db, led by its bin_col (and created before, for per-bin deletes),
+    # ANALYZE'd once all bins are imported.
+    # ordered for the filter: grouped by qseqid, tested on the rest in-index
+    probes_filter_idx = [ 'qseqid', 'is_excluded', 'pident', 'length', 'gc_pct' ]
 
 [probes_view]
     name = 'probes_filtered'
@@ -114,6 +153,8 @@ TMP_FILE_GLOBS = dict(
     blast_db = DB_CFG.get('blastdb').get('name'),
     target_dbs = DB_CFG.get('clusterdb').get('name'),
     blast_csv = 'probes.blasts.csv',
+    blast_parquet = 'probes.blasts.parquet',
+    blast_arrow = 'probes.blasts.arrow',
     catch_coverage = 'probe_coverage_analysis.tsv',
 )
 # and here go the keeeeys...
@@ -1,14 +1,51 @@
 import os
+import re
+import time
+import itertools
+import multiprocessing
+from functools import partial
 import sqlite3
 import csv
+import gzip
+import logbook
+from collections import namedtuple, deque
+from contextlib import contextmanager
 
 from .log import log
-from .utils import load_csv_data, write_csv_dict
+from .utils import open_text
 
 
 class SqliteIO():
     """Library of Sqlite DB I/O methods"""
 
+    """seconds to wait on a locked db, e.g. while other processes write to it"""
+    BUSY_TIMEOUT = 600
+
+    """pragmas set on connection for bulk imports; trading durability for speed"""
+    BULK_PRAGMAS = dict(
+        journal_mode = 'WAL',
+        synchronous = 'OFF',
+        cache_size = '-200000', # negative = KiB, i.e. ~200MB
+        temp_store = 'MEMORY',
+    )
+
+    """rows fetched per chunk in streaming exports; bounds their memory use"""
+    EXPORT_CHUNK_ROWS = 10000
+
+    """export formats by file suffix (sans '.gz'), see 'export_csv'"""
+    EXPORT_SUFFIXES = {'.csv': 'csv', '.tsv': 'tsv', '.txt': 'tsv',
+                       '.fasta': 'fasta', '.fa': 'fasta', '.fna': 'fasta'}
+
+    """rows sampled to guess column types, and parsed per chunk, in csv imports"""
+    TYPE_SAMPLE_ROWS = 1000
+    CSV_CHUNK_ROWS = 10000
+
+    """prepared statements cached per connection, reused while it is open"""
+    CACHED_STATEMENTS = 256
+
+    """long-lived connections of open sessions, {(db realpath, pid): [connection, depth]}"""
+    _sessions = {}
+
     @staticmethod
     def connect(dbname, row_dict=True):
         """Connect to sqlite db, using Row in factory"""
@@ -16,6 +53,8 @@ class SqliteIO():
             log.info(f'Connecting to sqlite db: {dbname}')
             dbkws = {}
             dbkws['detect_types'] = sqlite3.PARSE_DECLTYPES
+            dbkws['timeout'] = SqliteIO.BUSY_TIMEOUT
+            dbkws['cached_statements'] = SqliteIO.CACHED_STATEMENTS
             con = sqlite3.connect(dbname, **dbkws)
             if row_dict:
                 con.row_factory = SqliteIO._dict_row_factory
@@ -31,6 +70,94 @@ class SqliteIO():
             return con
 
 
+    @staticmethod
+    def _session_key(dbname):
+        """Return key of dbname's session connection: per db file and process,
+        as a connection must not be shared with forked worker processes.
+        """
+        return (os.path.realpath(dbname), os.getpid())
+
+
+    @staticmethod
+    def open_session(dbname):
+        """Open (or re-enter) a session on dbname: one long-lived connection,
+        used (with its cached prepared statements) by all SqliteIO methods on
+        dbname in this process, until the session is closed.
+        Return the connection.
+        """
+        key = SqliteIO._session_key(dbname)
+        session = SqliteIO._sessions.get(key)
+        if session is None:
+            session = SqliteIO._sessions[key] = [SqliteIO.connect(dbname, row_dict=False), 0]
+        session[1] += 1
+        return session[0]
+
+
+    @staticmethod
+    def close_session(dbname=None, force=False):
+        """Leave the session on dbname, closing its connection once the
+        outermost session is left (or at once if 'force').
+        Without dbname, close all sessions of this process.
+        """
+        pid = os.getpid()
+        if dbname is None:
+            keys = [ key for key in SqliteIO._sessions if key[1] == pid ]
+            force = True
+        else:
+            keys = [SqliteIO._session_key(dbname)]
+        for key in keys:
+            session = SqliteIO._sessions.get(key)
+            if session is None:
+                continue
+            session[1] -= 1
+            if force or session[1] <= 0:
+                del SqliteIO._sessions[key]
+                log.debug(f'Closing sqlite db session: {key[0]}')
+                session[0].close()
+
+
+    @staticmethod
+    @contextmanager
+    def session(*dbnames):
+        """Context manager of sessions on dbnames (see 'open_session')"""
+        opened = []
+        try:
+            for dbname in dbnames:
+                SqliteIO.open_session(dbname)
+                opened.append(dbname)
+            yield
+        finally:
+            for dbname in opened:
+                SqliteIO.close_session(dbname)
+
+
+    @staticmethod
+    @contextmanager
+    def connection(dbname, row_dict=True):
+        """Context manager of a connection to dbname: its session's, if open,
+        else a new one, closed on exit. Session connections use sqlite3.Row;
+        set 'row_factory' on cursors for dict rows.
+        """
+        session = SqliteIO._sessions.get(SqliteIO._session_key(dbname))
+        if session is not None:
+            yield session[0]
+            return
+        con = SqliteIO.connect(dbname, row_dict=row_dict)
+        try:
+            yield con
+        finally:
+            con.close() # now, not whenever garbage collected
+
+
+    @staticmethod
+    def set_pragmas(db, pragmas):
+        """Set each of dict of pragmas {name: value} on db connection"""
+        for name, value in pragmas.items():
+            pragma_sql = f'PRAGMA {name}={value};'
+            log.debug(f'Executing: "{pragma_sql}"')
+            db.execute(pragma_sql)
+
+
     def _dict_row_factory(cursor, row):
         """Return row from cursor select as dict. {column_name: value}
         Compared to sqlite3.Row (tuple), this dict gives name-access plus mutability.
@@ -42,8 +169,21 @@ class SqliteIO():
 
 
     @staticmethod
-    def iter_select(dbname, table, fields=None, where=None, row_dict=True):
-        """Iterate on selected rows from table in dbname"""
+    def iter_select(dbname, table, fields=None, where=None, row_dict=True,
+                    order_by=None, limit=None, row_mode=None, header=False,
+                    chunk_rows=None, explain=False):
+        """Iterate on selected rows from table in dbname
+        Optionally 'order_by' (sql expression, e.g. 'random()') and 'limit' rows.
+        Rows are as 'row_mode':
+            - 'dict': {column_name: value} (default if 'row_dict')
+            - 'row': sqlite3.Row (default if not 'row_dict')
+            - 'tuple': plain tuples; with 'header', the first one yielded is
+              of the column names (as a csv reader)
+            - 'record': namedtuples of a class made once per select
+        Pass 'chunk_rows' to yield lists of up to that many rows (fetchmany)
+        rather than single rows.
+        Pass 'explain' to log the query plan (at debug level).
+        """
         try:
             log.info(f'Selecting data from {dbname}')
             if isinstance(fields, list):
@@ -54,33 +194,84 @@ class SqliteIO():
                 field_def = '*'
 
             where_def = where or '1=1'
-            select_sql = f'SELECT {field_def} FROM {table} WHERE {where_def};'
+            select_sql = f'SELECT {field_def} FROM {table} WHERE {where_def}'
+            if order_by:
+                select_sql += f' ORDER BY {order_by}'
+            if limit is not None:
+                select_sql += f' LIMIT {int(limit)}'
+            select_sql += ';'
 
-            with SqliteIO.connect(dbname, row_dict=row_dict) as db:
+            row_mode = row_mode or ('dict' if row_dict else 'row')
+            row_factories = dict(dict=SqliteIO._dict_row_factory, row=sqlite3.Row,
+                                 tuple=None, record=None)
+            if row_mode not in row_factories:
+                raise ValueError(f'Unknown row_mode "{row_mode}"')
+
+            if explain:
+                SqliteIO.log_query_plan(dbname, select_sql)
+            with SqliteIO.connection(dbname, row_dict=row_dict) as db:
+                dbcur = db.cursor()
+                dbcur.row_factory = row_factories[row_mode]
                 log.debug(f'Executing: "{select_sql}"')
-                for row in db.execute(select_sql):
-                    yield row
+                dbcur.execute(select_sql)
+                columns = tuple(col[0] for col in dbcur.description or ())
+                if row_mode == 'tuple' and header:
+                    yield [columns] if chunk_rows else columns
+                make_record = None
+                if row_mode == 'record':
+                    make_record = namedtuple('Record', columns, rename=True)._make
+
+                if not chunk_rows:
+                    yield from map(make_record, dbcur) if make_record else dbcur
+                    return
+                dbcur.arraysize = int(chunk_rows)
+                while rows := dbcur.fetchmany():
+                    yield list(map(make_record, rows)) if make_record else rows
         except sqlite3.Error as e:
             log.error(f'Selecting with "{select_sql}" in db: {dbname}\n{e}')
             raise e
         except Exception as e:
             log.error(f'Selecting with "{select_sql}" in db: {dbname}\n{e}')
             raise e
-        else:
-            db.close()
 
 
     @staticmethod
-    def exec_ddl(dbname, ddl_sql):
-        """Create object in db using DDL sql statement"""
+    def log_query_plan(dbname, sql, params=()):
+        """Log 'EXPLAIN QUERY PLAN' of sql at debug level, e.g. to check which
+        indexes a query uses rather than full table scans ('SCAN table').
+        Return list of plan lines (None if not logging debug).
+        """
+        if log.level > logbook.DEBUG:
+            return None
+        try:
+            with SqliteIO.connection(dbname, row_dict=False) as db:
+                plan = db.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+            """rows of (id, parent, notused, detail); indent by depth of parent"""
+            depths, lines = {0: 0}, []
+            for node_id, parent, _, detail in plan:
+                depths[node_id] = depths.get(parent, 0) + 1
+                lines.append('  ' * depths[node_id] + detail)
+            log.debug(f'Query plan of "{sql}":\n' + '\n'.join(lines))
+            return lines
+        except sqlite3.Error as e:
+            log.warning(f'Explaining query "{sql}" in db: {dbname}\n{e}')
+            return None
+
+
+    @staticmethod
+    def exec_ddl(dbname, ddl_sql, params=()):
+        """Create object in db using DDL sql statement
+        (or other statement, using optional 'params' for its placeholders)
+        """
         try:
             if not ddl_sql.endswith(';'):
                 ddl_sql += ';'
             if sqlite3.complete_statement(ddl_sql):
-                with SqliteIO.connect(dbname, row_dict=False) as db:
-                    log.debug(f'Executing: "{ddl_sql}"')
-                    db.execute(ddl_sql)
-                    return True
+                with SqliteIO.connection(dbname, row_dict=False) as db:
+                    with db:
+                        log.debug(f'Executing: "{ddl_sql}"')
+                        db.execute(ddl_sql, params)
+                return True
             else:
                 log.error(f'Can''t execute incomplete sql: "{ddl_sql}"')
                 return False
@@ -90,15 +281,30 @@ class SqliteIO():
         except Exception as e:
             log.error(f'Defining object "{ddl_sql}" in db: {dbname}\n{e}')
             raise e
-        else:
-            db.close()
 
 
     @staticmethod
-    def import_data(data_list, dbname, table):
+    def drop_object(dbname, name, types=('table', 'view')):
+        """Drop table or view 'name' from db, whichever it is (if either of 'types').
+        Return whether dropped.
+        """
+        name_val = name.replace("'", "''")
+        objs = [ obj['type'] for obj in
+                 SqliteIO.iter_select(dbname, 'sqlite_master', fields='type',
+                                      where=f"name='{name_val}'")
+                 if obj['type'] in types ]
+        for obj_type in objs:
+            SqliteIO.exec_ddl(dbname, f'DROP {obj_type.upper()} IF EXISTS {name};')
+        return bool(objs)
+
+
+    @staticmethod
+    def import_data(data_list, dbname, table, bulk=False, **bulk_opts):
         """Insert rows from data list of dicts into database table.
                 Fieldnames are data_dict[0].keys()
                 Values are from data_dict[:].values()
+        Pass 'bulk=True' to insert using SqliteIO.import_rows (see there for
+        the 'bulk_opts' keyword args), rather than row by row.
         """
         try: # check data_list is expected format!
             err_msg = "'data_list' must be a list of dict's of field names and values!"
@@ -112,9 +318,13 @@ class SqliteIO():
             log.error(f'{err_msg}\n{e}')
             raise e
 
+        if bulk:
+            fields = list(data_list[0].keys())
+            rows = ( list(row.values()) for row in data_list )
+            return SqliteIO.import_rows(rows, dbname, table, fields, **bulk_opts)
         try:
             fields = list(data_list[0].keys())
-            with SqliteIO.connect(dbname) as db:
+            with SqliteIO.connection(dbname) as db, db:
                 dbcur = db.cursor()
                 sql_cols = ','.join('?' * len(fields))
                 fieldnames = ','.join(fields)
@@ -133,52 +343,164 @@ class SqliteIO():
             raise e
 
 
-    #TODO: db export arg: filetype=csv/tsv or plain text!
     @staticmethod
-    def export_csv(dbname, table, filepath, fields=None, where=None, delimiter=','):
-        """Export from sqlite database to csv file (created or appended).
+    def import_rows(rows, dbname, table, fields, chunk_size=10000,
+                    pragmas=None, index_ddls=None, delete_where=None):
+        """Bulk insert rows from iterable of value lists into database table,
+        using executemany on chunks of 'chunk_size' rows, in a single transaction.
+                Fieldnames are the 'fields' list
+                Values in each row are in order of 'fields'
+        Rows are consumed as they arrive, e.g. from a generator, so memory use
+        is bound by the chunk size.
+        Pragmas (dict) are set on the connection first, SqliteIO.BULK_PRAGMAS
+        if not passed; the db's prior journal_mode is restored afterwards.
+        Index DDL statements (list) are executed after the load.
+        Pass 'delete_where' tuple of (where_sql, params) to first delete those
+        rows, e.g. a previous import, within the same transaction.
+        The write lock is taken at the start ('BEGIN IMMEDIATE') so concurrent
+        writers to the same db wait in turn rather than deadlock.
+        Return number of rows inserted.
+        """
+        try:
+            chunk_size = int(chunk_size)
+            pragmas = SqliteIO.BULK_PRAGMAS if pragmas is None else pragmas
+            sql_cols = ','.join('?' * len(fields))
+            fieldnames = ','.join(fields)
+            sql_insert = f'INSERT INTO {table} ({fieldnames}) VALUES ({sql_cols});'
+
+            row_count = 0
+            start = time.perf_counter()
+            with SqliteIO.connection(dbname, row_dict=False) as db:
+                journal_mode = db.execute('PRAGMA journal_mode;').fetchone()[0]
+                SqliteIO.set_pragmas(db, pragmas)
+                with db:
+                    db.execute('BEGIN IMMEDIATE;')
+                    dbcur = db.cursor()
+                    if delete_where:
+                        where_sql, params = delete_where
+                        dbcur.execute(f'DELETE FROM {table} WHERE {where_sql};', params)
+                        log.debug(f' ... Deleted {dbcur.rowcount} prior rows from table "{table}"')
+                    chunk = []
+                    for row in rows:
+                        chunk.append(row)
+                        if len(chunk) >= chunk_size:
+                            dbcur.executemany(sql_insert, chunk)
+                            row_count += len(chunk)
+                            log.debug(f' ... Inserted {row_count} rows into table "{table}"')
+                            chunk = []
+                    if chunk:
+                        dbcur.executemany(sql_insert, chunk)
+                        row_count += len(chunk)
+                loaded = time.perf_counter() - start
+                log.info(f'Inserted {row_count} rows into table "{table}" in {loaded:.2f}s'
+                         f' ({row_count / max(loaded, 1e-6):,.0f} rows/sec)')
+
+                for ddl in index_ddls or []:
+                    log.debug(f'Executing: "{ddl}"')
+                    with db:
+                        db.execute(ddl)
+                if index_ddls:
+                    indexed = time.perf_counter() - start - loaded
+                    log.info(f'Indexed table "{table}" in {indexed:.2f}s')
+
+                """journal_mode persists in db file; restore it when done"""
+                if pragmas.get('journal_mode', journal_mode).lower() != journal_mode.lower():
+                    SqliteIO.set_pragmas(db, dict(journal_mode=journal_mode))
+            log.info('Import session complete.')
+        except sqlite3.Error as e:
+            log.error(f'Importing into db "{dbname}": {e}')
+            raise e
+        except Exception as e:
+            log.error(f'Importing into db "{dbname}": {e}')
+            raise e
+        else:
+            return row_count
+
+
+    @staticmethod
+    def export_csv(dbname, table, filepath, fields=None, where=None, delimiter=None,
+                   fmt=None, compress=None, append=False, order_by=None, limit=None,
+                   seq_field='probe_seq', chunk_rows=None):
+        """Export from sqlite database to file (created, or appended if 'append'),
+        streaming the selected rows in chunks of 'chunk_rows', so memory use is
+        bound by the chunk size whatever the table size. Return number of rows.
         Specify list or string of field names for export, defaults to all (select *).
-        Specify where clause to select, defaults to all.
+        Specify where clause to select, defaults to all; optionally 'order_by', 'limit'.
+        Format 'fmt' is one of:
+            - 'csv', or 'tsv' (tab 'delimiter'): header of field names first,
+              unless appending to a non-empty file
+            - 'fasta': header of the other fields joined by '|', then 'seq_field'
+        defaulting by suffix of filepath (e.g. 'probes.tsv.gz'), else 'csv'.
+        Output is gzip'd if 'compress', defaulting to whether filepath ends '.gz'.
         """
         try:
-            log.error(f'Exporting to csv file "{filepath}"')
-            if os.path.isfile(filepath):
-                selects = SqliteIO.iter_select(dbname, table, fields, where)
-                records = [ row for row in selects ]
-                return write_csv_dict(filepath, values=records, delim=delimiter)
-            else:
-                log.error(f'Exporting to csv file "{filepath}" is not file...')
-                return None
+            filepath = str(filepath)
+            base, suffix = os.path.splitext(filepath)
+            if compress is None:
+                compress = suffix == '.gz'
+            if suffix == '.gz':
+                suffix = os.path.splitext(base)[1]
+            fmt = fmt or SqliteIO.EXPORT_SUFFIXES.get(suffix.lower(), 'csv')
+            if fmt not in ('csv', 'tsv', 'fasta'):
+                raise ValueError(f'Unknown export format "{fmt}"')
+            delimiter = delimiter or ('\t' if fmt == 'tsv' else ',')
+            chunk_rows = int(chunk_rows or SqliteIO.EXPORT_CHUNK_ROWS)
+            log.info(f'Exporting {fmt} from table "{table}" to file "{filepath}"')
+
+            write_header = not (append and os.path.isfile(filepath)
+                                and os.path.getsize(filepath))
+            selects = SqliteIO.iter_select(dbname, table, fields, where, order_by=order_by,
+                                           limit=limit, row_mode='tuple', header=True,
+                                           chunk_rows=chunk_rows)
+            header = next(selects)[0]
+            open_mode = 'at' if append else 'wt'
+            opener = gzip.open if compress else open
+
+            row_count = 0
+            with opener(filepath, open_mode, newline='') as out_fh:
+                if fmt == 'fasta':
+                    seq_idx = header.index(seq_field)
+                    for chunk in selects:
+                        out_fh.write(''.join(
+                            '>' + '|'.join([ str(v) for i, v in enumerate(row) if i != seq_idx ])
+                            + f'\n{row[seq_idx]}\n' for row in chunk))
+                        row_count += len(chunk)
+                else:
+                    writer = csv.writer(out_fh, delimiter=delimiter, dialect='unix',
+                                        quoting=csv.QUOTE_MINIMAL)
+                    if write_header:
+                        writer.writerow(header)
+                    for chunk in selects:
+                        writer.writerows(chunk)
+                        row_count += len(chunk)
+            log.info(f'Exported {row_count} rows to file "{filepath}"')
         except Exception as e:
             log.error(f'Exporting from db "{dbname}" to file "{filepath}": {e}')
             raise e
+        else:
+            return row_count
 
 
     @staticmethod
-    def get_csv_field_datatypes(filename, delim=','):
-        """guess datatypes from data in csv file.
-        Return dict of {field: typename, ...}
+    def get_csv_field_datatypes(filename, delim=',', sample_rows=None, dialect='unix'):
+        """Guess datatypes of fields in csv file (gzip'd or not) from its header
+        and first 'sample_rows' rows: the widest type of each field's values
+        in the sample, of INTEGER, REAL, TEXT; '' if all empty.
+        Return dict of {field: typename, ...}, in order of the file's fields.
         """
         try:
             if os.path.isfile(filename):
-                log.info(f'Getting types of fields from {filename}')
-                ftypes = {}
-                with open(filename, 'r') as csvfh:
-                    dreader = csv.DictReader(csvfh, delimiter=delim)
-                    fields = dreader.fieldnames
-                    data = next(dreader)
-
-                for f in fields:
-                    if not data[f]:
-                        log.notice(f'field: {f}')
-                        continue
-                    if data[f].isdigit():
-                        ftypes[f] = 'INTEGER'
-                    elif data[f].replace('.','').isdigit():
-                        ftypes[f] = 'REAL'
-                    else:
-                        ftypes[f] = 'TEXT'
-                return ftypes
+                sample_rows = int(sample_rows or SqliteIO.TYPE_SAMPLE_ROWS)
+                log.info(f'Getting types of fields from {sample_rows} rows of {filename}')
+                with open_text(filename) as csvfh:
+                    reader = csv.reader(csvfh, delimiter=delim, dialect=dialect)
+                    fields = next(reader)
+                    widest = [0] * len(fields) # index into CSV_TYPES, 0 = none
+                    for row in itertools.islice(reader, sample_rows):
+                        for idx, value in enumerate(row[:len(fields)]):
+                            if value and widest[idx] < len(CSV_TYPES) - 1:
+                                widest[idx] = max(widest[idx], csv_value_type(value))
+                return { fld: CSV_TYPES[w][0] for fld, w in zip(fields, widest) }
             else:
                 log.warning(f'Fieldtypes: "{filename}" not a file?')
                 return {}
@@ -187,68 +509,132 @@ class SqliteIO():
             raise e
 
 
-    #FIXME: parsing errors in field datatypes and list-length mismatches; skip dataypes?
     @staticmethod
-    def import_csv(filename, dbname, table=None, fields=[],
-                     delim=',', dialect='unix'):
-        """Import csv file to sqlite database (created if not found),
-        into a specific table if name is passed, or will create new
-        table with same name as file.
-        Column names will be taken from first row in file if fields[list] not passed.
+    def import_csv(filename, dbname, table=None, fields=None, delim=',', dialect='unix',
+                   sample_rows=None, chunk_rows=None, workers=1, pragmas=None):
+        """Import csv file (gzip'd or not, e.g. archived '.blasts.csv.gz') to
+        sqlite database (created if not found), into a specific table if name
+        is passed, else one named as the file (sans suffixes).
+        The table is created if need be, with column types guessed from the
+        first 'sample_rows' rows (see 'get_csv_field_datatypes').
+        Column names are taken from the file's header row, or 'fields' (list)
+        if passed, which must be as many.
+        Rows are parsed by one csv reader and typed in chunks of 'chunk_rows',
+        then bulk inserted in order (see 'import_rows'). If 'workers' is more
+        than 1, chunks of lines are parsed and typed on that many processes
+        instead: records must not span lines then, i.e. no quoted newlines.
+        Return number of rows imported.
         """
         try:
-            with SqliteIO.connect(dbname) as db:
-                if not table:
-                    filebase = filename
-                    if filename.rfind('.'): # e.g. '.csv'
-                        filebase = filename[0:filename.rfind('.')]
-                    table = filebase
-
-                if os.path.isfile(filename):
-                    field_datatypes = SqliteIO.get_csv_field_datatypes(filename, delim=delim)
-                    log.notice(f'length fields: {len(fields)}')
-                    if not fields:
-                        fields = field_datatypes.keys()
-                        log.notice(f'length fields: {len(fields)}')
-
-                    if len(field_datatypes):
-                        fld_types = {}
-                        for fld in fields:
-                            fld_types[fld] = field_datatypes.pop(fld, '')
-                        # include leftover fields in file:
-                        fld_types.update(field_datatypes)
-
-                        col_defs = ', '.join([' '.join(t) for t in fld_types])
-                    else:
-                        col_defs = ', '.join(fields)
-                    log.notice(f'col_defs: {col_defs}')
-
-                    try:
-                        sql_cols = ','.join('?' * len(fields))
-                        fieldnames = ','.join(fields)
-                        sql_insert = f'INSERT INTO {table} ({fieldnames}) VALUES ({sql_cols});'
-                        dbcur = db.cursor()
-
-                        rows = load_csv_data(filename, fields=fields, skip_rows=1,
-                                         delim=delim, dialect=dialect)
-                        for row in rows:
-                            row_values = list(row.values())
-                            dbcur.execute( sql_insert, (row_values) )
-                            # log.notice(f'Inserted row {dbcur.lastrowid} into table "{table}"')
-                        log.notice(f'Inserted {dbcur.lastrowid} rows into table "{table}"')
-                    except Exception as e:
-                        log.error(f'Importing records from file "{filename}": {e}')
-                        raise e
-
-                    return # Success!!
+            if not os.path.isfile(filename):
+                log.error(f'Reading file "{filename}" has problems...')
+                return None
+            start = time.perf_counter()
+            if not table:
+                table = re.sub(r'\W', '_', os.path.basename(str(filename)).split('.csv')[0])
+            chunk_rows = int(chunk_rows or SqliteIO.CSV_CHUNK_ROWS)
+            workers = max(int(workers or 1), 1)
+
+            field_types = SqliteIO.get_csv_field_datatypes(filename, delim=delim,
+                                                           sample_rows=sample_rows,
+                                                           dialect=dialect)
+            fields = list(fields or field_types.keys())
+            if len(fields) != len(field_types):
+                raise ValueError(f'{len(fields)} fields passed for {len(field_types)}'
+                                 f' columns in file: {fields}')
+            col_types = dict(zip(fields, field_types.values()))
+            col_defs = ', '.join(' '.join(t).strip() for t in col_types.items())
+            SqliteIO.exec_ddl(dbname, f'CREATE TABLE IF NOT EXISTS {table} ({col_defs});')
+
+            types = list(col_types.values())
+            with open_text(filename) as csvfh:
+                if workers > 1:
+                    log.info(f'Parsing "{filename}" on {workers} worker processes')
+                    next(csvfh) # header
+                    line_chunks = iter(lambda: list(itertools.islice(csvfh, chunk_rows)), [])
+                    parse = partial(_parse_csv_chunk, col_types=types,
+                                    delim=delim, dialect=dialect)
+                    with multiprocessing.get_context('fork').Pool(workers) as pool:
+                        row_count = SqliteIO.import_rows(
+                            itertools.chain.from_iterable(
+                                _imap_window(pool, parse, line_chunks, workers * 2)),
+                            dbname, table, fields, chunk_size=chunk_rows, pragmas=pragmas)
                 else:
-                    log.error(f'Reading file "{filename}" has problems...')
-                    return None
+                    reader = csv.reader(csvfh, delimiter=delim, dialect=dialect)
+                    next(reader) # header
+                    row_chunks = iter(lambda: list(itertools.islice(reader, chunk_rows)), [])
+                    row_count = SqliteIO.import_rows(
+                        itertools.chain.from_iterable(
+                            _type_csv_rows(rows, types) for rows in row_chunks),
+                        dbname, table, fields, chunk_size=chunk_rows, pragmas=pragmas)
+
+            elapsed = time.perf_counter() - start
+            log.notice(f'Imported {row_count} rows from "{filename}" into table "{table}"'
+                       f' in {elapsed:.2f}s ({row_count / max(elapsed, 1e-6):,.0f} rows/sec)')
         except sqlite3.Error as e:
             log.error(f'Importing from file "{filename}" to db: {e}')
             raise e
         except Exception as e:
             log.error(f'Importing from file "{filename}" to db: {e}')
             raise e
-        finally:
-            db.close()
+        else:
+            return row_count
+
+
+#~~~ CSV import helpers (module level, so picklable for worker processes) ~~~~~
+"""sqlite column types of csv values, narrowest first: (typename, converter)"""
+CSV_TYPES = [ ('', str), ('INTEGER', int), ('REAL', float), ('TEXT', str) ]
+
+
+def csv_value_type(value):
+    """Return index into CSV_TYPES of narrowest type of (non-empty) csv value"""
+    for idx, (_, convert) in enumerate(CSV_TYPES[1:-1], start=1):
+        try:
+            convert(value)
+            return idx
+        except ValueError:
+            pass
+    return len(CSV_TYPES) - 1
+
+
+def _parse_csv_chunk(lines, col_types, delim=',', dialect='unix'):
+    """Return list of rows parsed from csv lines, typed as '_type_csv_rows'"""
+    return _type_csv_rows(csv.reader(lines, delimiter=delim, dialect=dialect), col_types)
+
+
+def _type_csv_rows(csv_rows, col_types):
+    """Return list of csv_rows (lists of str), with each value converted
+    to its column's type (empty as None; as text if not convertible).
+    """
+    converters = [ dict(CSV_TYPES).get(col_type) or str for col_type in col_types ]
+    ncols = len(converters)
+    rows = []
+    for row in csv_rows:
+        if len(row) != ncols:
+            if not row:
+                continue # blank line
+            raise ValueError(f'{len(row)} values for {ncols} columns: {row}')
+        typed = []
+        for convert, value in zip(converters, row):
+            if value == '':
+                typed.append(None)
+                continue
+            try:
+                typed.append(convert(value))
+            except ValueError:
+                typed.append(value)
+        rows.append(typed)
+    return rows
+
+
+def _imap_window(pool, func, items, window):
+    """Yield results of func on each of items, in order, from pool, with at
+    most 'window' in flight, so items are read only as results are consumed.
+    """
+    pending = deque()
+    for item in items:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
@@ -0,0 +1,206 @@
+"""Exact-match k-mer specificity engine: in-process stand-in for 'blastn'
+where only full-length exact matches of the probes count, as with the
+default filters (pct_identity 100, length = probe length).
+Needs numpy.
+"""
+import os
+
+from .log import log
+from .utils import read_fasta
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+"""blastn '-outfmt' fields the engine gives, per match"""
+KMER_FIELDS = ( 'qseqid', 'sseqid', 'pident', 'length', 'qseq', 'sseq', 'mismatch',
+                'gapopen', 'gaps', 'nident', 'qstart', 'qend', 'sstart', 'send',
+                'qlen', 'slen', 'sstrand' )
+
+"""odd multiplier of the rolling hash (mod 2**64), and its inverse"""
+HASH_BASE = 0x9E3779B97F4A7C15
+HASH_BASE_INV = pow(HASH_BASE, -1, 1 << 64)
+
+COMPLEMENT = bytes.maketrans(b'ACGT', b'TGCA')
+ACGT_CODES = np.frombuffer(b'ACGT', dtype=np.uint8) if np is not None else None
+
+
+def powers(base, n):
+    """Return uint64 array of base**i (mod 2**64) for i in range(n)"""
+    pows = np.full(n, base, dtype=np.uint64)
+    pows[:1] = 1
+    return np.cumprod(pows, dtype=np.uint64) # wraps, i.e. mod 2**64
+
+
+def window_hashes(codes, k):
+    """Return uint64 array of the hash of each k-long window of codes
+    (uint8 array), sum(codes[i+j] * HASH_BASE_INV**j), in one vectorized pass
+    over prefix sums; the same as hashing each window on its own, so codes
+    can be hashed a chunk at a time.
+    """
+    n = len(codes)
+    prefix = np.zeros(n + 1, dtype=np.uint64)
+    np.cumsum(codes.astype(np.uint64) * powers(HASH_BASE_INV, n), dtype=np.uint64,
+              out=prefix[1:])
+    return (prefix[k:] - prefix[:n-k+1]) * powers(HASH_BASE, n - k + 1)
+
+
+def valid_windows(codes, k):
+    """Return bool array: is each k-long window of codes all ACGT?"""
+    bad = np.zeros(len(codes) + 1, dtype=np.int64)
+    np.cumsum(~np.isin(codes, ACGT_CODES), out=bad[1:])
+    return bad[k:] == bad[:len(codes)-k+1]
+
+
+class KmerIndex():
+    """Index of every k-mer of the seqs of a fasta file (e.g. the concatenated
+    prokka blastdb fasta), for lookup of many probes at once by binary search.
+    Each window is one uint64 key, sorted in place: the top bits of its 64-bit
+    rolling hash, then its position (in as few bits as the positions need),
+    so candidates of a probe are the keys of its hash's top bits, each then
+    checked base by base. Windows with other bases than ACGT are left out.
+    Both strands are searched by looking up each probe and its reverse
+    complement. Keys are built 'CHUNK_BASES' at a time, so memory at peak is
+    about 9 bytes per base (8 per key, plus the seqs).
+    Use 'cached' to build one per fasta and k in a process (inherited by
+    forked workers).
+    """
+
+    _cache = {} # {(fasta realpath, mtime, k): KmerIndex}
+    CHUNK_BASES = 1 << 20
+
+    def __init__(self, fasta_file, k):
+        if np is None:
+            raise ImportError('Module "numpy" is required for the k-mer engine!')
+        self.k = int(k)
+        log.info(f'Indexing {self.k}-mers of {fasta_file}')
+        names, seqs = [], []
+        for header, seq in read_fasta(fasta_file):
+            names.append(header[1:].split()[0])
+            seqs.append(seq.upper().encode('ascii'))
+        self.names = names
+        self.lengths = np.array([ len(s) for s in seqs ], dtype=np.int64)
+        self.starts = np.concatenate(([0], np.cumsum(self.lengths + 1)[:-1])).astype(np.int64)
+        self.bases = b'\n'.join(seqs) # separators are in no window
+        del seqs
+
+        codes = np.frombuffer(self.bases, dtype=np.uint8)
+        num_windows = max(len(codes) - self.k + 1, 0)
+        self.pos_bits = np.uint64(max(num_windows.bit_length(), 1))
+        self.pos_mask = np.uint64((1 << int(self.pos_bits)) - 1)
+
+        chunks = [ (start, min(start + self.CHUNK_BASES, num_windows))
+                   for start in range(0, num_windows, self.CHUNK_BASES) ]
+        window_codes = lambda start, stop: codes[start:stop + self.k - 1]
+        num_valid = sum(int(valid_windows(window_codes(*chunk), self.k).sum())
+                        for chunk in chunks)
+        self.keys = np.empty(num_valid, dtype=np.uint64)
+        filled = 0
+        for start, stop in chunks:
+            chunk_codes = window_codes(start, stop)
+            valid = np.flatnonzero(valid_windows(chunk_codes, self.k))
+            hashes = window_hashes(chunk_codes, self.k)[valid]
+            positions = (valid + start).astype(np.uint64)
+            self.keys[filled:filled + len(valid)] = \
+                ((hashes >> self.pos_bits) << self.pos_bits) | positions
+            filled += len(valid)
+        self.keys.sort()
+        log.info(f'Indexed {len(self.keys)} {self.k}-mers of {len(names)} seqs')
+
+
+    @classmethod
+    def cached(cls, fasta_file, k):
+        """Return index of fasta_file's k-mers, built once per process"""
+        fasta_file = os.path.realpath(fasta_file)
+        key = (fasta_file, os.path.getmtime(fasta_file), int(k))
+        if key not in cls._cache:
+            cls._cache[key] = cls(fasta_file, k)
+        return cls._cache[key]
+
+
+    def find_all(self, probes):
+        """Return list, per probe seq (str, k long), of its exact matches:
+        tuples of (seq index, 0-based start, strand '+'/'-'), in seq order.
+        """
+        if not probes:
+            return []
+        probe_bytes = [ p.upper().encode('ascii') for p in probes ]
+        queries = probe_bytes + [ p.translate(COMPLEMENT)[::-1] for p in probe_bytes ]
+        codes = np.frombuffer(b''.join(queries), dtype=np.uint8).reshape(len(queries), self.k)
+        query_hashes = (codes.astype(np.uint64) * powers(HASH_BASE_INV, self.k)).sum(
+            axis=1, dtype=np.uint64)
+        query_keys = (query_hashes >> self.pos_bits) << self.pos_bits
+        lefts = np.searchsorted(self.keys, query_keys, side='left')
+        rights = np.searchsorted(self.keys, query_keys | self.pos_mask, side='right')
+
+        matches = []
+        for idx in range(len(probes)):
+            found = []
+            for strand, qidx in (('+', idx), ('-', idx + len(probes))):
+                query = queries[qidx]
+                for pos in (self.keys[lefts[qidx]:rights[qidx]] & self.pos_mask).tolist():
+                    if self.bases[pos:pos + self.k] == query: # not just a hash collision
+                        found.append((pos, strand))
+            found.sort()
+            seq_idxs = np.searchsorted(self.starts, [ pos for pos, _ in found ], side='right') - 1
+            matches.append([ (int(si), pos - int(self.starts[si]), strand)
+                             for si, (pos, strand) in zip(seq_idxs, found) ])
+        return matches
+
+
+def kmer_match_probes(probe_file, fasta_file, fields, max_subjects=250, chunk_size=10000):
+    """Yield blast-like match records (lists of str, in order of 'fields',
+    each of KMER_FIELDS) of the probes in probe_file on the seqs of
+    fasta_file: every full-length exact match, on either strand, of up to
+    'max_subjects' seqs per probe (as blastn '-num_alignments').
+    Probes are looked up 'chunk_size' at a time, in order of probe_file.
+    """
+    unknown = [ fld for fld in fields if fld not in KMER_FIELDS ]
+    if unknown:
+        raise ValueError(f'Fields not given by the k-mer engine: {unknown}')
+    max_subjects = int(max_subjects)
+    log.info(f'Matching probes of {probe_file} by exact k-mers on {fasta_file}')
+
+    def match_rows(chunk):
+        by_length = {}
+        for idx, (_, seq) in enumerate(chunk):
+            by_length.setdefault(len(seq), []).append(idx)
+        matches = [None] * len(chunk)
+        for k, idxs in by_length.items():
+            index = KmerIndex.cached(fasta_file, k)
+            for idx, found in zip(idxs, index.find_all([ chunk[i][1] for i in idxs ])):
+                matches[idx] = (index, found)
+
+        for (qseqid, seq), (index, found) in zip(chunk, matches):
+            k = len(seq)
+            subjects = []
+            for seq_idx, start, strand in found:
+                if seq_idx not in subjects:
+                    if len(subjects) >= max_subjects:
+                        continue
+                    subjects.append(seq_idx)
+                sstart, send = (start + 1, start + k) if strand == '+' else (start + k, start + 1)
+                values = dict(qseqid=qseqid, sseqid=index.names[seq_idx], pident='100.000',
+                              length=k, qseq=seq, sseq=seq, mismatch=0, gapopen=0, gaps=0,
+                              nident=k, qstart=1, qend=k, sstart=sstart, send=send, qlen=k,
+                              slen=int(index.lengths[seq_idx]),
+                              sstrand='plus' if strand == '+' else 'minus')
+                yield [ str(values[fld]) for fld in fields ]
+
+    try:
+        num_matches, chunk = 0, []
+        for header, seq in read_fasta(probe_file):
+            chunk.append((header[1:].split()[0], seq))
+            if len(chunk) >= chunk_size:
+                for row in match_rows(chunk):
+                    num_matches += 1
+                    yield row
+                chunk = []
+        for row in match_rows(chunk):
+            num_matches += 1
+            yield row
+        log.info(f'Number of k-mer matches: {num_matches}')
+    except Exception as e:
+        log.error(f'Matching probes of "{probe_file}" by k-mers: {e}')
+        raise e
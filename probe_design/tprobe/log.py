@@ -24,6 +24,17 @@ def inject_extra_group(record):
     record.extra['group'] = ''
 
 
+def log_channel_group(group):
+    """Return Processor prefixing each record's channel with 'group'.
+    Use e.g. `with log_channel_group(name).applicationbound():` in pipeline
+    workers so that channels switched via 'log.name' stay attributable.
+    """
+    def inject_channel_group(record):
+        record.extra['group'] = group
+        record.channel = f'{group}:{record.channel}'
+    return logbook.Processor(inject_channel_group)
+
+
 def log_file_init(log_name=__name__, logfile=None):
     NOW = datetime.datetime.now().isoformat('T', 'seconds').replace(':','-')
     if not logfile:
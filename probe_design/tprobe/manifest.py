@@ -0,0 +1,90 @@
+import os
+import json
+import hashlib
+import datetime
+
+from .log import log
+from .db import SqliteIO
+
+
+class PipelineManifest():
+    """Checkpoint manifest of the pipeline steps completed for each genome bin,
+    kept in a sqlite db in the working_dir.
+
+    Each step is recorded with a key: a hash of the content of its input files,
+    the config options it uses, and the key of the step it follows. When
+    'resume' is set, a step is done (i.e. can be skipped) only if recorded
+    with the same key and its output files still exist.
+    """
+
+    TABLE = 'pipeline_steps'
+
+    def __init__(self, dbname, resume=False):
+        self.dbname = str(dbname)
+        self.resume = resume
+        self._hashes = {} # {(path, size, mtime): sha256}
+        SqliteIO.exec_ddl(self.dbname,
+            f'CREATE TABLE IF NOT EXISTS {self.TABLE} ('
+            ' bin_name TEXT, step TEXT, step_key TEXT, status TEXT, finished TEXT,'
+            ' PRIMARY KEY (bin_name, step));')
+
+
+    def file_hash(self, filepath):
+        """Return sha256 of the content of file; cached while it is unchanged"""
+        filepath = os.path.abspath(str(filepath))
+        stat = os.stat(filepath)
+        cache_key = (filepath, stat.st_size, stat.st_mtime_ns)
+        if cache_key not in self._hashes:
+            log.debug(f'Hashing content of "{filepath}"')
+            sha = hashlib.sha256()
+            with open(filepath, 'rb') as fh:
+                for chunk in iter(lambda: fh.read(1 << 20), b''):
+                    sha.update(chunk)
+            self._hashes[cache_key] = sha.hexdigest()
+        return self._hashes[cache_key]
+
+
+    def step_key(self, inputs=(), config=None, upstream=None):
+        """Return key (sha256) of a step from its input files' content,
+        dict of config options, and the key of the step it follows.
+        """
+        key_parts = dict(
+            inputs = [ self.file_hash(f) for f in inputs ],
+            config = config or {},
+            upstream = upstream or '',
+        )
+        key_json = json.dumps(key_parts, sort_keys=True, default=str)
+        return hashlib.sha256(key_json.encode('UTF-8')).hexdigest()
+
+
+    def is_done(self, bin_name, step, key, outputs=()):
+        """Is step of bin recorded done with this key, and all outputs exist?
+        Always False unless resuming.
+        """
+        if not self.resume:
+            return False
+        bin_val = bin_name.replace("'", "''")
+        where = f"bin_name='{bin_val}' AND step='{step}' AND status='done'"
+        recs = list(SqliteIO.iter_select(self.dbname, self.TABLE, fields='step_key', where=where))
+        done = (bool(recs) and recs[0]['step_key'] == key
+                and all(os.path.exists(str(f)) for f in outputs))
+        if done:
+            log.notice(f'Resuming: step "{step}" of "{bin_name}" already done.')
+        return done
+
+
+    def mark(self, bin_name, step, key, status='done'):
+        """Record step of bin with key and status"""
+        finished = datetime.datetime.now().isoformat('T', 'seconds')
+        SqliteIO.exec_ddl(self.dbname,
+            f'INSERT OR REPLACE INTO {self.TABLE}'
+            ' (bin_name, step, step_key, status, finished) VALUES (?, ?, ?, ?, ?);',
+            (bin_name, step, key, status, finished))
+
+
+    def clear(self, step=None, bin_name=None):
+        """Forget records of step and/or bin (all if neither), so they are redone"""
+        wheres = [ f'{col}=?' for col, val in (('step', step), ('bin_name', bin_name)) if val ]
+        params = tuple( val for val in (step, bin_name) if val )
+        where = ' WHERE ' + ' AND '.join(wheres) if wheres else ''
+        SqliteIO.exec_ddl(self.dbname, f'DELETE FROM {self.TABLE}{where};', params)
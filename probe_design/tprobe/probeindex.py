@@ -0,0 +1,243 @@
+import hashlib
+import itertools
+
+from .log import log
+from .db import SqliteIO
+from .utils import read_fasta
+
+"""complement of each base; others (e.g. 'N') unchanged"""
+COMPLEMENT = str.maketrans('ACGTacgt', 'TGCAtgca')
+
+
+def reverse_complement(seq):
+    """Return reverse complement of DNA seq"""
+    return seq.translate(COMPLEMENT)[::-1]
+
+
+def seq_hash(seq):
+    """Return 64-bit (signed, as sqlite INTEGER) hash of seq, case-insensitive"""
+    digest = hashlib.blake2b(seq.upper().encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def canonical_seq(seq):
+    """Return seq or its reverse complement (uppercase), whichever is the
+    lesser: the same for a seq on either strand.
+    """
+    seq = seq.upper()
+    return min(seq, reverse_complement(seq))
+
+
+def canonical_hash(seq):
+    """Return seq_hash of seq's canonical_seq: the same for a seq on either strand"""
+    return seq_hash(canonical_seq(seq))
+
+
+class ProbeIndex():
+    """Index of the probe seqs of all genome bins, by 64-bit hash of their
+    canonical seq (either strand), in a sqlite db; built once all bins'
+    probes are designed, before any are blasted, to find probes whose seq
+    is shared (within or across bins). The hashes of shared seqs are found
+    once, by 'index_shared' after the last bin is added, for each bin's
+    'shared_ids' to look up.
+    Holds only the db name, so it can be passed to worker processes.
+    """
+
+    TABLE = 'probe_seqs'
+    BINS_TABLE = 'probe_bins'
+    SHARED_TABLE = 'probe_shared_seqs'
+
+    def __init__(self, dbname, clear=False):
+        self.dbname = str(dbname)
+        SqliteIO.exec_ddl(self.dbname,
+                          f'CREATE TABLE IF NOT EXISTS {self.TABLE}'
+                          ' ( bin_name TEXT, qseqid TEXT, canon_hash INTEGER );')
+        SqliteIO.exec_ddl(self.dbname,
+                          f'CREATE TABLE IF NOT EXISTS {self.BINS_TABLE}'
+                          ' ( bin_name TEXT PRIMARY KEY, probes_file TEXT );')
+        SqliteIO.exec_ddl(self.dbname,
+                          f'CREATE TABLE IF NOT EXISTS {self.SHARED_TABLE}'
+                          ' ( canon_hash INTEGER PRIMARY KEY );')
+        if clear:
+            self.clear()
+
+
+    def clear(self):
+        """Remove all bins from the index"""
+        with SqliteIO.session(self.dbname):
+            SqliteIO.exec_ddl(self.dbname, f'DELETE FROM {self.TABLE};')
+            SqliteIO.exec_ddl(self.dbname, f'DELETE FROM {self.BINS_TABLE};')
+            SqliteIO.exec_ddl(self.dbname, f'DELETE FROM {self.SHARED_TABLE};')
+
+
+    def add_bin(self, bin_name, probes_file):
+        """Index (or re-index) the probe seqs of bin's probes_file; the shared
+        seqs are then out of date until 'index_shared'.
+        Return number of probes indexed.
+        """
+        log.info(f'Indexing probe seqs of {bin_name}')
+        rows = ( (bin_name, name[1:].split()[0], canonical_hash(seq))
+                 for name, seq in read_fasta(probes_file) )
+        with SqliteIO.session(self.dbname):
+            num_probes = SqliteIO.import_rows(rows, self.dbname, self.TABLE,
+                                              ['bin_name', 'qseqid', 'canon_hash'],
+                                              pragmas={}, delete_where=('bin_name=?', (bin_name,)),
+                                              index_ddls=[f'CREATE INDEX IF NOT EXISTS'
+                                                          f' "{self.TABLE}_hash_idx"'
+                                                          f' ON {self.TABLE} (canon_hash);',
+                                                          f'CREATE INDEX IF NOT EXISTS'
+                                                          f' "{self.TABLE}_bin_idx"'
+                                                          f' ON {self.TABLE} (bin_name);'])
+            SqliteIO.exec_ddl(self.dbname, f'DELETE FROM {self.SHARED_TABLE};')
+            SqliteIO.exec_ddl(self.dbname,
+                              f'INSERT OR REPLACE INTO {self.BINS_TABLE}'
+                              ' (bin_name, probes_file) VALUES (?, ?);',
+                              (bin_name, str(probes_file)))
+        return num_probes
+
+
+    def probes_file(self, bin_name):
+        """Return probes file of bin as indexed, or None if not indexed"""
+        bin_val = bin_name.replace("'", "''")
+        recs = list(SqliteIO.iter_select(self.dbname, self.BINS_TABLE, fields='probes_file',
+                                         where=f"bin_name='{bin_val}'", row_mode='tuple'))
+        return recs[0][0] if recs else None
+
+
+    def index_shared(self):
+        """Find the hashes of seqs (either strand) that occur more than once
+        in the index, i.e. in any bins, in one pass over all bins' probes.
+        Return number of shared seqs.
+        """
+        with SqliteIO.session(self.dbname):
+            SqliteIO.exec_ddl(self.dbname, f'DELETE FROM {self.SHARED_TABLE};')
+            SqliteIO.exec_ddl(self.dbname,
+                              f'INSERT INTO {self.SHARED_TABLE} (canon_hash)'
+                              f' SELECT canon_hash FROM {self.TABLE} GROUP BY canon_hash'
+                              ' HAVING count(*) > 1;')
+            row = next(SqliteIO.iter_select(self.dbname, self.SHARED_TABLE, fields='count(*)',
+                                            row_mode='tuple'))
+        return row[0]
+
+
+    def shared_ids(self, bin_name):
+        """Return set of qseqids of bin's probes whose seq (either strand)
+        occurs more than once in the index, i.e. in any bin (per 'index_shared').
+        """
+        bin_val = bin_name.replace("'", "''")
+        shared_where = (f"bin_name='{bin_val}' AND canon_hash IN"
+                        f' (SELECT canon_hash FROM {self.SHARED_TABLE})')
+        return set( row[0] for row in
+                    SqliteIO.iter_select(self.dbname, self.TABLE, fields='qseqid',
+                                         where=shared_where, row_mode='tuple') )
+
+
+    def summary(self):
+        """Return tuple of counts (probes, distinct seqs, probes of shared seqs)"""
+        counts_from = (f'(SELECT count(*) AS n FROM {self.TABLE}'
+                       ' GROUP BY canon_hash)')
+        fields = 'sum(n), count(*), coalesce(sum(CASE WHEN n > 1 THEN n END), 0)'
+        row = next(SqliteIO.iter_select(self.dbname, counts_from, fields=fields,
+                                        row_mode='tuple'))
+        return tuple(v or 0 for v in row)
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Blast each distinct query seq only once ~~~~~
+def write_unique_queries(probes_files, query_file, exclude=(), dedup=True):
+    """Write the probes of probes_files into query_file, leaving out probes
+    in 'exclude' (set of ids); if 'dedup', each distinct canonical seq only
+    once (its first probe, the 'representative'), i.e. a probe whose seq is
+    the same as, or the reverse complement of, an earlier one's is not
+    blasted (as in ProbeIndex).
+    Return tuple of (list of ids of all probes written or represented, in
+    order; dict {probe id: its representative's id}, of those not written;
+    dict {probe id: seq length}, of those the reverse complement of theirs)
+    """
+    query_ids, reps, flipped, first_of_seq = [], {}, {}, {}
+    with open(query_file, 'w') as query_fh:
+        for probes_file in probes_files:
+            for name, seq in read_fasta(probes_file):
+                qseqid = name[1:].split()[0]
+                if qseqid in exclude:
+                    continue
+                query_ids.append(qseqid)
+                if dedup:
+                    rep_id, rep_seq = first_of_seq.setdefault(canonical_seq(seq),
+                                                              (qseqid, seq.upper()))
+                    if rep_id != qseqid:
+                        reps[qseqid] = rep_id
+                        if rep_seq != seq.upper():
+                            flipped[qseqid] = len(seq)
+                        continue
+                query_fh.write(f'{name}\n{seq}\n')
+    log.info(f'Blast queries: {len(query_ids) - len(reps)} distinct seqs of'
+             f' {len(query_ids)} probes ({len(exclude)} excluded,'
+             f' {len(flipped)} reverse complements), into {query_file}')
+    return query_ids, reps, flipped
+
+
+def flip_blast(pb, fields, qlen):
+    """Return blast match record pb (list of 'fields' values, as str) as
+    matched by the reverse complement of its query (of length qlen):
+    qseq and sseq reverse complemented, qstart/qend mirrored, sstart/send
+    swapped, sstrand flipped. Other fields are the same either way.
+    """
+    pb = list(pb)
+    idx = { fld: i for i, fld in enumerate(fields) }
+    for fld in ('qseq', 'sseq'):
+        if fld in idx:
+            pb[idx[fld]] = reverse_complement(pb[idx[fld]])
+    if 'qstart' in idx and 'qend' in idx:
+        qstart, qend = int(pb[idx['qstart']]), int(pb[idx['qend']])
+        pb[idx['qstart']], pb[idx['qend']] = str(qlen - qend + 1), str(qlen - qstart + 1)
+    if 'sstart' in idx and 'send' in idx:
+        pb[idx['sstart']], pb[idx['send']] = pb[idx['send']], pb[idx['sstart']]
+    if 'sstrand' in idx:
+        pb[idx['sstrand']] = 'minus' if pb[idx['sstrand']] == 'plus' else 'plus'
+    return pb
+
+
+def fan_out_blasts(probe_blasts, query_ids, reps, flipped=None, fields=None):
+    """Yield blast match records (lists, qseqid first, of 'fields') of each
+    of query_ids in order, those of probes not blasted being copies of their
+    representative's matches (see 'write_unique_queries'), flipped to the
+    other strand for probes in 'flipped' (see 'flip_blast'); i.e. as if every
+    probe was blasted. Matches are passed on per contiguous run of a query's
+    records as they arrive (in query order, as blastn gives them); only those
+    of representatives are held, until their last copy is made.
+    Each record yielded is a new list.
+    """
+    flipped = flipped or {}
+    last_copy = {} # {representative id: index in query_ids of its last copy}
+    for idx, qseqid in enumerate(query_ids):
+        if qseqid in reps:
+            last_copy[reps[qseqid]] = idx
+    query_idx = { qseqid: idx for idx, qseqid in enumerate(query_ids) if qseqid not in reps }
+    held = {} # {representative id: list of its match records}
+    next_idx = 0
+
+    def copies(stop):
+        """yield the copied matches of probes from next_idx up to stop"""
+        for idx in range(next_idx, stop):
+            qseqid = query_ids[idx]
+            rep_id = reps.get(qseqid)
+            if rep_id is None:
+                continue # a blasted query: no matches, or passed on already
+            for pb in held.get(rep_id, ()):
+                if qseqid in flipped:
+                    pb = flip_blast(pb, fields, flipped[qseqid])
+                yield [qseqid] + pb[1:]
+            if last_copy[rep_id] == idx:
+                held.pop(rep_id, None)
+
+    for qseqid, query_blasts in itertools.groupby(probe_blasts, key=lambda pb: pb[0]):
+        idx = query_idx.get(qseqid, -1)
+        if idx < next_idx:
+            raise ValueError(f'Blast matches of "{qseqid}" not in query order!')
+        yield from copies(idx)
+        if qseqid in last_copy:
+            query_blasts = held[qseqid] = list(query_blasts)
+        for pb in query_blasts:
+            yield list(pb)
+        next_idx = idx + 1
+    yield from copies(len(query_ids))
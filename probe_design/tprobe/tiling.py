@@ -0,0 +1,104 @@
+"""Native probe tiling: in-process stand-in for running catch 'design.py'
+using only its '--probe-length' and '--probe-stride' options.
+"""
+import os
+
+from .log import log
+from .utils import read_fasta
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def tile_starts(seq_length, probe_length, probe_stride):
+    """Return list of start positions of probes tiling a sequence every
+    'probe_stride' bases; plus a final probe flush with the end of the
+    sequence if the stride does not land there (as catch does).
+    Sequences shorter than 'probe_length' get no probes.
+    """
+    if seq_length < probe_length:
+        return []
+    starts = list(range(0, seq_length - probe_length + 1, probe_stride))
+    if starts[-1] != seq_length - probe_length:
+        starts.append(seq_length - probe_length)
+    return starts
+
+
+def tile_sequence(seq, probe_length, probe_stride):
+    """Return list of probe seqs (str) tiling 'seq'. See 'tile_starts'.
+    Windows are extracted in one vectorized pass if numpy is available.
+    """
+    starts = tile_starts(len(seq), probe_length, probe_stride)
+    if not starts:
+        return []
+    if np is None:
+        return [ seq[s:s+probe_length] for s in starts ]
+
+    bases = np.frombuffer(seq.encode('ascii'), dtype=np.uint8)
+    windows = np.lib.stride_tricks.sliding_window_view(bases, probe_length)[starts]
+    probes = np.ascontiguousarray(windows).view(f'S{probe_length}').ravel()
+    return [ p.decode('ascii') for p in probes.tolist() ]
+
+
+def coverage_stats(seq_length, starts, probe_length):
+    """Return tuple of (number of bases covered, total probe bases) over
+    a sequence of 'seq_length' by probes at 'starts'.
+    """
+    covered, reach = 0, 0
+    for s in starts:
+        end = s + probe_length
+        if end > reach:
+            covered += end - max(s, reach)
+            reach = end
+    return covered, len(starts) * probe_length
+
+
+def tile_probes(fasta_file, probe_out, coverage_tsv, probe_length, probe_stride,
+                header_prefix=''):
+    """Tile probes across every sequence in 'fasta_file', writing them to
+    'probe_out' fasta with headers '>{header_prefix}probe_{n}' (as catch names
+    them, plus prefix), dropping duplicate probe seqs (first one kept).
+    Write coverage analysis of the genome by the probes to 'coverage_tsv',
+    in the columns of catch's '--write-analysis-to-tsv'.
+    Return number of probes written.
+    """
+    try:
+        probe_length = int(probe_length)
+        probe_stride = int(probe_stride)
+        genome = os.path.basename(fasta_file)
+        log.info(f'Tiling {probe_length}bp probes every {probe_stride}bp across {genome}')
+
+        seen = set()
+        num_probes, genome_length, covered, depth = 0, 0, 0, 0
+        with open(probe_out, 'w') as probe_fh:
+            for header, seq in read_fasta(fasta_file):
+                starts = tile_starts(len(seq), probe_length, probe_stride)
+                if not starts:
+                    log.notice(f'Sequence "{header}" shorter than probe length; skipped.')
+                genome_length += len(seq)
+                seq_covered, seq_depth = coverage_stats(len(seq), starts, probe_length)
+                covered += seq_covered
+                depth += seq_depth
+
+                for probe in tile_sequence(seq, probe_length, probe_stride):
+                    if probe in seen:
+                        continue
+                    seen.add(probe)
+                    probe_fh.write(f'>{header_prefix}probe_{num_probes}\n{probe}\n')
+                    num_probes += 1
+
+        with open(coverage_tsv, 'w') as tsv_fh:
+            tsv_fh.write('\t'.join(['Genome', 'Num bases covered',
+                                    'Frac bases covered', 'Average coverage/depth']) + '\n')
+            frac = covered / genome_length if genome_length else 0
+            avg = depth / genome_length if genome_length else 0
+            tsv_fh.write('\t'.join([genome, str(covered), f'{frac:.4f}', f'{avg:.4f}']) + '\n')
+
+        log.info(f'Tiled {num_probes} distinct probes for {genome}')
+    except Exception as e:
+        log.error(f'Tiling probes for "{fasta_file}": {e}')
+        raise e
+    else:
+        return num_probes
@@ -1,14 +1,36 @@
 import os
 import re
 import shutil
+import time
+import random
 import tempfile
-from subprocess import run, CalledProcessError, STDOUT, PIPE
+import pickle
+import itertools
+from subprocess import run, Popen, CalledProcessError, STDOUT, PIPE
 import csv
 import gzip
+from functools import partial
+from multiprocessing.pool import ThreadPool
 
 from .log import log
 from .abspath import AbsPath as Path
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
 
 def pct_gc(seq, points=2):
     """return percent GC of sequence (2 decimal points)"""
@@ -16,11 +38,76 @@ def pct_gc(seq, points=2):
     return round((seq.count('G') + seq.count('C')) / len(seq) * 100, points)
 
 
+def pct_gc_batch(seqs, points=2):
+    """return list of percent GC of each sequence in 'seqs' (2 decimal points),
+    counted in one numpy pass over all of them, and rounded as in 'pct_gc'.
+    'seqs' is list of str, or numpy array of fixed-length seqs: either 2-D
+    of bytes (uint8) per base, or 1-D of bytes ('S') per seq.
+    Falls back to 'pct_gc' per seq if numpy is not available.
+    """
+    if np is None:
+        return [ pct_gc(seq, points) for seq in seqs ]
+    if len(seqs) == 0:
+        return []
+
+    gc_bases = np.zeros(256, dtype=bool)
+    gc_bases[list(b'GCgc')] = True
+
+    if isinstance(seqs, np.ndarray):
+        bases = seqs.view(np.uint8).reshape(len(seqs), -1) if seqs.dtype.kind == 'S' else seqs
+        lengths = np.full(len(bases), bases.shape[1], dtype=np.int64)
+        gc_counts = gc_bases[bases].sum(axis=1)
+    else:
+        lengths = np.fromiter((len(seq) for seq in seqs), dtype=np.int64, count=len(seqs))
+        if not lengths.all():
+            raise ZeroDivisionError('GC% of empty sequence!')
+        bases = np.frombuffer(''.join(seqs).encode('ascii'), dtype=np.uint8)
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        gc_counts = np.add.reduceat(gc_bases[bases].astype(np.int64), offsets)
+
+    """same float ops as pct_gc; python round() of each, to match it exactly"""
+    pcts = gc_counts / lengths * 100
+    return [ round(pct, points) for pct in pcts.tolist() ]
+
+
+def reservoir_sample(items, k, rng=random):
+    """Return list of 'k' items chosen at random from iterable 'items' in a
+    single pass, holding only k items (reservoir sampling, "algorithm R").
+    Chosen items are returned in the order they came in 'items'.
+    Pass 'rng' as a seeded random.Random for reproducible samples.
+    """
+    reservoir = []
+    for num, item in enumerate(items):
+        if num < k:
+            reservoir.append((num, item))
+        else:
+            pick = rng.randint(0, num)
+            if pick < k:
+                reservoir[pick] = (num, item)
+    return [ item for num, item in sorted(reservoir, key=lambda r: r[0]) ]
+
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def is_gzip(filepath):
+    """Is file gzip (or bgzip) compressed? by its leading magic bytes"""
+    with open(filepath, 'rb') as fh:
+        return fh.read(2) == GZIP_MAGIC
+
+
+def open_text(filepath):
+    """Open text file for reading, decompressing it if gzip'd (or bgzip'd)"""
+    if is_gzip(filepath):
+        return gzip.open(filepath, 'rt')
+    return open(filepath, 'r')
+
+
 def read_fasta(fasta_file):
-    """Yield generator of header, seq lines in fasta file."""
+    """Yield generator of header, seq lines in fasta file (may be gzip'd)."""
     name, seq = None, []
     try:
-        with open(fasta_file, "r") as fh:
+        with open_text(fasta_file) as fh:
             for line in fh:
                 line = line.rstrip()
                 if line.startswith(">"):
@@ -78,23 +165,114 @@ def replace_spaces(filepath, replace='_'):
         return filepath
 
 
+def transform_fasta(src_file, dest_fh, header_prefix='', space_repl='_', chunk_size=1 << 20):
+    """Copy fasta 'src_file' (may be gzip'd) into open binary 'dest_fh' in a
+    single streaming pass (of 'chunk_size' byte chunks): prepending 'header_prefix'
+    onto each header line (after its '>'), and replacing all spaces with 'space_repl';
+    the equivalent of a copy, 'sed_inplace' of headers and 'replace_spaces'.
+    Return number of bytes written.
+    """
+    try:
+        space, repl = b' ', space_repl.encode()
+        prefix = header_prefix.encode().replace(space, repl)
+        written, line_start = 0, True
+        opener = gzip.open if is_gzip(src_file) else open
+        with opener(src_file, 'rb') as src:
+            for chunk in iter(lambda: src.read(chunk_size), b''):
+                chunk = chunk.replace(space, repl)
+                if prefix:
+                    chunk = chunk.replace(b'\n>', b'\n>' + prefix)
+                    if line_start and chunk.startswith(b'>'): # header split over chunks
+                        chunk = b'>' + prefix + chunk[1:]
+                line_start = chunk.endswith(b'\n')
+                dest_fh.write(chunk)
+                written += len(chunk)
+    except Exception as e:
+        log.error(f'Error transforming fasta "{src_file}": {e.args}')
+        raise e
+    else:
+        return written
+
+
+def _copy_fd_kernel(in_fd, out_fd, size):
+    """Copy 'size' bytes from start of in_fd to the position of out_fd within
+    the kernel, by os.copy_file_range else os.sendfile, where available.
+    Return number of bytes copied (less than size if unsupported).
+    """
+    copied = 0
+    for copier in ('copy_file_range', 'sendfile'):
+        if not hasattr(os, copier):
+            continue
+        try:
+            while copied < size:
+                if copier == 'copy_file_range':
+                    sent = os.copy_file_range(in_fd, out_fd, size - copied, copied)
+                else:
+                    sent = os.sendfile(out_fd, in_fd, copied, size - copied)
+                if not sent:
+                    break
+                copied += sent
+            return copied
+        except OSError as e:
+            log.debug(f'No {copier} for this file ({e}); trying next way to copy.')
+    return copied
+
+
+def copy_file_into(src_file, dest_fh, chunk_size=1 << 20):
+    """Append contents of 'src_file' onto open binary file 'dest_fh' (not
+    opened in append mode, which the kernel copy refuses), decompressing it in
+    chunks if gzip'd, else copied kernel-side if possible, else in chunks.
+    Return number of bytes written.
+    """
+    if is_gzip(src_file):
+        start_pos = dest_fh.tell()
+        with gzip.open(src_file, 'rb') as src:
+            shutil.copyfileobj(src, dest_fh, chunk_size)
+        return dest_fh.tell() - start_pos
+
+    with open(src_file, 'rb') as src:
+        size = os.fstat(src.fileno()).st_size
+        dest_fh.flush()
+        copied = _copy_fd_kernel(src.fileno(), dest_fh.fileno(), size)
+        dest_fh.seek(0, os.SEEK_END) # sync after writes made beneath it
+        if copied < size:
+            src.seek(copied)
+            shutil.copyfileobj(src, dest_fh, chunk_size)
+    return size
+
+
+def cat_files(src_files, destfile, append=False):
+    """cat all src_files into destfile (gzip'd ones decompressed), streaming
+    each without reading it whole into memory. Append to destfile if 'append'.
+    Return number of bytes written.
+    """
+    try:
+        start = time.perf_counter()
+        nbytes = 0
+        open_mode = 'r+b' if append and os.path.exists(destfile) else 'wb'
+        with open(destfile, open_mode) as dest:
+            dest.seek(0, os.SEEK_END)
+            for src in src_files:
+                nbytes += copy_file_into(src, dest)
+        secs = time.perf_counter() - start
+        rate = nbytes / secs if secs else 0
+        log.info(f'Wrote {nbytes} bytes of {len(src_files)} files into {destfile}'
+                 f' in {secs:.2f}s ({rate:.0f} bytes/sec)')
+    except Exception as e:
+        log.error(f'Error concatenating into "{destfile}": {e.args}')
+        raise e
+    else:
+        return nbytes
+
+
 def concatenate_files(filepath, destfile, suffix='', clobber=False):
     """cat all files into single new destfile, appending to it if not 'clobber'"""
     log.info('in function concatenate_files')
     try:
         fpath = Path(filepath)
-        dests = [f for f in fpath.glob('*'+suffix)
-                  if destfile not in f.name]
-        if clobber:
-            try:
-                os.remove(destfile)
-            except FileNotFoundError:
-                pass
-
-        with open(destfile, mode='a') as dest:
-            for b in dests:
-                with open(b) as bff:
-                    dest.write(bff.read())
+        dests = sorted(f for f in fpath.glob('*'+suffix)
+                       if os.path.basename(destfile) not in f.name)
+        cat_files(dests, destfile, append=not clobber)
     except Exception as e:
         log.error(f'Error: {e.args}')
         raise e
@@ -131,6 +309,36 @@ def run_cmd(cmd, only_stdout=False):
         return output
 
 
+def iter_cmd_lines(cmd):
+    """run the passed cmd using subprocess.Popen; yield each line of its
+       stdout (sans EOL) as it arrives, or raise a CalledProcessError.
+       Stderr is spooled to a temp file, and logged if the cmd fails.
+    """
+    try:
+        log.debug(f'Streaming subprocess cmd "{cmd}"')
+        with tempfile.TemporaryFile() as errfh:
+            with Popen(cmd, stdout=PIPE, stderr=errfh, encoding='UTF-8') as proc:
+                try:
+                    for line in proc.stdout:
+                        yield line.rstrip('\n')
+                except GeneratorExit:
+                    proc.kill()
+                    raise
+            if proc.returncode:
+                errfh.seek(0)
+                errors = errfh.read().decode('UTF-8', errors='replace')
+                raise CalledProcessError(proc.returncode, cmd, output=errors)
+    except CalledProcessError as e:
+        log.error(f'From command: {e.cmd}')
+        log.error(e.output)
+        raise e
+    except GeneratorExit:
+        raise
+    except Exception as e:
+        log.error(f'Error: {e}')
+        raise e
+
+
 def load_csv_data(csv_file, fields=None, skip_rows=None,
               delim=',', quotechar='"', dialect='unix'):
     """yield row dicts from csv_file using DictReader
@@ -208,7 +416,7 @@ def write_csv_dict(csv_file, fieldnames=[], values=[],
                                     extrasaction='ignore')
 
             if not skip_header:
-                og.info(f'Writing header to {csv_file}')
+                log.info(f'Writing header to {csv_file}')
                 writer.writeheader()
 
             if values:
@@ -260,6 +468,129 @@ def write_out_csv(csv_file, values:list, append=True, quoting=False,
         raise e
 
 
+def iter_write_csv(csv_file, rows, header=None, append=False, quoting=False,
+                   delim=',', dialect='unix'):
+    """write each row of iterable 'rows' in csv format to outfile as it is
+    passed through, yielding the row on unchanged.
+    Rows is iterable of lists, e.g. a generator of records being streamed
+    elsewhere (database, etc). Header (list of field names) is written first.
+    """
+    try:
+        open_mode = 'a' if append else 'w'
+        quote_when = csv.QUOTE_NONE if not quoting else csv.QUOTE_ALL
+
+        with open(csv_file, open_mode) as csvout:
+            writer = csv.writer(csvout,
+                                delimiter=delim,
+                                dialect=dialect,
+                                quoting=quote_when)
+            log.info(f'Streaming data to {csv_file}')
+            if header:
+                writer.writerow(header)
+            for row in rows:
+                writer.writerow(row)
+                yield row
+    except csv.Error as e:
+        log.error(f'Error writing CSV file {csv_file}: {e.args}')
+        raise e
+    except Exception as e:
+        log.error(f'Error writing CSV file {e.args}')
+        raise e
+
+
+def spool_rows(rows, chunk_rows=10000, spool_dir=None):
+    """Consume iterable 'rows' into an unnamed temporary file (in spool_dir),
+    pickled in chunks of 'chunk_rows', then return a generator of them read
+    back in order; so all rows of a slow source (e.g. streamed from blastn)
+    are in hand before they are written elsewhere, without holding them all
+    in memory.
+    """
+    spool_fh = tempfile.TemporaryFile(dir=spool_dir)
+    try:
+        for chunk in iter(lambda: list(itertools.islice(rows, int(chunk_rows))), []):
+            pickle.dump(chunk, spool_fh, pickle.HIGHEST_PROTOCOL)
+        spool_fh.seek(0)
+    except Exception as e:
+        spool_fh.close()
+        log.error(f'Error spooling rows: {e}')
+        raise e
+
+    def read_spool():
+        with spool_fh:
+            while True:
+                try:
+                    chunk = pickle.load(spool_fh)
+                except EOFError:
+                    return
+                yield from chunk
+    return read_spool()
+
+
+"""arrow types of sqlite column datatypes (others are string)"""
+ARROW_TYPES = dict(TEXT='string', REAL='double', INTEGER='int64', BOOLEAN='bool')
+
+
+def iter_write_arrow(out_file, rows, header, col_types=None, fmt='parquet',
+                     dict_cols=('sseqid',), batch_rows=65536):
+    """write each row of iterable 'rows' to columnar 'out_file' as it is
+    passed through, yielding the row on unchanged (as 'iter_write_csv'),
+    in record batches of 'batch_rows'.
+    Format 'fmt' is 'parquet', or 'arrow' (IPC file). Columns are named by
+    'header', typed by dict 'col_types' {field: sqlite datatype}; any in
+    'dict_cols' are dictionary-encoded. Short rows are padded with nulls.
+    Requires module 'pyarrow'.
+    """
+    if pa is None:
+        raise ImportError(f'Module "pyarrow" is required to write {fmt} files!')
+    if fmt not in ('parquet', 'arrow'):
+        raise ValueError(f'Unknown columnar format "{fmt}"!')
+    try:
+        col_types = col_types or {}
+        value_types = [ pa.type_for_alias(ARROW_TYPES.get(str(col_types.get(col, '')).upper(),
+                                                          'string'))
+                        for col in header ]
+        schema = pa.schema([ pa.field(col, pa.dictionary(pa.int32(), vtype))
+                             if col in dict_cols else pa.field(col, vtype)
+                             for col, vtype in zip(header, value_types) ])
+        """one dictionary per column across batches, so each extends the last"""
+        dict_codes = { col: {} for col in header if col in dict_cols }
+
+        def record_batch(batch):
+            arrays = []
+            for num, (col, vtype) in enumerate(zip(header, value_types)):
+                values = [ row[num] if num < len(row) else None for row in batch ]
+                if col in dict_codes:
+                    codes = dict_codes[col]
+                    indices = [ None if v is None else codes.setdefault(v, len(codes))
+                                for v in values ]
+                    arrays.append(pa.DictionaryArray.from_arrays(
+                        pa.array(indices, type=pa.int32()),
+                        pa.array(list(codes), type=pa.string()).cast(vtype)))
+                else:
+                    arrays.append(pa.array(values).cast(vtype))
+            return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+        if fmt == 'parquet':
+            writer = pq.ParquetWriter(out_file, schema)
+        else:
+            writer = pa.ipc.new_file(out_file, schema,
+                                     options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+        log.info(f'Streaming data to {out_file}')
+        with writer:
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= batch_rows:
+                    writer.write_batch(record_batch(batch))
+                    batch = []
+                yield row
+            if batch:
+                writer.write_batch(record_batch(batch))
+    except Exception as e:
+        log.error(f'Error writing {fmt} file {out_file}: {e.args}')
+        raise e
+
+
 def write_out_file(contents, filename, mode='w'):
     """Write contents to outfile directly.
     Default mode is truncate/create new file; pass mode='a' if append to existing.
@@ -274,14 +605,15 @@ def write_out_file(contents, filename, mode='w'):
         return filename
 
 
-def gzip_compress(file_in, file_out=None, rm_file_in=True):
-    """gzip 'file_in', optionally remove it, return filename of file_out."""
+def gzip_compress(file_in, file_out=None, rm_file_in=True, level=9):
+    """gzip 'file_in' at compression 'level', optionally remove it,
+    return filename of file_out."""
     try:
         if not file_out:
             file_out = '.'.join([file_in, 'gz'])
         with open(file_in, 'rb') as fh_in:
-            with gzip.open(file_out, 'wb') as fh_out:
-                shutil.copyfileobj(fh_in, fh_out)
+            with gzip.open(file_out, 'wb', compresslevel=int(level)) as fh_out:
+                shutil.copyfileobj(fh_in, fh_out, 1 << 20)
         if os.access(file_out, os.W_OK) and rm_file_in:
             os.remove(file_in)
     except Exception as e:
@@ -291,7 +623,46 @@ def gzip_compress(file_in, file_out=None, rm_file_in=True):
         return file_out
 
 
-def tidy_up_files(fileglob, fdir=None, keep=True, compress=True):
+def zstd_compress(file_in, file_out=None, rm_file_in=True, level=3):
+    """zstd compress 'file_in' at compression 'level', optionally remove it,
+    return filename of file_out. Requires module 'zstandard'."""
+    try:
+        if not file_out:
+            file_out = '.'.join([file_in, 'zst'])
+        with open(file_in, 'rb') as fh_in:
+            with open(file_out, 'wb') as fh_out:
+                zstandard.ZstdCompressor(level=int(level)).copy_stream(fh_in, fh_out)
+        if os.access(file_out, os.W_OK) and rm_file_in:
+            os.remove(file_in)
+    except Exception as e:
+        log.error(f'Error: {e}')
+        raise e
+    else:
+        return file_out
+
+
+def compress_file(file_in, codec='gzip', level=None):
+    """Compress 'file_in' (then remove it) using 'codec' ('gzip' or 'zstd')
+    at 'level' (codec's default if None), return filename of compressed file.
+    """
+    if codec == 'zstd':
+        return zstd_compress(file_in, level=3 if level in (None, '') else level)
+    elif codec != 'gzip':
+        raise ValueError(f'Unknown compression codec "{codec}"!')
+    return gzip_compress(file_in, level=9 if level in (None, '') else level)
+
+
+def remove_file(file_in):
+    """Remove file, if it exists (as 'rm -f'); return its filename"""
+    try:
+        os.remove(file_in)
+    except FileNotFoundError:
+        pass
+    return file_in
+
+
+def tidy_up_files(fileglob, fdir=None, keep=True, compress=True, workers=1,
+                  codec='gzip', level=None):
     """Tidy up the files: either remove or compress them.
     This will only remove/compress files, not directoroes.
 
@@ -300,28 +671,33 @@ def tidy_up_files(fileglob, fdir=None, keep=True, compress=True):
         OR a list of explicit paths relative to fdir
     :param fdir: current dir if not passed
     :param keep: don't remove them
-    :param compress: if keeping, compress the files using gzip
+    :param compress: if keeping, compress the files (see 'compress_file')
+    :param workers: number of files compressed at a time, in threads
+    :param codec: compression codec, 'gzip' or 'zstd'
+    :param level: compression level; codec's default if not passed
     """
     try:
         if not fdir:
             fdir = os.getcwd()
 
-        if '*' in fileglob:
-            filelist = Path(fdir).glob(fileglob)
-        elif type(fileglob) in [list, tuple]:
+        if type(fileglob) in [list, tuple]:
             filelist = [Path(fdir)/fh for fh in fileglob]
+        elif '*' in fileglob:
+            filelist = list(Path(fdir).glob(fileglob))
         else: # single, explicit str
-            filelist = Path(fdir)/fileglob
+            filelist = [Path(fdir)/fileglob]
 
         output = []
         if not keep:
-            for fh in filelist:
-                cmd = ['rm','-f', fh.abspath]
-                output.append(run_cmd(cmd))
+            output = [ remove_file(fh.abspath) for fh in filelist ]
             return output
-        elif compress:
-            for fh in filelist:
-                output.append(gzip_compress(fh.abspath))
+        elif compress and filelist:
+            if codec == 'zstd' and zstandard is None:
+                log.warning('Module "zstandard" not available; compressing with gzip.')
+                codec, level = 'gzip', None
+            compressor = partial(compress_file, codec=codec, level=level)
+            with ThreadPool(max(min(int(workers), len(filelist)), 1)) as pool:
+                output = pool.map(compressor, [ fh.abspath for fh in filelist ])
     except ValueError as e:
         log.error(f'ValueError tidying files (bad glob?): {e}')
     except Exception as e:
@@ -330,4 +706,3 @@ def tidy_up_files(fileglob, fdir=None, keep=True, compress=True):
     else:
         log.debug(f'Tidied up files matching "{fileglob}"')
         return output
-